@@ -14,7 +14,7 @@ getLogger('tornado').addHandler(NullHandler())
 from .commands.args import COMMAND, make_parser, PROGNAME, HELP, DEV, DIARY, FIT, \
     PACKAGE_FIT_PROFILE, ACTIVITIES, NO_OP, DATABASE, CONSTANTS, SHOW_SCHEDULE, MONITOR, GARMIN, \
     UNLOCK, DUMP, FIX_FIT, CH2_VERSION, JUPYTER, KIT, WEB, IMPORT, THUMBNAIL, CHECK, SEARCH, VALIDATE, \
-    DB_VERSION, UPLOAD, PROCESS, DELETE, SPARKLINE
+    DB_VERSION, UPLOAD, PROCESS, DELETE, SPARKLINE, SRTM
 from .commands.process import process
 from .commands.upload import upload
 from .commands.constants import constants
@@ -29,6 +29,7 @@ from .commands.kit import kit
 from .commands.package_fit_profile import package_fit_profile
 from .commands.search import search
 from .commands.show_schedule import show_schedule
+from .commands.srtm import srtm
 from .commands.thumbnail import thumbnail
 from .commands.web import web
 from .lib.log import make_log_from_args
@@ -63,6 +64,7 @@ COMMANDS = {CONSTANTS: constants,
             SEARCH: search,
             SHOW_SCHEDULE: show_schedule,
             SPARKLINE: sparkline,
+            SRTM: srtm,
             THUMBNAIL: thumbnail,
             UPLOAD: upload,
             VALIDATE: validate,
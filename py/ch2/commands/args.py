@@ -42,6 +42,7 @@ PACKAGE_FIT_PROFILE = 'package-fit-profile'
 SEARCH = 'search'
 SHOW_SCHEDULE = 'show-schedule'
 SPARKLINE = 'sparkline'
+SRTM = 'srtm'
 TEXT = 'text'
 THUMBNAIL = 'thumbnail'
 UNLOCK = 'unlock'
@@ -66,9 +67,11 @@ ALL_FIELDS = 'all-fields'
 ARG = 'arg'
 BACKUP = 'backup'
 BATCH = 'batch'
+BBOX = 'bbox'
 BORDER = 'border'
 CHANGE = 'change'
 CHECK = 'check'
+CHECKPOINTS = 'checkpoints'
 CMD = 'cmd'
 COMPACT = 'compact'
 COMPONENT = 'component'
@@ -115,6 +118,7 @@ IMAGE_DIR = 'image-dir'
 INTERNAL = 'internal'
 INVERT = 'invert'
 ITEM = 'item'
+JOBS = 'jobs'
 K = 'k'
 KARG = 'karg'
 LABEL = 'label'
@@ -129,6 +133,7 @@ LOG_DIR = 'log-dir'
 LONGITUDE = 'longitude'
 LIST = 'list'
 M, MESSAGE = 'm', 'message'
+MARGIN = 'margin'
 MATCH = 'match'
 MAX_BACK_CNT = 'max-back-cnt'
 MAX_COLUMNS = 'max-columns'
@@ -152,6 +157,7 @@ NOT = 'not'
 NOTEBOOKS = 'notebooks'
 NOTEBOOK_DIR = 'notebook-dir'
 O, OUTPUT = 'o', 'output'
+OUTPUT_DIR = 'output-dir'
 OWNER = 'owner'
 PATH = 'path'
 PATTERN = 'pattern'
@@ -171,6 +177,7 @@ READ_ONLY = 'read-only'
 REBUILD = 'rebuild'
 RECORDS = 'records'
 REMOVE = 'remove'
+REPORT = 'report'
 RETIRE = 'retire'
 ROOT = 'root'
 RUN = 'run'
@@ -495,6 +502,10 @@ def make_parser(with_noop=False):
         cmd.add_argument(mm(MAX_DELTA_T), type=float, metavar='S',
                          help='validate seconds between timestamps (and non-decreasing)')
         cmd.add_argument(mm(NAME), action='store_true', help='print file name')
+        cmd.add_argument(mm(JOBS), type=int, metavar='N', default=1,
+                         help='number of processes used to read multiple files (output is in input order)')
+        cmd.add_argument(mm(CHECKPOINTS), metavar='DIR',
+                         help='directory for checkpoint indices (so that --after-bytes starts directly)')
         cmd.add_argument(PATH, metavar='PATH', nargs='+', help='path to fit file')
 
     def add_fit_grep(cmd):
@@ -534,12 +545,18 @@ def make_parser(with_noop=False):
     fix_fit.add_argument(m(W), mm(WARN), action='store_true', help='additional warning messages')
     fix_fit_output = fix_fit.add_argument_group(title='output (default hex to stdout)').add_mutually_exclusive_group()
     fix_fit_output.add_argument(m(O), mm(OUTPUT), help='output file for fixed data (otherwise, stdout)')
+    fix_fit_output.add_argument(mm(OUTPUT_DIR), metavar='DIR',
+                                help='output directory for fixed data (batch mode, same file names)')
     fix_fit_output.add_argument(mm(DISCARD), action='store_true', help='discard output (otherwise, stdout)')
     fix_fit_output.add_argument(mm(RAW), action='store_true', help='raw binary to stdout (otherwise, hex encoded)')
     fix_fit_output.add_argument(mm(NAME_BAD), action='store_false', dest=NAME, default=None,
                                 help='print file name if bad')
     fix_fit_output.add_argument(mm(NAME_GOOD), action='store_true', dest=NAME, default=None,
                                 help='print file name if good')
+    fix_fit_batch = fix_fit.add_argument_group(title='batch (directories in PATH are expanded)')
+    fix_fit_batch.add_argument(mm(JOBS), type=int, metavar='N', default=1,
+                               help='number of processes used to fix multiple files')
+    fix_fit_batch.add_argument(mm(REPORT), metavar='PATH', help='write a JSON report on each file')
     fix_fit_process = fix_fit.add_argument_group(title='processing (default disabled)')
     fix_fit_process.add_argument(mm(ADD_HEADER), action='store_true', help='preprend a new header')
     fix_fit_stage = fix_fit_process.add_mutually_exclusive_group()
@@ -587,6 +604,17 @@ def make_parser(with_noop=False):
     sparkline.add_argument(mm(SECTOR), type=int, metavar='ID', help='restrict to single sector')
     sparkline.add_argument(mm(ACTIVITY), type=int, metavar='ID', help='mark activity')
 
+    srtm = commands.add_parser(SRTM, help='prepare SRTM elevation tiles for an area')
+    srtm_area = srtm.add_mutually_exclusive_group(required=True)
+    srtm_area.add_argument(mm(BBOX), type=float, nargs=4, metavar=('LAT', 'LON', 'LAT', 'LON'),
+                           help='opposite corners of the area')
+    srtm_area.add_argument(mm(ACTIVITIES), action='store_true', help='the area around all activities')
+    srtm.add_argument(mm(MARGIN), type=float, metavar='DEG', default=0.5,
+                      help='degrees added around each activity centre (default 0.5)')
+    srtm.add_argument(mm(DIR), metavar='DIR', help='SRTM directory (otherwise, from constants)')
+    srtm.add_argument(mm(JOBS), type=int, metavar='N', default=1, help='number of processes used')
+    srtm.add_argument(mm(FORCE), action='store_true', help='convert tiles even if already converted')
+
     if with_noop:
         noop = commands.add_parser(NO_OP, help='used within jupyter (no-op from cmd line)')
 
@@ -1,11 +1,20 @@
 
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import ExitStack
+from functools import partial
+from io import StringIO
 from logging import getLogger
+from os import makedirs
+from os.path import join, exists
+from sys import stdout
 
 from .args import PATH, SUB_COMMAND, AFTER_BYTES, LIMIT_BYTES, AFTER_RECORDS, LIMIT_RECORDS, NAME, WIDTH, GREP, \
     RECORDS, ALL_FIELDS, INTERNAL, ALL_MESSAGES, MESSAGE, FIELD, VALIDATE, MAX_DELTA_T, WARN, TABLES, PATTERN, \
-    COMPACT, CONTEXT, NOT, MATCH, CSV, TOKENS, FIELDS
+    COMPACT, CONTEXT, NOT, MATCH, CSV, TOKENS, FIELDS, JOBS, CHECKPOINTS
 from ..common.args import no
-from ..fit.profile.profile import read_fit
+from ..common.io import file_hash
+from ..fit.format.stream import Checkpoints, build_checkpoints
+from ..fit.profile.profile import read_fit, read_profile
 from ..fit.summary import summarize_records, summarize_tables, summarize_grep, summarize_csv, summarize_tokens, \
     summarize_fields
 from ..common.io import terminal_width
@@ -41,6 +50,16 @@ or redirect stderr elsewhere).
 
 Will list file names that contain cycling data.
 
+    > ch2 -v 0 fit csv --jobs 8 directory/**/*.fit
+
+Will read the files using 8 processes (output is in the same order as the files are given).
+
+    > ch2 -v 0 fit records --checkpoints /tmp/ckpt --after-bytes 100000000 huge.fit
+
+Will read the file once to build an index of checkpoints (saved in /tmp/ckpt) and then start reading
+from the last checkpoint before the given offset.  Later calls with the same directory use the saved
+index and so start directly.
+
     > ch2 fit grep -p PATTERN -- FILE
 
 You may need a `--` between patterns and file paths so that the argument parser can decide where patterns
@@ -49,66 +68,139 @@ finish and paths start.
 
     args = config.args
     format = args[SUB_COMMAND]
-    after_bytes = args[AFTER_BYTES]
-    limit_bytes = args[LIMIT_BYTES]
-    after_records = args[AFTER_RECORDS]
-    limit_records = args[LIMIT_RECORDS]
-    warn = args[WARN]
-    no_validate = args[no(VALIDATE)]
-    max_delta_t = args[MAX_DELTA_T]
 
     # todo - can this be handled by argparse?
-    if (after_records or limit_records != -1) and (after_bytes or limit_bytes != -1):
+    if (args[AFTER_RECORDS] or args[LIMIT_RECORDS] != -1) and (args[AFTER_BYTES] or args[LIMIT_BYTES] != -1):
         raise Exception('Constrain either records or bytes, not both')
 
-    for file_path in args[PATH]:
-
-        name_file = file_path if args[NAME] else None
-        if name_file and format != GREP:
-            print()
-            print(name_file)
-
-        data = read_fit(file_path)
-
-        if format == RECORDS:
-            summarize_records(data,
-                              all_fields=args[ALL_FIELDS], all_messages=args[ALL_MESSAGES],
-                              internal=args[INTERNAL], after_bytes=after_bytes, limit_bytes=limit_bytes,
-                              after_records=after_records, limit_records=limit_records,
-                              record_names=args[MESSAGE], field_names=args[FIELD],
-                              warn=warn, no_validate=no_validate, max_delta_t=max_delta_t,
-                              width=args[WIDTH] or terminal_width())
-        elif format == TABLES:
-            summarize_tables(data,
-                             all_fields=args[ALL_FIELDS], all_messages=args[ALL_MESSAGES],
-                             internal=args[INTERNAL], after_bytes=after_bytes, limit_bytes=limit_bytes,
-                             after_records=after_records, limit_records=limit_records,
-                             record_names=args[MESSAGE], field_names=args[FIELD],
-                             warn=warn, no_validate=no_validate, max_delta_t=max_delta_t,
-                             width=args[WIDTH] or terminal_width())
-        elif format == CSV:
-            summarize_csv(data,
-                          internal=args[INTERNAL], after_bytes=after_bytes, limit_bytes=limit_bytes,
-                          after_records=after_records, limit_records=limit_records,
-                          record_names=args[MESSAGE], field_names=args[FIELD],
-                          warn=warn, max_delta_t=max_delta_t)
-        elif format == GREP:
-            summarize_grep(data, args[PATTERN],
-                           after_bytes=after_bytes, limit_bytes=limit_bytes,
-                           after_records=after_records, limit_records=limit_records,
-                           warn=warn, no_validate=no_validate, max_delta_t=max_delta_t,
-                           width=args[WIDTH] or terminal_width(),
-                           name_file=name_file, match=args[MATCH], compact=args[COMPACT],
-                           context=args[CONTEXT], invert=args[NOT])
-        elif format == TOKENS:
-            summarize_tokens(data,
-                             after_bytes=after_bytes, limit_bytes=limit_bytes,
-                             after_records=after_records, limit_records=limit_records,
-                             warn=warn, no_validate=no_validate, max_delta_t=max_delta_t)
-        elif format == FIELDS:
-            summarize_fields(data,
-                             after_bytes=after_bytes, limit_bytes=limit_bytes,
-                             after_records=after_records, limit_records=limit_records,
-                             warn=warn, no_validate=no_validate, max_delta_t=max_delta_t)
+    options = dict(format=format,
+                   after_bytes=args[AFTER_BYTES], limit_bytes=args[LIMIT_BYTES],
+                   after_records=args[AFTER_RECORDS], limit_records=args[LIMIT_RECORDS],
+                   warn=args[WARN], no_validate=args[no(VALIDATE)], max_delta_t=args[MAX_DELTA_T],
+                   name=args[NAME], checkpoints=args[CHECKPOINTS])
+    if format in (RECORDS, TABLES, CSV):
+        options.update(internal=args[INTERNAL], record_names=args[MESSAGE], field_names=args[FIELD])
+    if format in (RECORDS, TABLES):
+        options.update(all_fields=args[ALL_FIELDS], all_messages=args[ALL_MESSAGES])
+    if format in (RECORDS, TABLES, GREP):
+        options.update(width=args[WIDTH] or terminal_width())
+    if format == GREP:
+        options.update(grep=args[PATTERN], match=args[MATCH], compact=args[COMPACT], context=args[CONTEXT],
+                       invert=args[NOT])
+
+    paths, jobs = args[PATH], args[JOBS]
+    if jobs > 1 and len(paths) > 1:
+        # the profile is unpickled once per worker; map returns results in input order
+        with ProcessPoolExecutor(max_workers=jobs, initializer=read_profile) as executor:
+            for output in executor.map(partial(summarize_path, **options), paths):
+                print(output, end='')
+    else:
+        for path in paths:
+            summarize_path(path, output=stdout, **options)
+
+
+def summarize_path(file_path, format=None, name=False,
+                   after_bytes=None, limit_bytes=-1, after_records=None, limit_records=-1,
+                   warn=False, no_validate=False, max_delta_t=None,
+                   internal=False, record_names=None, field_names=None, all_fields=False, all_messages=False,
+                   width=None, grep=None, match=-1, compact=False, context=False, invert=False,
+                   checkpoints=None, output=None):
+    '''
+    Display a single file.  If output is None, the text is returned as a string (for use in a worker process).
+    If checkpoints is a directory then the file is streamed, starting near after_bytes (see stream.py).
+    '''
+
+    buffer = StringIO() if output is None else None
+    output = buffer or output
+
+    name_file = file_path if name else None
+    if name_file and format != GREP:
+        print(file=output)
+        print(name_file, file=output)
+
+    with ExitStack() as stack:
+        if checkpoints and format != GREP:
+            data = stack.enter_context(open(file_path, 'rb'))
+            checkpoints = read_checkpoints(file_path, checkpoints, max_delta_t=max_delta_t)
         else:
-            raise Exception('Bad format: %s' % format)
+            data, checkpoints = read_fit(file_path), None
+        summarize_data(data, format=format, name_file=name_file,
+                       after_bytes=after_bytes, limit_bytes=limit_bytes,
+                       after_records=after_records, limit_records=limit_records,
+                       warn=warn, no_validate=no_validate, max_delta_t=max_delta_t,
+                       internal=internal, record_names=record_names, field_names=field_names,
+                       all_fields=all_fields, all_messages=all_messages, width=width,
+                       grep=grep, match=match, compact=compact, context=context, invert=invert,
+                       checkpoints=checkpoints, output=output)
+
+    if buffer:
+        return buffer.getvalue()
+
+
+def read_checkpoints(file_path, dir, max_delta_t=None):
+    '''
+    Read the checkpoints for the file from dir, creating them if necessary.
+    '''
+    path = join(dir, file_hash(file_path) + '.ckpt')
+    if exists(path):
+        log.debug(f'Reading checkpoints from {path}')
+        return Checkpoints.load(path)
+    log.info(f'Building checkpoints for {file_path}')
+    types, messages = read_profile()
+    with open(file_path, 'rb') as input:
+        checkpoints = build_checkpoints(input, types, messages, max_delta_t=max_delta_t)
+    makedirs(dir, exist_ok=True)
+    checkpoints.save(path)
+    return checkpoints
+
+
+def summarize_data(data, format=None, name_file=None,
+                   after_bytes=None, limit_bytes=-1, after_records=None, limit_records=-1,
+                   warn=False, no_validate=False, max_delta_t=None,
+                   internal=False, record_names=None, field_names=None, all_fields=False, all_messages=False,
+                   width=None, grep=None, match=-1, compact=False, context=False, invert=False,
+                   checkpoints=None, output=stdout):
+
+    if format == RECORDS:
+        summarize_records(data,
+                          all_fields=all_fields, all_messages=all_messages,
+                          internal=internal, after_bytes=after_bytes, limit_bytes=limit_bytes,
+                          after_records=after_records, limit_records=limit_records,
+                          record_names=record_names, field_names=field_names,
+                          warn=warn, no_validate=no_validate, max_delta_t=max_delta_t,
+                          checkpoints=checkpoints, width=width, output=output)
+    elif format == TABLES:
+        summarize_tables(data,
+                         all_fields=all_fields, all_messages=all_messages,
+                         internal=internal, after_bytes=after_bytes, limit_bytes=limit_bytes,
+                         after_records=after_records, limit_records=limit_records,
+                         record_names=record_names, field_names=field_names,
+                         warn=warn, no_validate=no_validate, max_delta_t=max_delta_t,
+                         checkpoints=checkpoints, width=width, output=output)
+    elif format == CSV:
+        summarize_csv(data,
+                      internal=internal, after_bytes=after_bytes, limit_bytes=limit_bytes,
+                      after_records=after_records, limit_records=limit_records,
+                      record_names=record_names, field_names=field_names,
+                      warn=warn, max_delta_t=max_delta_t, checkpoints=checkpoints, output=output)
+    elif format == GREP:
+        summarize_grep(data, grep,
+                       after_bytes=after_bytes, limit_bytes=limit_bytes,
+                       after_records=after_records, limit_records=limit_records,
+                       warn=warn, no_validate=no_validate, max_delta_t=max_delta_t,
+                       width=width, name_file=name_file, match=match, compact=compact,
+                       context=context, invert=invert, output=output)
+    elif format == TOKENS:
+        summarize_tokens(data,
+                         after_bytes=after_bytes, limit_bytes=limit_bytes,
+                         after_records=after_records, limit_records=limit_records,
+                         warn=warn, no_validate=no_validate, max_delta_t=max_delta_t, checkpoints=checkpoints,
+                         output=output)
+    elif format == FIELDS:
+        summarize_fields(data,
+                         after_bytes=after_bytes, limit_bytes=limit_bytes,
+                         after_records=after_records, limit_records=limit_records,
+                         warn=warn, no_validate=no_validate, max_delta_t=max_delta_t, checkpoints=checkpoints,
+                         output=output)
+    else:
+        raise Exception('Bad format: %s' % format)
@@ -4,8 +4,9 @@ from sys import stdout, stderr
 
 from .args import PATH, DROP, OUTPUT, SLICES, RAW, WARN, MIN_SYNC_CNT, MAX_RECORD_LEN, MAX_DROP_CNT, MAX_BACK_CNT, \
     MAX_FWD_LEN, DISCARD, FORCE, VALIDATE, ADD_HEADER, HEADER_SIZE, PROTOCOL_VERSION, PROFILE_VERSION, MAX_DELTA_T, \
-    NAME, FIX_HEADER, FIX_CHECKSUM, NAME_BAD, NAME_GOOD, START
+    NAME, FIX_HEADER, FIX_CHECKSUM, NAME_BAD, NAME_GOOD, START, OUTPUT_DIR, JOBS, REPORT
 from ..common.args import mm, no
+from ..fit.batch import batch_fix
 from ..fit.fix import fix
 from ..fit.profile.profile import read_fit
 
@@ -44,6 +45,14 @@ Will attempt to fix the given file (in the test data from git).
     > ch2 fix-fit FILE.FIT --add-header --header-size 14 --slices :14,28: --fix-header --fix-checksum
 
 Will prepend a new 14 byte header, drop the old 14 byte header, and fix the header and checksum values.
+
+    > ch2 fix-fit DIRECTORY --drop --fix-header --fix-checksum --output-dir FIXED --jobs 8 --report report.json
+
+Will attempt to fix all the files in the given directory, in parallel, writing the results to FIXED.
+The report lists, for each file, whether it was good, fixed or failed (and the error).
+In this batch mode (`--output-dir`, `--report` or `--jobs`) a failure does not stop processing.
+Files with the same name (from different directories) are written with an index suffix (eg `NAME-1.fit`).
+Batch mode needs `--output-dir` (or `--discard`, to only report on the files).
     '''
 
     args = config.args
@@ -57,6 +66,16 @@ Will prepend a new 14 byte header, drop the old 14 byte header, and fix the head
     if not args[FORCE]:
         log.warning('%s means that data are not completely parsed' % no(FORCE))
 
+    if args[OUTPUT_DIR] or args[REPORT] or args[JOBS] > 1:
+        if check:
+            raise Exception('Cannot check (%s) in batch mode' % mm(name))
+        if not args[OUTPUT_DIR] and not args[DISCARD]:
+            raise Exception('Batch mode needs %s (or %s to check files without saving the results)' %
+                            (mm(OUTPUT_DIR), mm(DISCARD)))
+        batch_fix(args[PATH], jobs=args[JOBS], output_dir=args[OUTPUT_DIR], report=args[REPORT],
+                  **fix_options(args))
+        return
+
     for path in args[PATH]:
 
         log.info('Input ----------')
@@ -65,14 +84,7 @@ Will prepend a new 14 byte header, drop the old 14 byte header, and fix the head
         log.debug('Read %d bytes' % len(data))
 
         try:
-            data = fix(data, warn=args[WARN],
-                       add_header=args[ADD_HEADER], drop=args[DROP], slices=args[SLICES], start=args[START],
-                       fix_header=args[FIX_HEADER], fix_checksum=args[FIX_CHECKSUM],
-                       force=args[FORCE], validate=args[VALIDATE],
-                       header_size=args[HEADER_SIZE], protocol_version=args[PROTOCOL_VERSION],
-                       profile_version=args[PROFILE_VERSION], min_sync_cnt=args[MIN_SYNC_CNT],
-                       max_record_len=args[MAX_RECORD_LEN], max_drop_cnt=args[MAX_DROP_CNT],
-                       max_back_cnt=args[MAX_BACK_CNT], max_fwd_len=args[MAX_FWD_LEN], max_delta_t=args[MAX_DELTA_T])
+            data = fix(data, **fix_options(args))
         except:
             if check:
                 if not args[NAME]:
@@ -105,3 +117,13 @@ Will prepend a new 14 byte header, drop the old 14 byte header, and fix the head
                     stdout.write(data.hex())
                 log.debug('Wrote %d bytes' % len(data))
 
+
+def fix_options(args):
+    return dict(warn=args[WARN],
+                add_header=args[ADD_HEADER], drop=args[DROP], slices=args[SLICES], start=args[START],
+                fix_header=args[FIX_HEADER], fix_checksum=args[FIX_CHECKSUM],
+                force=args[FORCE], validate=args[VALIDATE],
+                header_size=args[HEADER_SIZE], protocol_version=args[PROTOCOL_VERSION],
+                profile_version=args[PROFILE_VERSION], min_sync_cnt=args[MIN_SYNC_CNT],
+                max_record_len=args[MAX_RECORD_LEN], max_drop_cnt=args[MAX_DROP_CNT],
+                max_back_cnt=args[MAX_BACK_CNT], max_fwd_len=args[MAX_FWD_LEN], max_delta_t=args[MAX_DELTA_T])
@@ -15,7 +15,9 @@ def package_fit_profile(config):
     > ch2 package-fit-profile data/sdk/Profile.xlsx
 
 Parse the global profile and save the structures containing types and messages
-to a pickle file that is distributed with this package.
+to a pickle file that is distributed with this package.  A compact version, in
+which each type and message is loaded only when first used, is also written
+(and is preferred when present).
 
 This command is intended for internal use only.
     '''
@@ -0,0 +1,41 @@
+from logging import getLogger
+
+from .args import BBOX, ACTIVITIES, MARGIN, DIR, JOBS, FORCE
+from ..common.io import clean_path
+from ..sql import Constant
+from ..srtm.file import SRTM1_DIR_CNAME, tile_root
+from ..srtm.prewarm import tiles_for_box, tiles_for_points, prewarm, activity_centres
+
+log = getLogger(__name__)
+
+
+def srtm(config):
+    '''
+## srtm
+
+    > ch2 srtm --bbox -33 -71 -34 -70 --jobs 4
+    > ch2 srtm --activities
+
+Convert the SRTM tiles needed for an area to the local format used for elevation lookups,
+so that later processing does not have to.
+
+The area is either a box (the corners, as latitude and longitude), or the area around the centres of
+all activities in the database (extended by --margin degrees).
+The SRTM directory is taken from the constants unless given with --dir.
+
+Missing tiles are printed (the names of the hgt files) and their download URLs logged.
+    '''
+    args = config.args
+    if args[BBOX] and args[DIR]:
+        # no need for the database
+        dir, tiles = clean_path(args[DIR]), tiles_for_box(*args[BBOX])
+    else:
+        with config.db.session_context() as s:
+            dir = clean_path(args[DIR] or Constant.from_name(s, SRTM1_DIR_CNAME).at(s).value)
+            if args[ACTIVITIES]:
+                tiles = tiles_for_points(activity_centres(s), margin=args[MARGIN])
+            else:
+                tiles = tiles_for_box(*args[BBOX])
+    _, missing = prewarm(dir, tiles, jobs=args[JOBS], force=args[FORCE])
+    for flat, flon in missing:
+        print(tile_root(flat, flon) + '.hgt')
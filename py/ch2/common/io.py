@@ -1,9 +1,11 @@
+from contextlib import contextmanager
 from hashlib import md5
 from logging import getLogger
-from os import makedirs
-from os.path import dirname, normpath, expanduser
+from os import makedirs, replace, remove
+from os.path import dirname, normpath, expanduser, basename
 from pathlib import Path
 from shutil import get_terminal_size
+from tempfile import NamedTemporaryFile
 
 log = getLogger(__name__)
 
@@ -21,6 +23,26 @@ def clean_path(path):
     return normpath(expanduser(path))
 
 
+@contextmanager
+def atomic_write(path, mode='wb'):
+    '''
+    Write to a unique temporary file in the same directory and then rename it to path (atomically),
+    so that a partial file is never read, even when several processes write the same path.
+    '''
+    output = NamedTemporaryFile(mode=mode, dir=dirname(path) or '.', prefix=basename(path) + '.',
+                                suffix='.tmp', delete=False)
+    try:
+        with output:
+            yield output
+        replace(output.name, path)
+    except BaseException:
+        try:
+            remove(output.name)
+        except OSError:
+            pass
+        raise
+
+
 # https://stackoverflow.com/a/3431838
 def file_hash(file_path):
     hash = md5()
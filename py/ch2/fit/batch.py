@@ -0,0 +1,99 @@
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from glob import glob
+from json import dump
+from logging import getLogger
+from os import makedirs
+from os.path import isdir, join, basename, splitext
+from time import perf_counter
+
+from .fix import fix
+from .profile.profile import read_fit, read_profile
+
+log = getLogger(__name__)
+
+'''
+Repair many FIT files (eg a dump from a broken device), in parallel, with a report.
+'''
+
+BAD = 'failed'
+FIXED = 'fixed'
+GOOD = 'good'
+
+
+def expand_paths(paths):
+    '''
+    Replace any directories with the FIT files they contain.
+    '''
+    for path in paths:
+        if isdir(path):
+            yield from sorted(glob(join(path, '*.fit')) + glob(join(path, '*.FIT')))
+        else:
+            yield path
+
+
+def output_names(paths):
+    '''
+    A unique output file name for each path.  Repeated names (eg the same file name in different
+    directories) get an index suffix (-1, -2, ...), in input order.
+    '''
+    names, counts = [], {}
+    for path in paths:
+        name = basename(path)
+        count = counts.get(name, 0)
+        counts[name] = count + 1
+        if count:
+            root, ext = splitext(name)
+            name = '%s-%d%s' % (root, count, ext)
+        names.append(name)
+    return names
+
+
+def fix_path(path, output_path=None, **kargs):
+    '''
+    Fix a single file, writing the result to output_path (if given).  Returns a dict for the report.
+    '''
+    start = perf_counter()
+    entry = {'path': path, 'status': BAD, 'input_bytes': None, 'output_bytes': None,
+             'output_path': None, 'error': None}
+    try:
+        data = read_fit(path)
+        entry['input_bytes'] = len(data)
+        fixed = fix(data, **kargs)
+        entry['output_bytes'] = len(fixed)
+        entry['status'] = GOOD if fixed == data else FIXED
+        if output_path:
+            entry['output_path'] = output_path
+            with open(output_path, 'wb') as output:
+                output.write(fixed)
+    except Exception as e:
+        log.warning('Could not fix %s: %s' % (path, e))
+        entry['error'] = str(e)
+    entry['seconds'] = round(perf_counter() - start, 3)
+    return entry
+
+
+def batch_fix(paths, jobs=1, output_dir=None, report=None, **kargs):
+    '''
+    Fix all paths (directories are expanded), using jobs processes.  Returns a list of dicts (one per file,
+    in input order) which is also written as JSON to report (if given).
+    '''
+    paths = list(expand_paths(paths))
+    if output_dir:
+        makedirs(output_dir, exist_ok=True)
+        output_paths = [join(output_dir, name) for name in output_names(paths)]
+    else:
+        output_paths = [None] * len(paths)
+    fix_one = partial(fix_path, **kargs)
+    if jobs > 1 and len(paths) > 1:
+        # the profile is unpickled once per worker; map returns results in input order
+        with ProcessPoolExecutor(max_workers=jobs, initializer=read_profile) as executor:
+            entries = list(executor.map(fix_one, paths, output_paths))
+    else:
+        entries = [fix_one(path, output_path) for path, output_path in zip(paths, output_paths)]
+    counts = dict((status, sum(entry['status'] == status for entry in entries)) for status in (GOOD, FIXED, BAD))
+    log.info('%d good, %d fixed, %d failed' % (counts[GOOD], counts[FIXED], counts[BAD]))
+    if report:
+        with open(report, 'w') as output:
+            dump({'counts': counts, 'files': entries}, output, indent=2)
+    return entries
@@ -0,0 +1,71 @@
+from logging import getLogger, basicConfig, INFO
+from sys import argv
+from time import perf_counter
+
+from .format.read import parse_data, parse_records
+from .format.tokens import Defined
+from .profile.profile import read_fit, read_profile
+
+log = getLogger(__name__)
+
+'''
+Compare the speed of the different ways of decoding FIT data.
+
+    > python -m ch2.fit.benchmark FILE [FILE ...]
+
+profile - each field parsed through the profile (Message.parse_message).
+compiled - each message parsed with the decoder compiled for the Definition.
+bulk - runs of messages decoded with numpy (see bulk.py).
+'''
+
+
+def profile_records(data, types, messages):
+    state, tokens = parse_data(data, types, messages)
+    for offset, token in tokens:
+        if isinstance(token, Defined):
+            yield token.definition.message.parse_message(token.data, token.definition, token.timestamp,
+                                                         accumulators=token._accumulators)
+        else:
+            yield token.parse_token()
+
+
+def compiled_records(data, types, messages):
+    state, tokens = parse_data(data, types, messages)
+    for offset, token in tokens:
+        yield token.parse_token()
+
+
+def bulk_records(data, types, messages):
+    state, records = parse_records(data, types, messages)
+    for offset, is_user, record in records:
+        yield record
+
+
+DECODERS = {'profile': profile_records, 'compiled': compiled_records, 'bulk': bulk_records}
+
+
+def benchmark(paths, repeat=3, decoders=None):
+    '''
+    Return a map from decoder name to records per second (best of repeat).
+    '''
+    types, messages = read_profile()
+    data = [read_fit(path) for path in paths]
+    results = {}
+    for name in decoders or DECODERS:
+        decoder, best = DECODERS[name], None
+        for _ in range(repeat):
+            start, count = perf_counter(), 0
+            for datum in data:
+                for record in decoder(datum, types, messages):
+                    list(record.data)  # force lazy evaluation
+                    count += 1
+            rate = count / (perf_counter() - start)
+            best = rate if best is None else max(best, rate)
+        results[name] = best
+    return results
+
+
+if __name__ == '__main__':
+    basicConfig(level=INFO)
+    for name, rate in benchmark(argv[1:]).items():
+        log.info(f'{name:>10s}: {rate:.0f} records/s')
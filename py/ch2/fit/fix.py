@@ -4,7 +4,7 @@ from logging import getLogger
 
 import pytz
 
-from .format.tokens import FileHeader, token_factory, Checksum, State
+from .format.tokens import FileHeader, token_factory, Checksum, State, Definition
 from .profile.profile import read_profile
 from ..commands.args import ADD_HEADER, HEADER_SIZE, PROFILE_VERSION, PROTOCOL_VERSION, MIN_SYNC_CNT, \
     MAX_RECORD_LEN, MAX_DROP_CNT, MAX_BACK_CNT, MAX_FWD_LEN, MAX_DELTA_T
@@ -173,10 +173,12 @@ def process_header(data, header_size=None, protocol_version=None, profile_versio
 def process_checksum(data, state):
     offset = 0
     try:
-        # don't use memoryview here as it gets spread into state and token
-        offset = len(FileHeader(data))
-        while len(data) - offset > 2:
-            token = token_factory(data[offset:], state)
+        # tokenise a view of a copy (data cannot be resized while a view is held by state and tokens)
+        # so that each token does not copy the rest of the file
+        copy = memoryview(bytes(data))
+        offset = len(FileHeader(copy))
+        while len(copy) - offset > 2:
+            token = token_factory(copy[offset:], state)
             offset += len(token)
         if len(data) - offset < 2:
             n = offset + 2 - len(data)
@@ -289,22 +291,62 @@ def drop_data(initial_state, data, warn=False, force=True,
         slices = advance(initial_state, view,
                          drop_count=0, initial_offset=0, warn=warn, force=force,
                          min_sync_cnt=min_sync_cnt, max_record_len=max_record_len, max_drop_cnt=max_drop_cnt,
-                         max_back_cnt=max_back_cnt, max_fwd_len=max_fwd_len)
+                         max_back_cnt=max_back_cnt, max_fwd_len=max_fwd_len, cache=SearchCache())
     log.info('Found slices %s' % format_slices(slices))
     return slices
 
 
-def offset_tokens(state, data, offset=0, warn=False, force=True):
+class SearchCache:
+    '''
+    The search in advance() reads the same data many times, from nearby offsets and with similar states.
+    This caches Definitions (without developer fields), keyed by their bytes, and the results of slurp,
+    keyed by offset and state.  Cached values are shared, so must not be modified.
+    '''
+
+    def __init__(self):
+        self.definitions = {}
+        self.reads = {}
+
+    def token(self, data, state):
+        header = data[0]
+        if header & 0xe0 != 0x40:
+            return token_factory(data, state)
+        key = bytes(data[:6 + 3 * data[5]])
+        if key not in self.definitions:
+            try:
+                self.definitions[key] = Definition(data, state)
+            except Exception as e:
+                self.definitions[key] = e
+        definition = self.definitions[key]
+        if isinstance(definition, Exception):
+            raise definition
+        # repeat the side effects of construction on this state
+        state.definitions[definition.local_message_type] = definition
+        for field in definition.fields:
+            if field.field:
+                field.field.register_accumulator(state.accumulators)
+        return definition
+
+    def read_key(self, state, offset, keep):
+        # states with developer fields or accumulators are not cached (only) to keep keys simple
+        if state.dev_fields or state.accumulators:
+            return None
+        return offset, keep, state.timestamp, \
+               tuple(sorted((local, id(definition)) for local, definition in state.definitions.items()))
+
+
+def offset_tokens(state, data, offset=0, warn=False, force=True, cache=None):
     '''
     this yields the offsets *after* the tokens (unlike tokens() in the read module).
     '''
+    factory = cache.token if cache else token_factory
     try:
         if not offset:
             file_header = FileHeader(data[offset:])
             offset = len(file_header)
             yield offset, file_header
         while len(data) - offset > 2:
-            token = token_factory(data[offset:], state)
+            token = factory(data[offset:], state)
             record = token.parse_token(warn=warn)
             if force:
                 record.force()
@@ -317,20 +359,35 @@ def offset_tokens(state, data, offset=0, warn=False, force=True):
         raise Exception('Error (%s) at offset %d' % (e, offset))
 
 
-def slurp(state, data, initial_offset, warn=False, force=True, max_record_len=None):
+def slurp(state, data, initial_offset, warn=False, force=True, max_record_len=None, keep=None, cache=None):
     '''
     read as much as possible starting at the given offset.
 
-    return offsets of valid tokens and a flag indicating if all data were read.
+    return offsets of valid tokens (with states, for the last keep tokens if given, otherwise None)
+    and a flag indicating if all data were read.
     '''
+    key = cache.read_key(state, initial_offset, keep) if cache else None
+    if key is not None and key in cache.reads:
+        return cache.reads[key]
+    result = _slurp(state, data, initial_offset, warn=warn, force=force, max_record_len=max_record_len,
+                    keep=keep, cache=cache)
+    if key is not None:
+        cache.reads[key] = result
+    return result
+
+
+def _slurp(state, data, initial_offset, warn=False, force=True, max_record_len=None, keep=None, cache=None):
     offsets_and_states = []
     offset = initial_offset
     try:
-        for offset, token in offset_tokens(state, data, initial_offset, warn=warn, force=force):
+        for offset, token in offset_tokens(state, data, initial_offset, warn=warn, force=force, cache=cache):
             if max_record_len and len(token) > max_record_len:
                 log.info('Record too large (%d > %d) at offset %d' % (len(token), max_record_len, offset))
                 return offsets_and_states, False
             offsets_and_states.append((offset, state.copy()))
+            # copying every state is expensive (and memory grows with the file)
+            if keep and len(offsets_and_states) > keep:
+                offsets_and_states[-keep-1] = (offsets_and_states[-keep-1][0], None)
         log.info('Read complete from %d' % initial_offset)
         return offsets_and_states, True
     except Exception as e:
@@ -344,7 +401,7 @@ class Backtrack(Exception): pass
 
 
 def advance(initial_state, data, drop_count=0, initial_offset=0, warn=False, force=True,
-            min_sync_cnt=3, max_record_len=None, max_drop_cnt=1, max_back_cnt=3, max_fwd_len=200):
+            min_sync_cnt=3, max_record_len=None, max_drop_cnt=1, max_back_cnt=3, max_fwd_len=200, cache=None):
     '''
     try to synchronize on the stream and then read as much as possible.  if reading later fails,
     then try recurse if not at limit; if that fails, backtrack a record and try again.
@@ -355,8 +412,8 @@ def advance(initial_state, data, drop_count=0, initial_offset=0, warn=False, for
     some length can be read.
     '''
     initial_offsets_and_states = [(initial_offset, initial_state.copy())]
-    offsets_and_states, complete = slurp(initial_state, data, initial_offset,
-                                         warn=warn, force=force, max_record_len=max_record_len)
+    offsets_and_states, complete = slurp(initial_state, data, initial_offset, warn=warn, force=force,
+                                         max_record_len=max_record_len, keep=max_back_cnt, cache=cache)
     if offsets_and_states:
         log.debug('%d: Read %d records; offset %d to %d' %
                   (drop_count, len(offsets_and_states), initial_offset, offsets_and_states[-1][0]))
@@ -386,7 +443,7 @@ def advance(initial_state, data, drop_count=0, initial_offset=0, warn=False, for
                               (drop_count, back_cnt-1, delta, offset+delta))
                     slices = advance(state.copy(), data, drop_count+1, offset+delta,
                                      min_sync_cnt=min_sync_cnt, max_record_len=max_record_len,
-                                     max_drop_cnt=max_drop_cnt, max_fwd_len=max_fwd_len)
+                                     max_drop_cnt=max_drop_cnt, max_fwd_len=max_fwd_len, cache=cache)
                     return [slice(initial_offset, offset)] + slices
                 except Backtrack as e:
                     log.debug('%d: Backtrack at (drop %d, skip %d): "%s"' % (drop_count, back_cnt, delta, e))
@@ -0,0 +1,360 @@
+import datetime as dt
+from collections import defaultdict, OrderedDict
+from logging import getLogger
+from numbers import Number
+
+import numpy as np
+
+from .decoder import simple_type
+from .records import LazyRecord, fix_degrees
+from .tokens import FIELD_DESCRIPTION
+from ..profile.types import AutoFloat, Mapping, Date
+
+log = getLogger(__name__)
+
+'''
+Bulk decoding of Data messages.
+
+Most of a FIT file is long runs of Data messages that share a single local message type (eg records every
+second).  Rather than unpack each field of each message through the profile, a run is read in a single
+call to numpy.frombuffer with a structured dtype that mirrors the Definition.  Fields that cannot be read
+as a simple column (strings, arrays, composite fields, etc) fall back to the profile, one message at a time.
+
+A Run can be read either as records (equivalent to parsing each token) or as columns (numpy arrays).
+
+Messages that need context from earlier messages (accumulators, 16 bit compressed timestamps) are not
+handled here.  bulk_run checks the header and returns None for these, so they fall back to the token
+factory (a compressed timestamp header also ends any run, since it differs from the run's header).
+'''
+
+
+MIN_RUN = 4
+COMPRESSED_TIMESTAMP = 0x80
+DEFINITION = 0x40
+SEMICIRCLES = 'semicircles'
+TIMESTAMP = 'timestamp'
+# the byte offset of each message, to recover file order (not a profile name, so cannot clash)
+OFFSET = '_offset'
+
+
+def _dtype(struct, endian, kind=None):
+    if kind is None:
+        kind = 'f' if isinstance(struct, AutoFloat) else ('i' if struct.signed else 'u')
+    return np.dtype('%s%s%d' % ('<>'[endian], kind, struct.n_bytes))
+
+
+def vector_fix_degrees(values, units, new_units='°'):
+    if units == SEMICIRCLES:
+        return values * 180 / 2**31, new_units
+    else:
+        return values, units
+
+
+class Column:
+    '''
+    A single field of a Definition, read as a numpy column.
+    '''
+
+    def __init__(self, field, endian):
+        self.field = field
+        profile = field.field
+        if profile:
+            self.name, self.units = profile.name, profile._units
+            type = profile.type
+            self.scale, self.offset = profile._scale, profile._offset
+        else:
+            self.name, self.units = '@%d:%d' % (field.start, field.finish), None
+            type = field.base_type
+            self.scale, self.offset = 1, 0
+        self.mapping = type if isinstance(type, Mapping) else None
+        self.struct = type.base_type if self.mapping else type
+        self.date = self.struct if isinstance(self.struct, Date) else None
+        self.key = 'f%d' % field.start
+        self.dtype = _dtype(self.struct, endian)
+        self.__raw = _dtype(self.struct, endian, kind='u')
+        self.__bad = np.frombuffer(self.struct.bad_bytes(endian), dtype=self.__raw)[0]
+
+    @classmethod
+    def is_simple(cls, field):
+        return simple_type(field) is not None
+
+    def __scaled(self, column, as_float=False):
+        if (self.scale == 1 and self.offset == 0) or self.struct.name == 'enum':
+            return column.astype(np.float64) if as_float else column
+        else:
+            return column.astype(np.float64) / self.scale - self.offset
+
+    def bad(self, column):
+        return column.view(self.__raw) == self.__bad
+
+    def times(self, column):
+        '''
+        Raw times (not checked for bad values) in seconds since the unix epoch.
+        '''
+        return column.astype(np.float64) + self.date.to_time(0).timestamp()
+
+    def decode(self, column):
+        '''
+        A list of (values, units) pairs, as returned by the profile.
+        '''
+        values = self.__scaled(column).tolist()
+        if self.mapping:
+            values = [self.mapping.safe_internal_to_profile(value) for value in values]
+        elif self.date:
+            values = [self.date.to_time(value) for value in values]
+        return [(None, self.units) if bad else ((value,), self.units)
+                for bad, value in zip(self.bad(column).tolist(), values)]
+
+    def array(self, column):
+        '''
+        A numpy array (float, with NaN for bad values, unless mapped) and units.
+        Dates are converted to seconds since the unix epoch.
+        '''
+        bad = self.bad(column)
+        if self.mapping:
+            keys, index = np.unique(self.__scaled(column), return_inverse=True)
+            values = np.array([self.mapping.safe_internal_to_profile(key) for key in keys.tolist()],
+                              dtype=object)[index]
+            values[bad] = None
+            return values, self.units
+        values = self.times(column) if self.date else self.__scaled(column, as_float=True)
+        values[bad] = np.nan
+        return vector_fix_degrees(values, self.units)
+
+
+class BulkDecoder:
+    '''
+    Decode a run of Data messages that share a Definition.
+    '''
+
+    def __init__(self, definition):
+        self.definition = definition
+        endian = definition.endian
+        self.columns = {}
+        names, formats, offsets = [], [], []
+        for field in definition.decoded_fields:
+            if field.start not in self.columns and Column.is_simple(field):
+                column = Column(field, endian)
+                self.columns[field.start] = column
+                names.append(column.key)
+                formats.append(column.dtype)
+                offsets.append(field.start)
+        self.dtype = np.dtype({'names': names, 'formats': formats, 'offsets': offsets,
+                               'itemsize': definition.size})
+        self.others = tuple(field for field in definition.decoded_fields if field.start not in self.columns)
+        self.timestamp = None
+        if definition.timestamp_field:
+            self.timestamp = self.columns[definition.timestamp_field.start]
+
+    @staticmethod
+    def for_definition(definition):
+        '''
+        A decoder for the definition, or None if the messages must be parsed one at a time.
+        '''
+        timestamp = definition.timestamp_field
+        if timestamp and not (Column.is_simple(timestamp) and isinstance(timestamp.field.type, Date)):
+            return None
+        if definition.global_message_no == FIELD_DESCRIPTION:
+            return None
+        return BulkDecoder(definition)
+
+    def parse_fields(self, row, timestamp, references, fields, **options):
+        '''
+        Parse fields from a single message via the profile (as Message.__parse).
+        '''
+        defn = self.definition
+        for field in fields:
+            bytes = row[field.start:field.finish]
+            if field.field:
+                for name, value in defn.message._parse_field(field.field, bytes, field.count, defn.endian,
+                                                             timestamp, references, defn.message, **options):
+                    if name in defn.references and value[0] is not None:
+                        references[name] = value
+                    yield name, value
+            else:
+                yield '@%d:%d' % (field.start, field.finish), \
+                      (field.base_type.parse_type(bytes, field.count, defn.endian, timestamp), None)
+
+
+class Run:
+    '''
+    A sequence of Data messages that share a Definition.  Takes the place of the Data tokens when
+    parse_data is called with bulk=True.
+
+    The state is updated (to the final timestamp) on construction.
+    '''
+
+    is_user = True
+
+    def __init__(self, decoder, view, offset, count, state):
+        self.decoder = decoder
+        self.definition = decoder.definition
+        self.name = self.definition.message.name
+        self.offset = offset
+        self.count = count
+        self.__view = view
+        self.__array = np.frombuffer(view, dtype=decoder.dtype, count=count, offset=offset)
+        if decoder.timestamp:
+            # we want the raw value here (check_bad=False in Defined)
+            raw = self.__array[decoder.timestamp.key]
+            if state.max_delta_t:
+                self.__times = [decoder.timestamp.date.to_time(time) for time in raw.tolist()]
+                for time in self.__times:
+                    state.timestamp = time
+            else:
+                self.__times = None
+                state.timestamp = decoder.timestamp.date.to_time(raw[-1].item())
+        else:
+            self.__times = [state.timestamp] * count
+
+    def __len__(self):
+        return self.count * self.definition.size
+
+    def __row(self, i):
+        start = self.offset + i * self.definition.size
+        return self.__view[start:start + self.definition.size]
+
+    def __decoded(self, names=None):
+        return dict((column.name, column.decode(self.__array[column.key]))
+                    for column in self.decoder.columns.values() if names is None or column.name in names)
+
+    def timestamps(self):
+        if self.__times is None:
+            self.__times = [self.decoder.timestamp.date.to_time(time)
+                            for time in self.__array[self.decoder.timestamp.key].tolist()]
+        return self.__times
+
+    def records(self, warn=False):
+        '''
+        Yield (offset, record) for each message.
+        '''
+        defn, columns = self.definition, self.decoder.columns
+        decoded = self.__decoded()
+        message = defn.message
+        for i, timestamp in enumerate(self.timestamps()):
+            row, data, references = None, [], {}
+            for field in defn.decoded_fields:
+                if field.start in columns:
+                    name = columns[field.start].name
+                    value = decoded[name][i]
+                    if name in defn.references and value[0] is not None:
+                        references[name] = value
+                    data.append((name, value))
+                else:
+                    if row is None: row = self.__row(i)
+                    data.extend(self.decoder.parse_fields(row, timestamp, references, (field,), warn=warn))
+            yield self.offset + i * defn.size, \
+                  LazyRecord(message.name, message.number, defn.identity, timestamp, data)
+
+    def columns(self, field_names=None, warn=False):
+        '''
+        The timestamps (seconds since the unix epoch) and a dict from field name to (array, units).
+        '''
+        defn, decoder = self.definition, self.decoder
+        if decoder.timestamp:
+            timestamps = decoder.timestamp.times(self.__array[decoder.timestamp.key])
+        else:
+            timestamp = self.__times[0]
+            timestamps = np.full(self.count, np.nan if timestamp is None else timestamp.timestamp())
+        data = OrderedDict()
+        for column in decoder.columns.values():
+            if column.name != TIMESTAMP and (not field_names or column.name in field_names):
+                data[column.name] = column.array(self.__array[column.key])
+        if decoder.others:
+            decoded = self.__decoded(defn.references)
+            values, units = defaultdict(lambda: [None] * self.count), {}
+            for i, timestamp in enumerate(self.timestamps()):
+                references = dict((name, value[i]) for name, value in decoded.items() if value[i][0] is not None)
+                for name, (value, unit) in fix_degrees(self.decoder.parse_fields(
+                        self.__row(i), timestamp, references, decoder.others, warn=warn)):
+                    if name != TIMESTAMP and (not field_names or name in field_names):
+                        values[name][i] = _scalar(value)
+                        units[name] = unit
+            for name in values:
+                data[name] = (_array(values[name]), units[name])
+        return timestamps, data
+
+
+def _scalar(values):
+    if values is not None and len(values) == 1:
+        value = values[0]
+        return value.timestamp() if isinstance(value, dt.datetime) else value
+    else:
+        return values
+
+
+def _array(values):
+    if all(value is None or (isinstance(value, Number) and not isinstance(value, bool)) for value in values):
+        return np.array([np.nan if value is None else value for value in values], dtype=np.float64)
+    else:
+        array = np.empty(len(values), dtype=object)
+        array[:] = values
+        return array
+
+
+def bulk_run(view, offset, state, decoders):
+    '''
+    If the data at offset starts a run of Data messages that can be decoded in bulk, return a Run.
+    Otherwise, return None.
+    '''
+    header = view[offset]
+    if header & COMPRESSED_TIMESTAMP or header & DEFINITION or state.accumulators: return None
+    definition = state.definitions.get(header & 0x0f)
+    if definition is None: return None
+    if definition not in decoders:
+        decoders[definition] = BulkDecoder.for_definition(definition)
+    decoder = decoders[definition]
+    if decoder is None: return None
+    size, count, end = definition.size, 0, offset
+    while len(view) - end > 2 and end + size <= len(view) and view[end] == header:
+        count += 1
+        end += size
+    if count < MIN_RUN: return None
+    return Run(decoder, view, offset, count, state)
+
+
+class Table:
+    '''
+    Accumulate columns for a single message type, from Runs or individual records.
+    '''
+
+    def __init__(self):
+        self.__count = 0
+        self.__timestamps = []
+        self.__offsets = []
+        self.__chunks = defaultdict(list)
+        self.__units = OrderedDict()
+
+    def add_run(self, offsets, timestamps, data):
+        self.__offsets.append(offsets)
+        self.__timestamps.append(timestamps)
+        for name, (values, units) in data.items():
+            self.__chunks[name].append((self.__count, values))
+            self.__units[name] = units
+        self.__count += len(timestamps)
+
+    def add_record(self, offset, record, field_names=None):
+        self.__offsets.append([offset])
+        self.__timestamps.append([np.nan if record.timestamp is None else record.timestamp.timestamp()])
+        for name, (values, units) in record.data.items():
+            if name != TIMESTAMP and (not field_names or name in field_names):
+                self.__chunks[name].append((self.__count, [_scalar(values)]))
+                self.__units[name] = units
+        self.__count += 1
+
+    def columns(self):
+        columns = OrderedDict()
+        columns[TIMESTAMP] = (np.concatenate([np.asarray(timestamps, dtype=np.float64)
+                                                for timestamps in self.__timestamps]), 's')
+        columns[OFFSET] = (np.concatenate([np.asarray(offsets, dtype=np.float64) for offsets in self.__offsets]), None)
+        for name, units in self.__units.items():
+            chunks = [(start, values if isinstance(values, np.ndarray) else _array(values))
+                      for start, values in self.__chunks[name]]
+            if all(values.dtype == np.float64 for _, values in chunks):
+                column = np.full(self.__count, np.nan)
+            else:
+                column = np.full(self.__count, None, dtype=object)
+            for start, values in chunks:
+                column[start:start + len(values)] = values
+            columns[name] = (column, units)
+        return columns
@@ -0,0 +1,95 @@
+from logging import getLogger
+from os import listdir, makedirs, remove
+from os.path import join, exists, isdir
+from shutil import rmtree
+
+import numpy as np
+
+from .bulk import TIMESTAMP, OFFSET
+from .read import columnar_records
+from ..profile.profile import profile_version, read_fit
+from ...common.io import file_hash, atomic_write
+
+log = getLogger(__name__)
+
+'''
+An on-disk cache of columnar FIT data (see columnar_records), keyed by file hash.
+
+Each profile version has its own directory (named by the hash of the profile and the cache FORMAT) and
+directories for other versions are deleted when the cache is opened with evict=True, so changes to the
+profile (or to the columns stored) invalidate cached data.  Worker processes should open the cache with evict=False (eviction is done once, by the parent).
+'''
+
+FIT_CACHE = 'fit-cache'
+INDEX = 'index'
+NPZ = '.npz'
+FORMAT = 2  # increment when the cached columns change
+
+
+class ColumnCache:
+
+    def __init__(self, dir, profile_path=None, evict=True):
+        self.__profile_path = profile_path
+        version = f'{profile_version(profile_path)}-{FORMAT}'
+        if evict: self.__evict(dir, version)
+        self.__dir = join(dir, version)
+        makedirs(self.__dir, exist_ok=True)
+
+    @staticmethod
+    def __evict(dir, version):
+        if exists(dir):
+            for name in listdir(dir):
+                path = join(dir, name)
+                if name != version and isdir(path):
+                    log.info(f'Removing cached FIT data for old profile ({path})')
+                    rmtree(path, ignore_errors=True)
+
+    def __path(self, hash):
+        return join(self.__dir, hash + NPZ)
+
+    def read(self, hash):
+        '''
+        The cached columns for the hash, or None.
+        '''
+        path = self.__path(hash)
+        if exists(path):
+            try:
+                with np.load(path, allow_pickle=True) as npz:
+                    columns = {}
+                    for i, (record, field, units) in enumerate(npz[INDEX]):
+                        columns.setdefault(record, {})[field] = (npz[str(i)], units)
+                    return columns
+            except Exception as e:
+                log.warning(f'Discarding unreadable cache file {path}: {e}')
+                remove(path)
+        return None
+
+    def write(self, hash, columns):
+        index, arrays = [], {}
+        for record, fields in columns.items():
+            for field, (values, units) in fields.items():
+                arrays[str(len(index))] = values
+                index.append((record, field, units))
+        index_array = np.empty(len(index), dtype=object)
+        index_array[:] = index
+        path = self.__path(hash)
+        with atomic_write(path) as output:
+            np.savez(output, **{INDEX: index_array}, **arrays)
+
+    def columnar_records(self, path, hash=None, record_names=None, field_names=None, **kargs):
+        '''
+        As columnar_records, but reading from the cache where possible.
+        The data for all records are cached, whatever the names given.
+        '''
+        if hash is None: hash = file_hash(path)
+        columns = self.read(hash)
+        if columns is None:
+            log.debug(f'Parsing {path} ({hash})')
+            columns = columnar_records(read_fit(path), profile_path=self.__profile_path, **kargs)
+            self.write(hash, columns)
+        else:
+            log.debug(f'Read {path} from cache ({hash})')
+        return dict((record, dict((field, value) for field, value in fields.items()
+                                  if field in (TIMESTAMP, OFFSET) or not field_names or field in field_names))
+                    for record, fields in columns.items()
+                    if not record_names or record in record_names)
@@ -0,0 +1,68 @@
+from logging import getLogger
+
+import numpy as np
+
+log = getLogger(__name__)
+
+'''
+The FIT checksum (CRC-16 with the reflected polynomial 0xA001, also known as CRC-16/ARC).
+
+The SDK calculates this a nibble at a time.  Here a byte-wise table is used for small inputs and, for large
+inputs, the data are split into blocks whose CRCs are calculated in parallel with numpy (one vector
+operation per byte of block length) and then combined.  The combination uses the linearity of the CRC:
+crc(a + b) = shift(crc(a), len(b)) ^ crc(b), where shift appends zero bytes, which (for a fixed length)
+is a linear map on 16 bits and so can be tabulated.
+'''
+
+BLOCK = 1024
+# the vector path has a fixed cost of around 12ms (one numpy operation per byte of block), so is slower
+# than the table below about 50KB (measured: 12.3ms v 0.98ms at 4KB, 12.1 v 4.7 at 16KB, 14.3 v 9.5 at 32KB)
+MIN_VECTOR = 64 * BLOCK
+
+
+def _table():
+    table = []
+    for byte in range(256):
+        crc = byte
+        for _ in range(8):
+            crc = (crc >> 1) ^ 0xA001 if crc & 1 else crc >> 1
+        table.append(crc)
+    return table
+
+
+TABLE = _table()
+NP_TABLE = np.array(TABLE, dtype=np.uint16)
+
+
+def _bytewise(data, crc):
+    table = TABLE
+    for byte in data:
+        crc = (crc >> 8) ^ table[(crc ^ byte) & 0xff]
+    return crc
+
+
+def _shift_tables(n):
+    # shift(crc, n) is linear, so is the xor of the shifts of the low and high bytes
+    low = [_bytewise(bytes(n), byte) for byte in range(256)]
+    high = [_bytewise(bytes(n), byte << 8) for byte in range(256)]
+    return low, high
+
+
+LOW, HIGH = _shift_tables(BLOCK)
+
+
+def crc16(data, crc=0):
+    '''
+    The FIT checksum of data (bytes, bytearray or memoryview), continuing from crc.
+    '''
+    n = len(data)
+    if n < MIN_VECTOR:
+        return _bytewise(data, crc)
+    n_blocks = n // BLOCK
+    blocks = np.frombuffer(data, dtype=np.uint8, count=n_blocks * BLOCK).reshape(n_blocks, BLOCK)
+    crcs = np.zeros(n_blocks, dtype=np.uint16)
+    for i in range(BLOCK):
+        crcs = (crcs >> 8) ^ NP_TABLE[(crcs ^ blocks[:, i]) & 0xff]
+    for block_crc in crcs.tolist():
+        crc = LOW[crc & 0xff] ^ HIGH[crc >> 8] ^ block_crc
+    return _bytewise(data[n_blocks * BLOCK:], crc)
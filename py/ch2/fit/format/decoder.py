@@ -0,0 +1,135 @@
+from logging import getLogger
+from struct import Struct
+
+from ..profile.fields import TypedField, RowField
+from ..profile.types import AutoInteger, AutoFloat, Mapping, Date, Date16
+
+log = getLogger(__name__)
+
+'''
+Decoders compiled for a Definition.
+
+The profile parses each field of each message through several layers of dynamic dispatch (Message,
+Field, Type).  For simple (single value, integer or float) fields all that work can be done once, when
+the Definition is read: a single Struct unpacks every simple field in the row and a list of operations
+applies bad value checks, scaling, mapping and date conversion.  Other fields still go via the profile.
+
+Fields that are not in Definition.decoded_fields (when the State restricts messages or fields) are skipped.
+'''
+
+
+def simple_type(field):
+    '''
+    The struct type (AutoInteger or AutoFloat) if the field contains a single value that can be read
+    directly, otherwise None.
+    '''
+    profile = field.field
+    if profile:
+        if type(profile) not in (TypedField, RowField) or profile._accumulate: return None
+        type_ = profile.type
+        struct = type_.base_type if isinstance(type_, Mapping) else type_
+        scaled = not (profile._scale == 1 and profile._offset == 0) and struct.name != 'enum'
+    else:
+        struct, scaled = field.base_type, False
+    if (isinstance(struct, (AutoInteger, AutoFloat)) and not isinstance(struct, Date16) and
+            field.count == 1 and struct.n_bytes == field.size and (struct.n_bytes < 8 or not scaled)):
+        return struct
+    else:
+        return None
+
+
+class Operation:
+    '''
+    The conversion for a single simple field (after unpacking).
+    '''
+
+    def __init__(self, field, struct, index, endian):
+        self.field = field
+        self.index = index
+        profile = field.field
+        if profile:
+            self.name, self.units = profile.name, profile._units
+            type = profile.type
+            scale, offset = profile._scale, profile._offset
+        else:
+            self.name, self.units = '@%d:%d' % (field.start, field.finish), None
+            type = field.base_type
+            scale, offset = 1, 0
+        self.scale, self.offset = scale, offset
+        self.scaled = not ((scale == 1 and offset == 0) or struct.name == 'enum')
+        self.mapping = type if isinstance(type, Mapping) else None
+        self.date = struct if isinstance(struct, Date) else None
+        bad = struct.bad_bytes(endian)
+        if isinstance(struct, AutoFloat):
+            # compare bytes because bad floats are NaN
+            self.bad, self.bad_bytes = None, bad
+        else:
+            self.bad = int.from_bytes(bad, byteorder=['little', 'big'][endian], signed=struct.signed)
+            self.bad_bytes = None
+
+    def __call__(self, data, values):
+        value = values[self.index]
+        if self.bad_bytes is None:
+            if value == self.bad: return None
+        elif data[self.field.start:self.field.finish] == self.bad_bytes:
+            return None
+        if self.scaled:
+            value = value / self.scale - self.offset
+        if self.mapping:
+            value = self.mapping.safe_internal_to_profile(value)
+        elif self.date:
+            value = self.date.to_time(value)
+        return (value,)
+
+
+class RowDecoder:
+    '''
+    Decode a single Data message with a Struct compiled from the Definition.
+    '''
+
+    def __init__(self, definition):
+        self.definition = definition
+        endian = definition.endian
+        formats, operations, index, position = ['<>'[endian], 'x'], {}, 0, 1
+        for field in sorted(set(definition.decoded_fields), key=lambda field: field.start):
+            if field.start > position:
+                # fields can be missing from definition.fields if names are duplicated (or not decoded)
+                formats.append('%dx' % (field.start - position))
+            position = field.finish
+            struct = simple_type(field)
+            if struct:
+                format = struct.size_to_format[struct.n_bytes]
+                if isinstance(struct, AutoInteger) and not struct.signed:
+                    format = format.upper()
+                formats.append(format)
+                operations[field.start] = Operation(field, struct, index, endian)
+                index += 1
+            else:
+                formats.append('%dx' % field.size)
+        if definition.size > position:
+            formats.append('%dx' % (definition.size - position))
+        self.struct = Struct(''.join(formats))
+        self.operations = tuple(operations.get(field.start) for field in definition.decoded_fields)
+
+    def decode(self, data, timestamp, accumulators=None, **options):
+        '''
+        Yield (name, (values, units)) as Message.__parse.
+        '''
+        defn = self.definition
+        values = self.struct.unpack_from(data)
+        references = {}
+        for field, operation in zip(defn.decoded_fields, self.operations):
+            if operation and not (accumulators and operation.name in accumulators):
+                pairs = ((operation.name, (operation(data, values), operation.units)),)
+            elif field.field:
+                pairs = defn.message._parse_field(field.field, data[field.start:field.finish], field.count,
+                                                  defn.endian, timestamp, references, defn.message,
+                                                  accumulators=accumulators, **options)
+            else:
+                pairs = (('@%d:%d' % (field.start, field.finish),
+                          (field.base_type.parse_type(data[field.start:field.finish], field.count,
+                                                      defn.endian, timestamp), None)),)
+            for name, value in pairs:
+                if name in defn.references and value[0] is not None:
+                    references[name] = value
+                yield name, value
@@ -1,16 +1,33 @@
+from collections import defaultdict
+from io import BytesIO
 from logging import getLogger
+from math import isnan
 
-from .records import restrict_names
-from .tokens import State, FileHeader, token_factory, Checksum
+import numpy as np
+
+from .bulk import bulk_run, Run, Table, TIMESTAMP, OFFSET
+from .records import restrict_names, fix_degrees, Record
+from .stream import stream_data
+from .tokens import State, FileHeader, token_factory, Checksum, Defined
 from ..profile.profile import read_profile
+from ...common.date import to_time
 from ...lib.data import tohex
 
 log = getLogger(__name__)
 
 
-def parse_data(data, types, messages, no_validate=False, max_delta_t=None):
+def parse_data(data, types, messages, no_validate=False, max_delta_t=None, bulk=False,
+               record_names=None, field_names=None):
+    '''
+    Yield (offset, token).  If bulk is true then runs of Data messages may be returned as a single Run
+    (see bulk.py).  If record_names or field_names are given then other messages and fields are not decoded
+    (see Definition.decoded_fields).
+    '''
 
-    state = State(types, messages, max_delta_t=max_delta_t)
+    state = State(types, messages, max_delta_t=max_delta_t, record_names=record_names, field_names=field_names)
+    # slicing a memoryview does not copy the remaining data for each token
+    data = memoryview(data)
+    decoders = {}
 
     def generator():
         offset = 0
@@ -20,7 +37,7 @@ def parse_data(data, types, messages, no_validate=False, max_delta_t=None):
             offset = len(file_header)
             file_header.validate(data, log, quiet=no_validate)
             while len(data) - offset > 2:
-                token = token_factory(data[offset:], state)
+                token = (bulk and bulk_run(data, offset, state, decoders)) or token_factory(data[offset:], state)
                 yield offset, token
                 offset += len(token)
             checksum = Checksum(data[offset:])
@@ -34,6 +51,42 @@ def parse_data(data, types, messages, no_validate=False, max_delta_t=None):
     return state, generator()
 
 
+def parse_records(data, types, messages, no_validate=False, max_delta_t=None, warn=False,
+                  record_names=None, field_names=None):
+    '''
+    As parse_data, but yields (offset, is_user, record), with runs of Data messages decoded in bulk.
+    Messages not in record_names (if given) are skipped.
+    '''
+
+    state, tokens = parse_data(data, types, messages, no_validate=no_validate, max_delta_t=max_delta_t, bulk=True,
+                               record_names=record_names, field_names=field_names)
+
+    def generator():
+        for offset, token in tokens:
+            if isinstance(token, Run):
+                if token.definition.is_selected:
+                    for offset, record in token.records(warn=warn):
+                        yield offset, True, record
+            else:
+                record = parse_selected(token, state, warn=warn)
+                if record is not None:
+                    yield offset, token.is_user, record
+
+    return state, generator()
+
+
+def parse_selected(token, state, warn=False):
+    '''
+    The parsed token, or None if it is a message that was not selected (see parse_data).
+    '''
+    if isinstance(token, Defined) and not token.definition.is_selected:
+        # only the accumulated fields are decoded, but they must be updated
+        if state.accumulators: token.parse_token(warn=warn).force()
+        return None
+    else:
+        return token.parse_token(warn=warn)
+
+
 def dump(data, offset, rows=3, blocks=6, block=4):
     for row in range(rows):
         line = '%06d' % offset
@@ -45,17 +98,32 @@ def dump(data, offset, rows=3, blocks=6, block=4):
         if offset >= len(data): return
 
 
+def indexed_tokens(data, types, messages, after_bytes=None, checkpoints=None, **kargs):
+    '''
+    Yield (index, offset, token).  If checkpoints are given then data may be a binary file object
+    and reading starts at the last checkpoint before after_bytes (see stream.py).
+    '''
+    if checkpoints is None:
+        state, tokens = parse_data(data, types, messages, **kargs)
+        return state, ((index, offset, token) for index, (offset, token) in enumerate(tokens))
+    else:
+        if not hasattr(data, 'read'): data = BytesIO(data)
+        checkpoint = checkpoints.before(after_bytes) if after_bytes else None
+        return stream_data(data, types, messages, checkpoint=checkpoint, **kargs)
+
+
 def filtered_tokens(data,
                     after_bytes=None, limit_bytes=-1, after_records=None, limit_records=-1,
-                    warn=False, no_validate=False, max_delta_t=None, profile_path=None):
+                    warn=False, no_validate=False, max_delta_t=None, profile_path=None, checkpoints=None):
 
     types, messages = read_profile(warn=warn, profile_path=profile_path)
-    state, tokens = parse_data(data, types, messages, no_validate=no_validate, max_delta_t=max_delta_t)
+    state, tokens = indexed_tokens(data, types, messages, after_bytes=after_bytes, checkpoints=checkpoints,
+                                   no_validate=no_validate, max_delta_t=max_delta_t)
 
     def generator():
         first_record = 0 if (after_records is None) else None
         first_bytes = 0 if (after_bytes is None) else None
-        for i, (offset, token) in enumerate(tokens):
+        for i, offset, token in tokens:
             if (first_record is None and (after_records is not None and i >= after_records)) or \
                     (first_bytes is None and (after_bytes is not None and offset >= after_bytes)):
                 first_record = i
@@ -71,27 +139,94 @@ def filtered_records(data,
                      after_bytes=None, limit_bytes=-1, after_records=None, limit_records=-1,
                      record_names=None, field_names=None,
                      warn=False, no_validate=False, internal=False, max_delta_t=None,
-                     profile_path=None, pipeline=None):
+                     profile_path=None, pipeline=None, bulk=False, checkpoints=None):
 
+    if bulk and (after_bytes is not None or after_records is not None or checkpoints is not None):
+        # runs are decoded from the start of the data, so cannot resume from a checkpoint
+        raise Exception('Bulk reading does not support after_bytes, after_records or checkpoints')
     if pipeline is None: pipeline = []
     if field_names: pipeline.append(restrict_names(field_names))
     types, messages = read_profile(warn=warn, profile_path=profile_path)
-    state, tokens = parse_data(data, types, messages, no_validate=no_validate, max_delta_t=max_delta_t)
+    if bulk:
+        state, records = parse_records(data, types, messages, no_validate=no_validate, max_delta_t=max_delta_t,
+                                       warn=warn, record_names=record_names, field_names=field_names)
+        records = ((i, offset, is_user, record) for i, (offset, is_user, record) in enumerate(records))
+    else:
+        state, tokens = indexed_tokens(data, types, messages, after_bytes=after_bytes, checkpoints=checkpoints,
+                                       no_validate=no_validate, max_delta_t=max_delta_t,
+                                       record_names=record_names, field_names=field_names)
+        records = ((i, offset, token.is_user, parse_selected(token, state, warn=warn)) for i, offset, token in tokens)
 
     def generator():
         first_record = 0 if (after_records is None) else None
         first_bytes = 0 if (after_bytes is None) else None
-        for i, (offset, token) in enumerate(tokens):
+        for i, offset, is_user, record in records:
             if (first_record is None and (after_records is not None and i >= after_records)) or \
                     (first_bytes is None and (after_bytes is not None and offset >= after_bytes)):
                 first_record = i
                 first_bytes = offset
-            record = token.parse_token(warn=warn)
+            if record is None: continue
             if state.accumulators: record = record.force(*pipeline)
-            if (internal or token.is_user) and (not record_names or record.name in record_names) and \
+            if (internal or is_user) and (not record_names or record.name in record_names) and \
                     (first_record is not None and (limit_records < 0 or i - first_record < limit_records)) and \
                     (first_bytes is not None and (limit_bytes < 0 or offset - first_bytes < limit_bytes)):
                 if not state.accumulators: record = record.force(*pipeline)
                 yield i, offset, record
 
     return types, messages, generator()
+
+
+def columnar_records(data, record_names=None, field_names=None,
+                     warn=False, no_validate=False, max_delta_t=None, profile_path=None):
+    '''
+    Read user records as columns.  Returns a dict from record name to an (ordered) dict from field name
+    to (array, units).  Each record type also has a timestamp column (seconds since the unix epoch) and an
+    OFFSET column (the byte offset of each message, so file order can be recovered).
+
+    Numerical values are float arrays with NaN for missing or bad values (other values are object arrays
+    with None).  Scaling, offsets and fix_degrees are applied.
+    '''
+
+    types, messages = read_profile(warn=warn, profile_path=profile_path)
+    state, tokens = parse_data(data, types, messages, no_validate=no_validate, max_delta_t=max_delta_t, bulk=True,
+                               record_names=record_names, field_names=field_names)
+    tables = defaultdict(Table)
+
+    for offset, token in tokens:
+        if isinstance(token, Run):
+            if token.definition.is_selected:
+                offsets = offset + np.arange(token.count) * token.definition.size
+                tables[token.name].add_run(offsets, *token.columns(field_names=field_names, warn=warn))
+        elif token.is_user or state.accumulators:
+            # force even if not used to update accumulators
+            record = parse_selected(token, state, warn=warn)
+            if record is not None:
+                record = record.force(fix_degrees)
+                if token.is_user:
+                    tables[record.name].add_record(offset, record, field_names=field_names)
+
+    return dict((name, table.columns()) for name, table in tables.items())
+
+
+def records_from_columns(columns, *filters, record_names=None):
+    '''
+    Rebuild records (as DictRecords, sorted by timestamp and then file order) from columnar data (see
+    columnar_records), applying the filters.  Bad values (NaN or None) are dropped and timestamps are
+    datetimes, but other dates remain as seconds since the unix epoch.
+    '''
+    records = []
+    for name, fields in columns.items():
+        if record_names and name not in record_names: continue
+        others = [(field, values.tolist(), units) for field, (values, units) in fields.items()
+                  if field not in (TIMESTAMP, OFFSET)]
+        offsets = fields[OFFSET][0].tolist()
+        for i, timestamp in enumerate(fields[TIMESTAMP][0].tolist()):
+            data = []
+            for field, values, units in others:
+                value = values[i]
+                if value is None or (isinstance(value, float) and isnan(value)): continue
+                data.append((field, (tuple(value) if isinstance(value, (tuple, list)) else (value,), units)))
+            timestamp = None if isnan(timestamp) else to_time(timestamp)
+            records.append((offsets[i], Record(name, None, None, timestamp, data).as_dict(*filters)))
+    records.sort(key=lambda offset_record: (offset_record[1].timestamp or to_time(0.0), offset_record[0]))
+    return [record for _, record in records]
@@ -0,0 +1,194 @@
+from bisect import bisect_right
+from copy import deepcopy
+from logging import getLogger
+from pickle import load, dump
+
+from .tokens import State, FileHeader, token_factory, Checksum, Defined, DeveloperField, Definition
+
+log = getLogger(__name__)
+
+'''
+Read FIT data from a file object, a chunk at a time, rather than loading the entire file into memory.
+
+A Checkpoints instance can be used to record the parser state (the definitions in force, developer fields,
+timestamp and accumulators) at regular intervals during a complete read.  A later read can then start
+directly at (or just before) any given offset.  Checkpoints contain no profile objects (the definitions
+are re-read from the file on restore) and so can be saved to disk.
+'''
+
+CHUNK = 1 << 20
+CHECKPOINT = 1 << 20
+# a data message can have 255 fields of 255 bytes; a definition 255 fields and 255 developer fields
+MAX_TOKEN = 255 * 255 + 1
+
+
+class Buffer:
+    '''
+    Data from a file object, read in chunks.  Only the data from the current offset onwards are kept.
+    Reading sequentially does not require the file to be seekable.
+    '''
+
+    def __init__(self, input, chunk_size=CHUNK):
+        self.__input = input
+        self.__chunk_size = max(chunk_size, MAX_TOKEN)
+        self.__data = b''
+        self.__start = 0
+        self.__eof = False
+
+    def seek(self, offset):
+        self.__input.seek(offset)
+        self.__data, self.__start, self.__eof = b'', offset, False
+
+    def view(self, offset):
+        '''
+        A view of the data from offset, containing at least MAX_TOKEN bytes unless the file ends first.
+        '''
+        if not self.__start <= offset <= self.__start + len(self.__data):
+            self.seek(offset)
+        while not self.__eof and self.__start + len(self.__data) - offset < MAX_TOKEN:
+            chunk = self.__input.read(self.__chunk_size)
+            if chunk:
+                self.__data = self.__data[offset - self.__start:] + chunk
+                self.__start = offset
+            else:
+                self.__eof = True
+        return memoryview(self.__data)[offset - self.__start:]
+
+
+class Checkpoint:
+    '''
+    The parser state before the token at offset (the index-th token in the file).
+    '''
+
+    def __init__(self, offset, index, state, replay):
+        self.offset = offset
+        self.index = index
+        self.replay = replay
+        self.timestamp = state.timestamp
+        self.accumulators = deepcopy(state.accumulators)
+        self.definition_counter = dict(state.definition_counter)
+
+    def restore(self, buffer, types, messages, max_delta_t=None, record_names=None, field_names=None):
+        '''
+        A new State, equivalent to the original, created by re-reading the tokens in replay.
+        '''
+        state = State(types, messages, max_delta_t=max_delta_t, record_names=record_names, field_names=field_names)
+        for offset in self.replay:
+            token_factory(buffer.view(offset), state)
+        state.accumulators.update(deepcopy(self.accumulators))
+        # update in place because identities refer to the counter
+        state.definition_counter.clear()
+        state.definition_counter.update(self.definition_counter)
+        state._timestamp = self.timestamp
+        return state
+
+
+class Checkpoints:
+    '''
+    Checkpoints taken (approximately) every `every` bytes while reading a file.
+    '''
+
+    def __init__(self, every=CHECKPOINT):
+        self.every = every
+        self.checkpoints = []
+        self.__definitions = {}  # local message type -> offset of definition
+        self.__replay = set()  # developer fields (and the definitions used to read them)
+
+    def observe(self, offset, index, state):
+        '''
+        Called before each token is read.
+        '''
+        if offset >= (self.checkpoints[-1].offset + self.every if self.checkpoints else 0):
+            replay = sorted(self.__replay.union(self.__definitions.values()))
+            self.checkpoints.append(Checkpoint(offset, index, state, replay))
+
+    def track(self, offset, token):
+        '''
+        Called after each token is read.
+        '''
+        if isinstance(token, DeveloperField):
+            self.__replay.add(offset)
+            self.__replay.add(self.__definitions[token.definition.local_message_type])
+        elif isinstance(token, Definition):
+            self.__definitions[token.local_message_type] = offset
+
+    def before(self, offset):
+        '''
+        The last checkpoint at or before offset (or None).
+        '''
+        i = bisect_right([checkpoint.offset for checkpoint in self.checkpoints], offset)
+        return self.checkpoints[i-1] if i else None
+
+    def save(self, path):
+        with open(path, 'wb') as output:
+            dump((self.every, self.checkpoints), output)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'rb') as input:
+            every, checkpoints = load(input)
+        instance = cls(every=every)
+        instance.checkpoints = checkpoints
+        return instance
+
+
+def stream_data(input, types, messages, no_validate=False, max_delta_t=None,
+                checkpoint=None, checkpoints=None, chunk_size=CHUNK, record_names=None, field_names=None):
+    '''
+    As parse_data, but reading from a binary file object in chunks, yielding (index, offset, token).
+
+    If checkpoint is given, reading starts there (with no validation of header or checksum).
+    If checkpoints is given, it is updated as the data are read (records must be parsed in order, as in
+    filtered_records, if accumulators are used).
+    '''
+
+    buffer = Buffer(input, chunk_size=chunk_size)
+    if checkpoint:
+        state = checkpoint.restore(buffer, types, messages, max_delta_t=max_delta_t,
+                                   record_names=record_names, field_names=field_names)
+    else:
+        state = State(types, messages, max_delta_t=max_delta_t, record_names=record_names, field_names=field_names)
+
+    def generator():
+        checksum = None
+        if checkpoint:
+            index, offset = checkpoint.index, checkpoint.offset
+        else:
+            index, offset = 0, 0
+            file_header = FileHeader(buffer.view(offset))
+            yield index, offset, file_header
+            checksum = Checksum.crc(file_header.data)
+            index, offset = index + 1, len(file_header)
+        try:
+            data = buffer.view(offset)
+            while len(data) > 2:
+                if checkpoints: checkpoints.observe(offset, index, state)
+                token = token_factory(data, state)
+                if checkpoints: checkpoints.track(offset, token)
+                yield index, offset, token
+                if checksum is not None: checksum = Checksum.crc(data[:len(token)], checksum)
+                index, offset = index + 1, offset + len(token)
+                data = buffer.view(offset)
+            token = Checksum(data)
+            yield index, offset, token
+            if not checkpoint:
+                file_header.validate(file_header.data, log, quiet=no_validate, size=offset + len(token))
+                token.validate(None, log, quiet=no_validate, checksum=checksum)
+        except Exception as e:
+            log.warning('"%s" at offset %d' % (e, offset))
+            raise
+
+    return state, generator()
+
+
+def build_checkpoints(input, types, messages, every=CHECKPOINT, max_delta_t=None):
+    '''
+    Read the entire file, returning Checkpoints.
+    '''
+    checkpoints = Checkpoints(every=every)
+    state, tokens = stream_data(input, types, messages, no_validate=True, max_delta_t=max_delta_t,
+                                checkpoints=checkpoints)
+    for index, offset, token in tokens:
+        # accumulators are updated as records are parsed
+        if state.accumulators and isinstance(token, Defined): token.parse_token().force()
+    return checkpoints
@@ -5,6 +5,8 @@ from logging import getLogger
 from re import sub
 from struct import unpack, pack
 
+from .crc import crc16
+from .decoder import RowDecoder
 from .records import LazyRecord, merge_duplicates
 from ..profile.fields import TypedField, TIMESTAMP_GLOBAL_TYPE, DynamicField, CompositeField
 from ..profile.types import timestamp_to_time, time_to_timestamp
@@ -139,7 +141,10 @@ class FileHeader(ValidateToken):
         else:
             self.has_checksum = False
 
-    def validate(self, data, log, quiet=False, header_size=None, protocol_version=None, profile_version=None):
+    def validate(self, data, log, quiet=False, header_size=None, protocol_version=None, profile_version=None,
+                 size=None):
+        # size is the total size of the file, if data contains only the start (see stream.py)
+        if size is None: size = len(data)
         if self.header_size < 12:
             self._error('Header size too small (%d)' % self.header_size, log, quiet)
         if self.header_size not in (12, 14):
@@ -153,8 +158,8 @@ class FileHeader(ValidateToken):
         if profile_version is not None:
             if self.profile_version != profile_version:
                 self._error('Profile version incorrect (%d%d)' % (self.profile_version, profile_version), log, quiet)
-        if len(data) != self.data_size + len(self) + 2:
-            self._error('Data size incorrect (%d/%d+%d+2=%d)' % (len(data), self.data_size, len(self),
+        if size != self.data_size + len(self) + 2:
+            self._error('Data size incorrect (%d/%d+%d+2=%d)' % (size, self.data_size, len(self),
                                                                  self.data_size + len(self) + 2), log, quiet)
         if self.data_type != FIT:
             self._error('Data type incorrect (%s)' % (self.data_type,), log, quiet)
@@ -238,8 +243,15 @@ class Defined(Token):
             raise Exception('Could not parse timestamp')
 
     def parse_token(self, **options):
-        return self.definition.message.parse_message(self.data, self.definition, self.timestamp,
-                                                     accumulators=self._accumulators, **options)
+        if options.keys() <= {'warn'}:
+            # the common case can use the decoder compiled for the definition
+            message = self.definition.message
+            return LazyRecord(message.name, message.number, self.definition.identity, self.timestamp,
+                              self.definition.decoder.decode(self.data, self.timestamp,
+                                                             accumulators=self._accumulators, **options))
+        else:
+            return self.definition.message.parse_message(self.data, self.definition, self.timestamp,
+                                                         accumulators=self._accumulators, **options)
 
     def describe_fields(self, types):
         yield '%s - header (local message type %d - %s)' % \
@@ -367,6 +379,12 @@ class Definition(Token):
         self.identity = Identity(self.message.name, state.definition_counter)
         self.fields = self.__process_fields(self._make_fields(data, state), state)
         self.accumulators = state.accumulators
+        self.is_selected = state.selects(self.message.name)
+        if self.global_message_no == FIELD_DESCRIPTION:
+            self.decoded_fields = self.fields  # needed by DeveloperField
+        else:
+            self.decoded_fields = self.__decoded_fields(state.field_names if self.is_selected else ())
+        self.decoder = RowDecoder(self)
         super().__init__(tag, False, data[0:overhead+3*len(self.fields)])
         state.definitions[self.local_message_type] = self
 
@@ -402,6 +420,27 @@ class Definition(Token):
         self.size = offset
         return tuple(self.__sorted(fields))
 
+    def __decoded_fields(self, names):
+        # fields that must be decoded to give the named values (None for all) and update accumulators
+        if names is None:
+            return self.fields
+        return tuple(field for field in self.fields if self.__is_needed(field, names))
+
+    def __is_needed(self, field, names):
+        if field is self.timestamp_field:
+            return True
+        if not field.field:
+            return '@%d:%d' % (field.start, field.finish) in names
+        accumulators = {}
+        field.field.register_accumulator(accumulators)
+        if accumulators:
+            return True
+        if not self.is_selected:
+            return False
+        if isinstance(field.field, DynamicField):
+            return True  # the name depends on other fields
+        return any(name in names or name in self.references for name in self.__provided_by(field))
+
     def __provided_by(self, field):
         yield field.name
         if isinstance(field.field, CompositeField):
@@ -458,8 +497,8 @@ class Definition(Token):
     def parse_token(self, raw_data=False, **options):
         data = {'local_message_type': ((self.data[0:1],
                                         str(self.local_message_type)), '') if raw_data else self.local_message_type,
-                'reserved': self.data[1:2],
-                'architecture': self.data[2:3],
+                'reserved': bytes(self.data[1:2]),
+                'architecture': bytes(self.data[2:3]),
                 'message_number': ((self.data[3:5], self.message.name), '') if raw_data else self.global_message_no,
                 'no_of_fields': self.data[5:6] if raw_data else self.data[5]}
         if not raw_data:
@@ -505,27 +544,16 @@ class DeveloperDefinition(Definition):
 class Checksum(ValidateToken):
 
     @staticmethod
-    def crc(data):
-
-        CRC = [0x0000, 0xCC01, 0xD801, 0x1400, 0xF001, 0x3C00, 0x2800, 0xE401,
-               0xA001, 0x6C00, 0x7800, 0xB401, 0x5000, 0x9C01, 0x8801, 0x4400]
-
-        checksum = 0
-        for byte in data:
-            tmp = CRC[checksum & 0xf]
-            checksum = (checksum >> 4) & 0xfff
-            checksum = checksum ^ tmp ^ CRC[byte & 0xf]
-            tmp = CRC[checksum & 0xf]
-            checksum = (checksum >> 4) & 0xfff
-            checksum = checksum ^ tmp ^ CRC[(byte >> 4) & 0xf]
-        return checksum
+    def crc(data, checksum=0):
+        return crc16(data, checksum)
 
     def __init__(self, data):
         super().__init__('CRC', False, data)
         self.checksum = unpack('<H', self.data)[0]
 
-    def validate(self, all_data, log, quiet=False):
-        checksum = self.crc(all_data[:-2])
+    def validate(self, all_data, log, quiet=False, checksum=None):
+        # checksum can be given if it was calculated incrementally (see stream.py)
+        if checksum is None: checksum = self.crc(all_data[:-2])
         if checksum != self.checksum:
             self._error('Bad checksum (%04x/%04x)' % (checksum, self.checksum), log, quiet)
 
@@ -562,10 +590,13 @@ def token_factory(data, state):
 
 class State:
 
-    def __init__(self, types, messages, max_delta_t=None):
+    def __init__(self, types, messages, max_delta_t=None, record_names=None, field_names=None):
         self.types = types
         self.messages = messages
         self.max_delta_t = max_delta_t
+        # if given, only these messages and fields are decoded (see Definition.decoded_fields)
+        self.record_names = record_names
+        self.field_names = field_names
         self.dev_fields = defaultdict(lambda: WarnDict(log, 'No definition for developer field %s'))
         self.definitions = WarnDict(log, 'No definition for local message type %s')
         self.definition_counter = Counter()
@@ -589,8 +620,12 @@ class State:
                 raise Exception('Timestep decreased (%s/%s)' % (self._timestamp, timestamp))
         return timestamp
 
+    def selects(self, name):
+        return not self.record_names or name in self.record_names
+
     def copy(self):
-        copy = State(self.types, self.messages, self.max_delta_t)
+        copy = State(self.types, self.messages, self.max_delta_t,
+                     record_names=self.record_names, field_names=self.field_names)
         copy.dev_fields.update(self.dev_fields)
         copy.definitions.update(self.definitions)
         copy.definition_counter.update(self.definition_counter)
@@ -0,0 +1,185 @@
+from io import BytesIO
+from logging import getLogger
+from mmap import mmap, ACCESS_READ
+from pickle import Pickler, Unpickler, dumps, loads
+from struct import Struct
+
+from .messages import Missing
+from .types import AbstractType, auto_type
+from ...lib.data import WarnList
+
+log = getLogger(__name__)
+
+'''
+A compact, lazily loaded format for the profile.
+
+Each type and message is pickled separately, with references between them (and to the log) replaced by
+persistent ids.  An index of names (and message numbers) to (offset, length) in the data is stored at the
+start of the file, which is mmapped, so only the types and messages needed by a given FIT file are unpickled.
+
+    MAGIC | index length (8 bytes) | pickled index | data (pickled types and messages)
+'''
+
+MAGIC = b'CH2PROF1'
+LENGTH = Struct('<Q')
+LOG = 'log'
+MESSAGES = 'messages'
+NUMBERS = 'numbers'
+TYPE = 'type'
+TYPES = 'types'
+BASE_TYPES = 'base_types'
+OVERRIDES = 'overrides'
+
+
+class _Pickler(Pickler):
+
+    def __init__(self, file, nlog, types, root):
+        super().__init__(file)
+        self.__nlog = nlog
+        self.__types = types
+        self.__root = root
+
+    def persistent_id(self, obj):
+        if obj is self.__nlog:
+            return LOG
+        if isinstance(obj, AbstractType) and obj is not self.__root and self.__types.get(obj.name) is obj:
+            return TYPE, obj.name
+        return None
+
+
+class _Unpickler(Unpickler):
+
+    def __init__(self, file, nlog, types):
+        super().__init__(file)
+        self.__nlog = nlog
+        self.__types = types
+
+    def persistent_load(self, pid):
+        if pid == LOG:
+            return self.__nlog
+        elif pid[0] == TYPE:
+            return self.__types.profile_to_type(pid[1])
+        else:
+            raise Exception('Unexpected persistent id %r' % (pid,))
+
+
+def write_lazy_profile(path, nlog, types, messages):
+    '''
+    Write the profile (as read by read_external_profile) to path.
+    '''
+    all_types = dict((type.name, type) for type in types.types())
+    index = {TYPES: {}, MESSAGES: {}, NUMBERS: {},
+             BASE_TYPES: [type.name for type in types.base_types], OVERRIDES: set(types.overrides)}
+    blobs, offset = [], 0
+
+    def add(group, name, obj):
+        nonlocal offset
+        buffer = BytesIO()
+        _Pickler(buffer, nlog, all_types, obj).dump(obj)
+        blob = buffer.getvalue()
+        index[group][name] = (offset, len(blob))
+        blobs.append(blob)
+        offset += len(blob)
+
+    for type in all_types.values():
+        add(TYPES, type.name, type)
+    for message in messages.messages():
+        add(MESSAGES, message.name, message)
+        if message.number is not None:
+            index[NUMBERS][message.number] = message.name
+    header = dumps(index)
+    with open(path, 'wb') as output:
+        output.write(MAGIC)
+        output.write(LENGTH.pack(len(header)))
+        output.write(header)
+        for blob in blobs:
+            output.write(blob)
+
+
+class LazyProfile:
+    '''
+    The mmapped file and index shared by LazyTypes and LazyMessages.
+    '''
+
+    def __init__(self, path, nlog):
+        self.nlog = nlog
+        with open(path, 'rb') as input:
+            self.__map = mmap(input.fileno(), 0, access=ACCESS_READ)
+        if self.__map[:len(MAGIC)] != MAGIC:
+            raise Exception('%s is not a compact profile' % path)
+        length, = LENGTH.unpack_from(self.__map, len(MAGIC))
+        start = len(MAGIC) + LENGTH.size
+        self.index = loads(self.__map[start:start + length])
+        self.__start = start + length
+        self.types = LazyTypes(self)
+        self.messages = LazyMessages(self)
+
+    def load(self, group, name):
+        offset, length = self.index[group][name]
+        offset += self.__start
+        return _Unpickler(BytesIO(self.__map[offset:offset + length]), self.nlog, self.types).load()
+
+
+class LazyTypes:
+    '''
+    Provides the same interface as Types, but unpickles each type on first use.
+    '''
+
+    def __init__(self, profile):
+        self.__profile = profile
+        self.__types = {}
+        self.__base_types = None
+        self.overrides = profile.index[OVERRIDES]
+
+    @property
+    def base_types(self):
+        if self.__base_types is None:
+            self.__base_types = WarnList(self.__profile.nlog, 'No base type for number %r')
+            self.__base_types.extend(self.profile_to_type(name) for name in self.__profile.index[BASE_TYPES])
+        return self.__base_types
+
+    def is_type(self, name):
+        return name in self.__types or name in self.__profile.index[TYPES]
+
+    def profile_to_type(self, name, auto_create=False):
+        if name not in self.__types:
+            if name in self.__profile.index[TYPES]:
+                self.__types[name] = self.__profile.load(TYPES, name)
+            else:
+                type = auto_type(self.__profile.nlog, name) if auto_create else None
+                if type is None:
+                    raise KeyError('No type for profile %r' % (name,))
+                self.__types[name] = type
+        return self.__types[name]
+
+
+class LazyMessages:
+    '''
+    Provides the same interface as Messages, but unpickles each message on first use.
+    '''
+
+    def __init__(self, profile):
+        self.__profile = profile
+        self.__messages = {}
+
+    def profile_to_message(self, name):
+        if name not in self.__messages:
+            self.__messages[name] = self.__profile.load(MESSAGES, name)
+        return self.__messages[name]
+
+    def number_to_message(self, number):
+        try:
+            return self.profile_to_message(self.__profile.index[NUMBERS][number])
+        except KeyError:
+            message = Missing(self.__profile.nlog, number)
+            self.__messages[message.name] = message
+            self.__profile.index[NUMBERS][number] = message.name
+            return message
+
+
+def read_lazy_profile(path, nlog):
+    '''
+    Return (types, messages), loaded on demand from path.
+    '''
+    profile = LazyProfile(path, nlog)
+    return profile.types, profile.messages
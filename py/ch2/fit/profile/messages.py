@@ -110,6 +110,9 @@ class Messages:
     def profile_to_message(self, name):
         return self.__profile_to_message[name]
 
+    def messages(self):
+        return self.__profile_to_message.values()
+
     def number_to_message(self, number):
         try:
             return self.__number_to_message[number]
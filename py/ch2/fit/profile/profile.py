@@ -4,15 +4,18 @@ from os.path import join, dirname
 from pickle import load, dump
 
 import openpyxl as xls
-from pkg_resources import resource_stream
+from pkg_resources import resource_stream, resource_string, resource_exists, resource_filename
 
+from .lazy import read_lazy_profile, write_lazy_profile
 from .messages import Messages
 from .support import NullableLog
 from .types import Types
 from ...commands.args import PACKAGE_FIT_PROFILE
+from ...common.io import file_hash, data_hash
 
 log = getLogger(__name__)
 PROFILE_NAME = 'global-profile.pkl'
+LAZY_PROFILE_NAME = 'global-profile.lazy'
 PROFILE = []
 
 
@@ -25,6 +28,10 @@ def read_external_profile(path, warn=False):
 
 
 def read_internal_profile():
+    if not PROFILE and resource_exists(__name__, LAZY_PROFILE_NAME):
+        log.debug('Opening compact profile')
+        path = resource_filename(__name__, LAZY_PROFILE_NAME)
+        PROFILE.append((None,) + read_lazy_profile(path, NullableLog(log)))
     if not PROFILE:
         log.debug('Unpickling profile')
         try:
@@ -51,6 +58,18 @@ def read_profile(warn=False, profile_path=None):
     return types, messages
 
 
+def profile_version(profile_path=None):
+    '''
+    A hash of the profile, used to invalidate cached data when the profile changes.
+    '''
+    if profile_path:
+        return file_hash(profile_path)
+    elif resource_exists(__name__, LAZY_PROFILE_NAME):
+        return data_hash(resource_string(__name__, LAZY_PROFILE_NAME))
+    else:
+        return data_hash(resource_string(__name__, PROFILE_NAME))
+
+
 def read_fit(fit_path):
     log.debug('Reading fit file from %s' % fit_path)
     with open(fit_path, 'rb') as input:
@@ -65,6 +84,9 @@ def pickle_profile(in_path, warn=False):
     log.info('Writing to %s' % out_path)
     with open(out_path, 'wb') as output:
         dump((nlog, types, messages), output)
+    lazy_path = join(dirname(__file__), LAZY_PROFILE_NAME)
+    log.info('Writing to %s' % lazy_path)
+    write_lazy_profile(lazy_path, nlog, types, messages)
     # test loading
     log.info('Test loading from %r' % PROFILE_NAME)
     log.info('Loaded %s, %s' % read_internal_profile())
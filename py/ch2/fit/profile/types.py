@@ -221,6 +221,9 @@ class AutoInteger(StructSupport):
     def is_bad(self, bytes, count, endian):
         return self._all_bad(bytes, self.__bad[endian], count)
 
+    def bad_bytes(self, endian):
+        return bytes(self.__bad[endian])
+
     def parse_type(self, data, count, endian, timestamp, check_bad=True, **options):
         return self._unpack(data, self.__formats, self.__bad, count, endian, check_bad=check_bad, **options)
 
@@ -259,6 +262,9 @@ class Date(AliasInteger):
         if time is not None:
             return timestamp_to_time(time, tzinfo=tzinfo)
 
+    def to_time(self, time):
+        return self.convert(time, tzinfo=self.__tzinfo)
+
     def parse_type(self, data, count, endian, timestamp, raw_time=False, **options):
         times = super().parse_type(data, count, endian, timestamp, raw_time=raw_time, **options)
         if times and not raw_time:
@@ -338,6 +344,9 @@ class AutoFloat(StructSupport):
     def is_bad(self, bytes, count, endian):
         return self._all_bad(bytes, self.__bad[endian], count)
 
+    def bad_bytes(self, endian):
+        return bytes(self.__bad[endian])
+
     def parse_type(self, data, count, endian, timestamp, check_bad=True, **options):
         return self._unpack(data, self.__formats, self.__bad, count, endian, check_bad=check_bad, **options)
 
@@ -441,20 +450,33 @@ class Types:
     def is_type(self, name):
         return name in self.__profile_to_type
 
+    def types(self):
+        return self.__profile_to_type.values()
+
     def profile_to_type(self, name, auto_create=False):
         try:
             return self.__profile_to_type[name]
         except KeyError:
             if auto_create:
-                for cls in (AutoFloat, AutoInteger):
-                    match = cls.pattern.match(name)
-                    if match:
-                        self.__log.info('Auto-adding type %s for %r' % (cls.__name__, name))
-                        self.__add_type(cls(self.__log, name))
-                        return self.profile_to_type(name)
+                type = auto_type(self.__log, name)
+                if type:
+                    self.__add_type(type)
+                    return self.profile_to_type(name)
             raise
 
 
+def auto_type(log, name):
+    '''
+    A new AutoFloat or AutoInteger for the name, or None if the name does not match either.
+    '''
+    for cls in (AutoFloat, AutoInteger):
+        match = cls.pattern.match(name)
+        if match:
+            log.info('Auto-adding type %s for %r' % (cls.__name__, name))
+            return cls(log, name)
+    return None
+
+
 class Row(namedtuple('BaseRow',
                      'type_name, base_type, value_name, value, comment')):
 
@@ -78,26 +78,30 @@ def summarize(format, data, all_fields=False, all_messages=False, internal=False
 
 
 def summarize_tokens(data, after_bytes=None, limit_bytes=-1, after_records=None, limit_records=-1,
-                     warn=False, no_validate=False, max_delta_t=None, profile_path=None, output=stdout):
+                     warn=False, no_validate=False, max_delta_t=None, profile_path=None, checkpoints=None,
+                     output=stdout):
 
     types, messages, tokens = \
         filtered_tokens(data,
                         after_bytes=after_bytes, limit_bytes=limit_bytes,
                         after_records=after_records, limit_records=limit_records,
-                        warn=warn, no_validate=no_validate, max_delta_t=max_delta_t, profile_path=profile_path)
+                        warn=warn, no_validate=no_validate, max_delta_t=max_delta_t, profile_path=profile_path,
+                        checkpoints=checkpoints)
 
     for index, offset, token in tokens:
         print('%03d %05d %s' % (index, offset, token), file=output)
 
 
 def summarize_fields(data, after_bytes=None, limit_bytes=-1, after_records=None, limit_records=-1,
-                     warn=False, no_validate=False, max_delta_t=None, profile_path=None, output=stdout):
+                     warn=False, no_validate=False, max_delta_t=None, profile_path=None, checkpoints=None,
+                     output=stdout):
 
     types, messages, tokens = \
         filtered_tokens(data,
                         after_bytes=after_bytes, limit_bytes=limit_bytes,
                         after_records=after_records, limit_records=limit_records,
-                        warn=warn, no_validate=no_validate, max_delta_t=max_delta_t, profile_path=profile_path)
+                        warn=warn, no_validate=no_validate, max_delta_t=max_delta_t, profile_path=profile_path,
+                        checkpoints=checkpoints)
 
     for index, offset, token in tokens:
         print('%03d %05d %s' % (index, offset, token), file=output)
@@ -108,7 +112,7 @@ def summarize_fields(data, after_bytes=None, limit_bytes=-1, after_records=None,
 def summarize_records(data, all_fields=False, all_messages=False, internal=False,
                       after_bytes=None, limit_bytes=-1, after_records=None, limit_records=-1,
                       record_names=None, field_names=None,
-                      warn=False, no_validate=False, max_delta_t=None, profile_path=None,
+                      warn=False, no_validate=False, max_delta_t=None, profile_path=None, checkpoints=None,
                       width=None, output=stdout):
 
     types, messages, records = \
@@ -117,7 +121,8 @@ def summarize_records(data, all_fields=False, all_messages=False, internal=False
                          after_records=after_records, limit_records=limit_records,
                          record_names=record_names, field_names=field_names,
                          warn=warn, no_validate=no_validate, internal=internal,
-                         profile_path=profile_path, max_delta_t=max_delta_t, pipeline=[merge_duplicates])
+                         profile_path=profile_path, max_delta_t=max_delta_t, pipeline=[merge_duplicates],
+                         checkpoints=checkpoints)
 
     records = list(records)
     print(file=output)
@@ -127,7 +132,7 @@ def summarize_records(data, all_fields=False, all_messages=False, internal=False
 def summarize_tables(data, all_fields=False, all_messages=False, internal=False,
                      after_bytes=None, limit_bytes=-1, after_records=None, limit_records=-1,
                      record_names=None, field_names=None,
-                     warn=False, no_validate=False, max_delta_t=None, profile_path=None,
+                     warn=False, no_validate=False, max_delta_t=None, profile_path=None, checkpoints=None,
                      width=None, output=stdout):
 
     types, messages, records = \
@@ -136,7 +141,8 @@ def summarize_tables(data, all_fields=False, all_messages=False, internal=False,
                          after_records=after_records, limit_records=limit_records,
                          record_names=record_names, field_names=field_names,
                          warn=warn, no_validate=no_validate, internal=internal,
-                         profile_path=profile_path, max_delta_t=max_delta_t, pipeline=[merge_duplicates])
+                         profile_path=profile_path, max_delta_t=max_delta_t, pipeline=[merge_duplicates],
+                         checkpoints=checkpoints)
 
     records = list(record[2] for record in records)
     counts = Counter(record.identity for record in records)
@@ -261,12 +267,13 @@ def summarize_grep(data, grep, name_file=None, match=1, compact=False, context=F
 
 def summarize_csv(data, after_bytes=0, limit_bytes=-1, after_records=0, limit_records=-1, internal=False,
                   record_names=None, field_names=None, warn=False, no_header=False, max_delta_t=None,
-                  profile_path=None, output=stdout):
+                  profile_path=None, checkpoints=None, output=stdout):
     types, messages, tokens = \
         filtered_tokens(data,
                         after_bytes=after_bytes, limit_bytes=limit_bytes,
                         after_records=after_records, limit_records=limit_records,
-                        warn=warn, no_validate=no_header, max_delta_t=max_delta_t, profile_path=profile_path)
+                        warn=warn, no_validate=no_header, max_delta_t=max_delta_t, profile_path=profile_path,
+                        checkpoints=checkpoints)
     for index, offset, token in tokens:
         if hasattr(token, 'describe_csv'):
             values = ','.join(str(component)
@@ -1,5 +1,6 @@
 
 from collections import namedtuple
+from functools import lru_cache
 from inspect import stack, getmodule
 from json import loads
 from logging import getLogger
@@ -62,8 +63,14 @@ def kargs_to_attr(**kargs):
     return dict_to_attr(kargs)
 
 
+@lru_cache(maxsize=1024)
+def _attr_class(names):
+    # creating a namedtuple class is slow (it evals source) so reuse classes for the same names
+    return namedtuple('Attr', names, rename=True)
+
+
 def dict_to_attr(kargs):
-    return namedtuple('Attr', kargs.keys(), rename=True)(*kargs.values())
+    return _attr_class(tuple(kargs.keys()))(*kargs.values())
 
 
 class MutableAttr(dict):
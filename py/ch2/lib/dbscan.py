@@ -1,58 +1,179 @@
-
 from abc import ABC, abstractmethod
-from collections import defaultdict
-
-
-class DBSCAN(ABC):
-
-    def __init__(self, epsilon, minpts):
-        self.__epsilon = epsilon
-        self.__minpts = minpts
-
-    def run(self, candidates):
-        count, label = self.scan(candidates)
-        return sorted(self.prune(count, label), reverse=True,
-                      key=lambda g: len(g) + (min(g) / max(g)))  # try to give repeatability
-
-    def prune(self, count, label):
-        index = defaultdict(list)
-        for key in label.keys():
-            if label[key]:
-                index[label[key]].append(key)
-        for i in range(count):
-            if len(index[i+1]) < self.__minpts:
-                del index[i+1]
-        return list(index.values())
-
-    def scan(self, candidates):
-        label = defaultdict(lambda: None)
-        count = 0
-        for candidate in candidates:
-            if label[candidate] is None:
-                neighbours = list(self.neighbourhood(candidate, self.__epsilon))
-                if len(neighbours) >= self.__minpts:
-                    count += 1
-                    label[candidate] = count
-                    self.grow(count, neighbours, label)
-                else:
-                    label[candidate] = 0
-        return count, label
-
-    def grow(self, count, stack, label):
-        n = 0
-        while stack:
-            candidate = stack.pop()
-            neighbours = list(self.neighbourhood(candidate, self.__epsilon))
-            if len(neighbours) >= self.__minpts:
-                for neighbour in neighbours:
-                    if not label[neighbour]:
-                        if label[neighbour] is None:
-                            stack.append(neighbour)
-                        label[neighbour] = count
-                        n += 1
-            elif label[candidate] is None:
-                label[candidate] = 0  # we know this is a leaf so save some time
+from logging import getLogger
+
+import numpy as np
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import connected_components
+from scipy.spatial import cKDTree
+
+from ..rtree import MatchType
+
+log = getLogger(__name__)
+
+'''
+DBSCAN over a precomputed neighbour graph.
+
+A neighbour index (sparse distance matrix, KD-tree or R-tree) is queried once, at the largest epsilon
+needed, giving all pairs of neighbours as CSR arrays.  Labelling is then done with numpy (core points
+are those with at least minpts neighbours, clusters are connected components of core points, and other
+points join the cluster of their nearest core neighbour), so several epsilons can be tried cheaply.
+
+Points are numbered 0..n-1; labels are an array with -1 for noise.
+'''
+
+NOISE = -1
+
+
+def csr(n, rows, columns, distances):
+    '''
+    Sort (row, column, distance) triples into CSR arrays (indptr, indices, distances).
+    '''
+    rows, columns, distances = np.asarray(rows, dtype=int), np.asarray(columns, dtype=int), np.asarray(distances)
+    order = np.argsort(rows, kind='stable')
+    indptr = np.searchsorted(rows[order], np.arange(n + 1))
+    return indptr, columns[order], distances[order]
+
+
+class Neighbours(ABC):
+    '''
+    An index over n points that can find all pairs of neighbours closer than epsilon.
+    '''
+
+    def __init__(self, n):
+        self.n = n
+
+    def __len__(self):
+        return self.n
 
     @abstractmethod
-    def neighbourhood(self, candidate, epsilon):
+    def graph(self, epsilon):
+        '''
+        CSR arrays (indptr, indices, distances) of all pairs (in both directions, excluding self)
+        closer than epsilon.
+        '''
         raise NotImplementedError()
+
+
+class MatrixNeighbours(Neighbours):
+    '''
+    A precomputed (symmetric) sparse distance matrix, as CSR arrays.  Zero distances are kept.
+    '''
+
+    def __init__(self, indptr, indices, distances):
+        super().__init__(len(indptr) - 1)
+        self.indptr, self.indices, self.distances = indptr, indices, distances
+
+    @classmethod
+    def from_pairs(cls, n, lo, hi, distances):
+        '''
+        Each (lo, hi, distance) is added in both directions.
+        '''
+        lo, hi, distances = np.asarray(lo, dtype=int), np.asarray(hi, dtype=int), np.asarray(distances)
+        return cls(*csr(n, np.concatenate([lo, hi]), np.concatenate([hi, lo]), np.tile(distances, 2)))
+
+    def graph(self, epsilon):
+        keep = self.distances < epsilon
+        rows = np.repeat(np.arange(self.n), np.diff(self.indptr))
+        return csr(self.n, rows[keep], self.indices[keep], self.distances[keep])
+
+
+class KDTreeNeighbours(Neighbours):
+    '''
+    A KD-tree over (projected) coordinates, with euclidean distances.
+    '''
+
+    def __init__(self, xy):
+        xy = np.asarray(xy, dtype=float).reshape(-1, 2)
+        super().__init__(len(xy))
+        self.tree = cKDTree(xy)
+
+    def graph(self, epsilon):
+        pairs = self.tree.sparse_distance_matrix(self.tree, epsilon, output_type='ndarray')
+        keep = (pairs['i'] != pairs['j']) & (pairs['v'] < epsilon)
+        pairs = pairs[keep]
+        return csr(self.n, pairs['i'], pairs['j'], pairs['v'])
+
+
+class RTreeNeighbours(Neighbours):
+    '''
+    An R-tree (see ch2.rtree) whose values are the point numbers.  The points are queried in batches with
+    get_items_many() (with a border of epsilon) and the candidates filtered with the tree's distances()
+    (so distances are in the tree's units - metres for the spherical trees, where the border is on the
+    local tangent plane).
+    '''
+
+    BATCH = 1000
+
+    def __init__(self, rtree, points):
+        super().__init__(len(points))
+        self.rtree, self.points = rtree, np.asarray(points, dtype=float).reshape((-1, 2))
+
+    @classmethod
+    def from_points(cls, tree_cls, points, **kargs):
+        rtree = tree_cls(**kargs)
+        rtree.bulk_load([([point], i) for i, point in enumerate(points)])
+        return cls(rtree, points)
+
+    def graph(self, epsilon):
+        pairs = [np.empty((0, 2), dtype=int)]
+        for start in range(0, self.n, self.BATCH):
+            found = self.rtree.get_items_many(self.points[start:start + self.BATCH],
+                                              match=MatchType.OVERLAP, border=epsilon)
+            pairs.append(np.array([(start + i, j) for i, (_, j) in found], dtype=int).reshape((-1, 2)))
+        rows, columns = np.concatenate(pairs).T
+        rows, columns = rows[rows != columns], columns[rows != columns]
+        distances = self.rtree.distances(self.points[rows], self.points[columns])
+        near = distances < epsilon
+        return csr(self.n, rows[near], columns[near], distances[near])
+
+
+def label(graph, epsilon, minpts):
+    '''
+    Label the points given the graph (CSR arrays, which may include pairs at or beyond epsilon).
+    A point is core if it has at least minpts neighbours (not counting itself).
+    '''
+    indptr, indices, distances = graph
+    n = len(indptr) - 1
+    rows = np.repeat(np.arange(n), np.diff(indptr))
+    near = distances < epsilon
+    rows, columns, distances = rows[near], indices[near], distances[near]
+    core = np.bincount(rows, minlength=n) >= minpts
+    labels = np.full(n, NOISE)
+    if not core.any():
+        return labels
+    # clusters are connected components of core points
+    both = core[rows] & core[columns]
+    links = csr_matrix((np.ones(np.count_nonzero(both)), (rows[both], columns[both])), shape=(n, n))
+    _, components = connected_components(links, directed=False)
+    _, labels[core] = np.unique(components[core], return_inverse=True)
+    # border points join the cluster of their nearest core neighbour
+    edge = ~core[rows] & core[columns]
+    rows, columns, distances = rows[edge], columns[edge], distances[edge]
+    order = np.lexsort((distances, rows))
+    border, first = np.unique(rows[order], return_index=True)
+    labels[border] = labels[columns[order][first]]
+    return labels
+
+
+def dbscan(neighbours, epsilon, minpts):
+    return label(neighbours.graph(epsilon), epsilon, minpts)
+
+
+def dbscan_many(neighbours, epsilons, minpts):
+    '''
+    Label for each epsilon, querying the index only once (at the largest).
+    '''
+    epsilons = list(epsilons)
+    if not epsilons: return []
+    graph = neighbours.graph(max(epsilons))
+    return [label(graph, epsilon, minpts) for epsilon in epsilons]
+
+
+def groups(labels, ids=None, minpts=0):
+    '''
+    The members (ids, or point numbers) of each cluster with at least minpts members, largest first.
+    '''
+    ids = np.arange(len(labels)) if ids is None else np.asarray(ids)
+    clusters = [ids[labels == i].tolist() for i in range(labels.max() + 1 if len(labels) else 0)]
+    return sorted((cluster for cluster in clusters if len(cluster) >= minpts),
+                  key=lambda g: (-len(g), min(g)))  # largest first, then by smallest member for repeatability
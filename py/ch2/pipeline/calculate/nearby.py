@@ -2,28 +2,68 @@
 from collections import defaultdict, namedtuple
 from itertools import groupby
 from logging import getLogger
-from random import uniform
+from os.path import join, exists
+from pickle import dump, load
 
-from sqlalchemy import inspect, select, alias, and_, distinct, func, not_
+import numpy as np
+from geoalchemy2 import Geometry
+from sqlalchemy import inspect, select, alias, and_, distinct, func, not_, cast
 from sqlalchemy.orm import aliased
 from sqlalchemy.sql.functions import count
 
 from .utils import ProcessCalculator, RerunWhenNewActivitiesMixin
 from ..pipeline import OwnerInMixin
+from ...common.io import data_hash, atomic_write
 from ...common.log import log_current_exception
-from ...lib.dbscan import DBSCAN
+from ...common.names import URI
+from ...lib.dbscan import MatrixNeighbours, dbscan, groups
 from ...lib.optimizn import expand_max
 from ...names import N
-from ...rtree import MatchType
-from ...rtree.spherical import SQRTree
+from ...rtree import MatchType, INDEXES
+from ...rtree.spherical import RADIUS, RADIAN
 from ...sql import ActivityJournal, ActivityGroup, ActivitySimilarity, ActivityNearby, StatisticName, \
     StatisticJournal, StatisticJournalFloat, Timestamp
+from ...sql.utils import WGS84_SRID
 
 log = getLogger(__name__)
+# increment when saved indexes become invalid (2 - LocalTangent scaled longitude by the cosine of degrees)
+INDEX_VERSION = 2
+INDEX_DIR = f'{{base}}/{{version}}/similarity-{INDEX_VERSION}'
 Nearby = namedtuple('Nearby', 'constraint, activity_group, border, start, finish, '
                               'latitude, longitude, height, width, fraction')
 
 
+class SimilarityIndex:
+    '''
+    The (sampled) points of the activities already compared, in a spatial index (an R-tree or a hash grid;
+    see INDEXES).  This is saved between runs (with the index's local tangent origin) so that only the
+    points of new activities are read and added.
+    '''
+
+    def __init__(self, fraction, border, index='rtree'):
+        self.fraction = fraction
+        self.border = border
+        self.index = index
+        self.rtree = INDEXES[index](default_match=MatchType.OVERLAP, default_border=border)
+        self.points = defaultdict(list)  # activity journal id: [(lon, lat), ...]
+
+    def add(self, aj_id, lon_lats):
+        '''
+        Add the points of an activity together (the hash grid then loads them in a single bulk_load rather
+        than merging its keys once per point; the R-trees still add them one at a time, since their
+        bulk_load rebuilds the whole tree).
+        '''
+        self.rtree.add_all([([lon_lat], aj_id) for lon_lat in lon_lats])
+        self.points[aj_id].extend(lon_lats)
+
+    def discard(self, aj_id):
+        for lon, lat in self.points.pop(aj_id, []):
+            self.rtree.delete([(lon, lat)], value=aj_id, match=MatchType.EQUALS)
+
+    def n_points(self):
+        return defaultdict(lambda: 0, ((aj_id, len(points)) for aj_id, points in self.points.items()))
+
+
 class SimilarityCalculator(RerunWhenNewActivitiesMixin, ProcessCalculator):
     '''
     this seems to be more efficient than
@@ -39,9 +79,11 @@ class SimilarityCalculator(RerunWhenNewActivitiesMixin, ProcessCalculator):
     (caching st_transform(lo.route::geometry, lo.utm_srid) as utm_route doesn't help)
     '''
 
-    def __init__(self, *args, fraction=0.01, border=150, **kargs):
+    def __init__(self, *args, fraction=0.01, border=150, index='rtree', **kargs):
         self.fraction = fraction
         self.border = border
+        if index not in INDEXES: raise Exception(f'Unknown index {index} (not one of {", ".join(INDEXES)})')
+        self.index = index
         super().__init__(*args, **kargs)
 
     def startup(self):
@@ -50,60 +92,91 @@ class SimilarityCalculator(RerunWhenNewActivitiesMixin, ProcessCalculator):
 
     def _run_one(self, missed):
         with self._config.db.session_context() as s:
-            rtree = SQRTree(default_match=MatchType.OVERLAP, default_border=self.border)
-            n_points = defaultdict(lambda: 0)
-            self._prepare(s, rtree, n_points, 30000)
+            index = self._load_index(s, 30000)
             n_overlaps = defaultdict(lambda: defaultdict(lambda: 0))
-            new_ids, affected_ids = self._count_overlaps(s, rtree, n_points, n_overlaps, 10000)
+            new_ids, affected_ids = self._count_overlaps(s, index, n_overlaps, 10000)
             # this clears itself beforehand
             # use explicit class to distinguish from subclasses (which compare against this)
             with Timestamp(owner=self.owner_out).on_success(s):
-                self._save(s, new_ids, affected_ids, n_points, n_overlaps, 10000)
-
-    def _prepare(self, s, rtree, n_points, delta):
-        n = 0
-        for aj_id_in, lon, lat in self._filter(self._aj_lon_lat(s, new=False)):
-            posn = [(lon, lat)]
-            rtree[posn] = aj_id_in
-            n_points[aj_id_in] += 1
-            n += 1
-            if n % delta == 0:
-                log.info(f'Loaded {n} points')
-        if n % delta:
-            log.info(f'Loaded {n} points')
-
-    def _count_overlaps(self, s, rtree, n_points, n_overlaps, delta):
+                self._save(s, new_ids, affected_ids, index.n_points(), n_overlaps, 10000)
+        self._save_index(index)
+
+    def _index_path(self):
+        dir = self._config.args._format_path(value=INDEX_DIR)
+        return join(dir, f'{self.__class__.__name__}-{data_hash(self._config.args._format(URI))}.pkl')
+
+    def _load_index(self, s, delta):
+        '''
+        Load the saved index if it is consistent with the database (activities that have since lost their
+        similarities are removed, and it must contain all others); otherwise build it from scratch.
+        '''
+        path, existing = self._index_path(), self._existing_ids(s)
+        if existing and exists(path):
+            try:
+                with open(path, 'rb') as input:
+                    index = load(input)
+                if (index.fraction, index.border, index.index) != (self.fraction, self.border, self.index):
+                    log.info('Similarity index has different parameters')
+                elif not existing.issubset(index.points):
+                    log.info('Similarity index is missing activities')
+                else:
+                    for aj_id in set(index.points) - existing:
+                        index.discard(aj_id)
+                    log.info(f'Loaded similarity index from {path}')
+                    return index
+            except Exception as e:
+                log.warning(f'Could not read similarity index from {path}: {e}')
+        index = SimilarityIndex(self.fraction, self.border, self.index)
+        self._prepare(s, index, delta)
+        return index
+
+    def _save_index(self, index):
+        path = self._index_path()
+        try:
+            with atomic_write(path) as output:
+                dump(index, output)
+            log.info(f'Saved similarity index to {path}')
+        except Exception as e:
+            log.warning(f'Could not save similarity index to {path}: {e}')
+
+    def _existing_ids(self, s):
+        return set(x[0] for x in s.query(distinct(ActivitySimilarity.activity_journal_lo_id)).all()). \
+            union(x[0] for x in s.query(distinct(ActivitySimilarity.activity_journal_hi_id)).all())
+
+    def _prepare(self, s, index, delta):
+        items = []
+        for aj_id_in, lon, lat in self._aj_lon_lat(s, new=False):
+            items.append(([(lon, lat)], aj_id_in))
+            index.points[aj_id_in].append((lon, lat))
+            if len(items) % delta == 0:
+                log.info(f'Read {len(items)} points')
+        index.rtree.bulk_load(items)  # much faster than adding one at a time
+        log.info(f'Loaded {len(items)} points')
+
+    def _count_overlaps(self, s, index, n_overlaps, delta):
         new_aj_ids, affected_aj_ids, n, no = [], set(), 0, 0
         for aj_id_in, aj_lon_lats in groupby(self._aj_lon_lat(s, new=True), key=lambda aj_lon_lat: aj_lon_lat[0]):
-            aj_lon_lats = list(self._filter(aj_lon_lats))  # reuse below
             seen_posns = set()
             new_aj_ids.append(aj_id_in)
             affected_aj_ids.add(aj_id_in)
-            for _, lon, lat in aj_lon_lats:
-                posn = [(lon, lat)]
-                for other_posn, aj_id_out in rtree.get_items(posn):
-                    if other_posn not in seen_posns:
-                        lo, hi = min(aj_id_in, aj_id_out), max(aj_id_in, aj_id_out)  # ordered pair
-                        affected_aj_ids.add(aj_id_out)
-                        n_overlaps[lo][hi] += 1
-                        no += 1
-                        seen_posns.add(other_posn)
-            for _, lon, lat in aj_lon_lats:  # adding after avoids matching ourselves
-                posn = [(lon, lat)]
-                rtree[posn] = aj_id_in
-                n_points[aj_id_in] += 1
-                n += 1
-                if n % delta == 0:
-                    log.info(f'Measured {n} points')
+            probes = [(lon, lat) for _, lon, lat in aj_lon_lats]
+            for _, (other_posn, aj_id_out) in index.rtree.get_items_many(probes):
+                if other_posn not in seen_posns:
+                    lo, hi = min(aj_id_in, aj_id_out), max(aj_id_in, aj_id_out)  # ordered pair
+                    affected_aj_ids.add(aj_id_out)
+                    n_overlaps[lo][hi] += 1
+                    no += 1
+                    seen_posns.add(other_posn)
+            index.add(aj_id_in, probes)  # adding after avoids matching ourselves
+            if (n + len(probes)) // delta > n // delta:
+                log.info(f'Measured {n + len(probes)} points')
+            n += len(probes)
         if n % delta:
             log.info(f'Measured {n} points')
         return new_aj_ids, affected_aj_ids
 
-    def _filter(self, lon_lats):
-        # todo - why random?  would sequential be better?
-        for lon_lat in lon_lats:
-            if uniform(0, 1 / self.fraction) < 1:
-                yield lon_lat
+    def _nth(self):
+        return max(1, int(0.5 + 1 / self.fraction))
 
     def _aj_lon_lat(self, s, new=True):
         from ..owners import ActivityReader
@@ -130,7 +203,9 @@ class SimilarityCalculator(RerunWhenNewActivitiesMixin, ProcessCalculator):
         existing = existing_lo.union(existing_hi).cte()
 
         # todo - has not been tuned for latest schema
-        stmt = select([sj_lat.c.source_id, sjf_lon.c.value, sjf_lat.c.value]). \
+        # every nth point (in time order) along each activity is selected in the database
+        i = func.row_number().over(partition_by=sj_lat.c.source_id, order_by=sj_lat.c.time).label('i')
+        stmt = select([sj_lat.c.source_id, sjf_lon.c.value.label('lon'), sjf_lat.c.value.label('lat'), i]). \
             select_from(sj_lat).select_from(sj_lon).select_from(sjf_lat).select_from(sjf_lat).select_from(aj). \
             where(and_(sj_lat.c.source_id == sj_lon.c.source_id,  # same source
                        sj_lat.c.time == sj_lon.c.time,            # same time
@@ -144,7 +219,10 @@ class SimilarityCalculator(RerunWhenNewActivitiesMixin, ProcessCalculator):
             stmt = stmt.where(func.not_(sj_lat.c.source_id.in_(existing)))
         else:
             stmt = stmt.where(sj_lat.c.source_id.in_(existing))
-        stmt = stmt.order_by(sj_lat.c.source_id)  # needed for seen logic
+        points = stmt.alias()
+        stmt = select([points.c.source_id, points.c.lon, points.c.lat]). \
+            where(points.c.i % self._nth() == 0). \
+            order_by(points.c.source_id, points.c.i)  # needed for seen logic
         yield from s.connection().execute(stmt)
 
     def _save(self, s, new_ids, affected_ids, n_points, n_overlaps, delta):
@@ -178,46 +256,147 @@ class SimilarityCalculator(RerunWhenNewActivitiesMixin, ProcessCalculator):
             log.info(f'Saved {n}')
 
 
-class NearbySimilarityDBSCAN(DBSCAN):
+def decode_points(wkb):
+    '''
+    A (n, 2) array of the coordinates in a WKB Point or MultiPoint.
+    '''
+    data = bytes(wkb)
+    order = '<' if data[0] == 1 else '>'
+    kind = int(np.frombuffer(data, dtype=order + 'u4', count=1, offset=1)[0])
+    if kind == 1:
+        return np.frombuffer(data, dtype=order + 'f8', count=2, offset=5).reshape(1, 2)
+    elif kind == 4:
+        n = int(np.frombuffer(data, dtype=order + 'u4', count=1, offset=5)[0])
+        point = np.dtype([('order', 'u1'), ('kind', order + 'u4'), ('x', order + 'f8'), ('y', order + 'f8')])
+        points = np.frombuffer(data, dtype=point, count=n, offset=9)
+        return np.stack([points['x'], points['y']], axis=1)
+    else:
+        raise Exception(f'Unexpected WKB type {kind}')
+
+
+def cell_keys(lon_lats, size, d_row=0, d_column=0):
+    '''
+    Integer keys for grid cells of about size metres (displaced by the given number of rows and columns).
+    Cell widths (in longitude) are fixed for each row, so neighbouring points share cells.
+    '''
+    step = size / (RADIUS * RADIAN)
+    row = np.floor(lon_lats[:, 1] / step).astype(np.int64) + d_row
+    width = step / np.maximum(np.cos((row + 0.5) * step * RADIAN), 1e-6)
+    column = np.floor(lon_lats[:, 0] / width).astype(np.int64) + d_column
+    return row * 2 ** 32 + column
+
 
-    def __init__(self, s, activity_group, epsilon, minpts):
-        super().__init__(epsilon, minpts)
-        self.__s = s
-        self.__activity_group = activity_group
+def grid_overlaps(ids, lon_lats, size):
+    '''
+    For each pair of different activities (a, b), the number of a's points that are in, or next to,
+    a grid cell (of about size metres) containing a point from b.  Returns arrays (a, b, count).
+    '''
+    ids = np.asarray(ids, dtype=np.int64)
+    occupied = np.unique(np.stack([cell_keys(lon_lats, size), ids]), axis=1)  # sorted by key
+    occupied_keys, occupied_ids = occupied
+    points, others = [], []
+    for d_row in (-1, 0, 1):
+        for d_column in (-1, 0, 1):
+            keys = cell_keys(lon_lats, size, d_row, d_column)
+            lo = np.searchsorted(occupied_keys, keys, side='left')
+            n = np.searchsorted(occupied_keys, keys, side='right') - lo
+            points.append(np.repeat(np.arange(len(keys)), n))
+            others.append(occupied_ids[np.arange(n.sum()) - np.repeat(np.cumsum(n) - n - lo, n)])
+    points, others = np.concatenate(points), np.concatenate(others)
+    different = others != ids[points]
+    points, others = np.unique(np.stack([points[different], others[different]]), axis=1)  # count points once
+    (a, b), count = np.unique(np.stack([ids[points], others]), axis=1, return_counts=True)
+    return a, b, count
+
+
+class RouteSimilarityCalculator(SimilarityCalculator):
+    '''
+    An alternative to SimilarityCalculator that reads points every spacing metres along the stored routes
+    (ActivityJournal.route_d, one row per activity) and counts overlaps on a grid (cells of border metres)
+    with numpy, rather than joining latitude and longitude statistics and querying an R-tree.
+    '''
+
+    def __init__(self, *args, spacing=100, **kargs):
+        self.spacing = spacing
+        super().__init__(*args, **kargs)
+
+    def startup(self):
+        log.info(f'Points every {self.spacing}m')
+        super(SimilarityCalculator, self).startup()
+
+    def _run_one(self, missed):
+        with self._config.db.session_context() as s:
+            existing = self._existing_ids(s)
+            ids, lon_lats = self._route_points(s)
+            all_ids, counts = np.unique(ids, return_counts=True)
+            n_points = defaultdict(lambda: 0, zip(all_ids.tolist(), counts.tolist()))
+            new_ids = set(all_ids.tolist()) - existing
+            affected_ids, n_overlaps = set(new_ids), defaultdict(lambda: defaultdict(lambda: 0))
+            for a, b, count in zip(*(x.tolist() for x in grid_overlaps(ids, lon_lats, self.border))):
+                if a in new_ids or b in new_ids:
+                    lo, hi = min(a, b), max(a, b)
+                    # match SimilarityCalculator - count points of the activity that was there first
+                    first = hi if lo in new_ids and hi not in new_ids else lo
+                    if a == first:
+                        n_overlaps[lo][hi] = count
+                        affected_ids.update((a, b))
+            log.info(f'{len(new_ids)} new activities')
+            with Timestamp(owner=self.owner_out).on_success(s):
+                self._save(s, new_ids, affected_ids, n_points, n_overlaps, 10000)
+
+    def _route_points(self, s):
+        route = func.ST_Force2D(cast(ActivityJournal.route_d, Geometry(srid=WGS84_SRID)))
+        length = func.ST_Length(ActivityJournal.route_d)  # metres
+        fraction = func.least(1, self.spacing / func.greatest(length, self.spacing))
+        ids, lon_lats = [], []
+        for aj_id, wkb in s.query(ActivityJournal.id,
+                                  func.ST_AsBinary(func.ST_LineInterpolatePoints(route, fraction, True))). \
+                filter(ActivityJournal.route_d != None).order_by(ActivityJournal.id).all():
+            points = decode_points(wkb)
+            ids.append(np.full(len(points), aj_id, dtype=np.int64))
+            lon_lats.append(points)
+        log.info(f'Read {sum(len(x) for x in ids)} points from {len(ids)} routes')
+        if ids:
+            return np.concatenate(ids), np.concatenate(lon_lats)
+        else:
+            return np.zeros(0, dtype=np.int64), np.zeros((0, 2))
+
+
+class SimilarityMatrix:
+    '''
+    The similarities between activities in a group, loaded once (a single query) as a sparse matrix of
+    distances (1 - similarity / max similarity) between activities numbered by their position in ids.
+    '''
+
+    def __init__(self, s, activity_group):
         ajlo = aliased(ActivityJournal)
         ajhi = aliased(ActivityJournal)
-        self.__max_similarity = self.__s.query(func.max(ActivitySimilarity.similarity)). \
+        data = s.query(ActivitySimilarity.activity_journal_lo_id, ActivitySimilarity.activity_journal_hi_id,
+                       ActivitySimilarity.similarity). \
             join(ajlo, ActivitySimilarity.activity_journal_lo_id == ajlo.id). \
             join(ajhi, ActivitySimilarity.activity_journal_hi_id == ajhi.id). \
             filter(ajlo.activity_group == activity_group,
-                   ajhi.activity_group == activity_group).scalar()
-        if not self.__max_similarity: raise Exception('All activities unconnected')
+                   ajhi.activity_group == activity_group).all()
+        lo, hi, similarity = (np.array(column) for column in zip(*data)) if data else (np.zeros(0),) * 3
+        max_similarity = similarity.max() if len(similarity) else 0
+        if not max_similarity: raise Exception('All activities unconnected')
+        self.ids = np.unique(np.concatenate([lo, hi])).astype(int)
+        self.neighbours = MatrixNeighbours.from_pairs(len(self.ids),
+                                                      np.searchsorted(self.ids, lo), np.searchsorted(self.ids, hi),
+                                                      (max_similarity - similarity) / max_similarity)
+        log.debug(f'Loaded {len(lo)} similarities for {len(self.ids)} activities')
+
+
+class NearbySimilarityDBSCAN:
+
+    def __init__(self, similarities, epsilon, minpts):
+        self.__similarities = similarities
+        self.__epsilon = epsilon
+        self.__minpts = minpts
 
     def run(self):
-        candidates = set(x[0] for x in
-                         self.__s.query(distinct(ActivitySimilarity.activity_journal_lo_id)).
-                         join(ActivityJournal, ActivityJournal.id == ActivitySimilarity.activity_journal_lo_id).
-                         filter(ActivityJournal.activity_group == self.__activity_group).all())
-        candidates = candidates.union(set(x[0] for x in
-                         self.__s.query(distinct(ActivitySimilarity.activity_journal_hi_id)).
-                         join(ActivityJournal, ActivityJournal.id == ActivitySimilarity.activity_journal_hi_id).
-                         filter(ActivityJournal.activity_group == self.__activity_group).all()))
-        candidates = sorted(candidates)
-        # shuffle(candidates)  # skip for repeatability
-        return super().run(candidates)
-
-    def neighbourhood(self, candidate, epsilon):
-        qlo = self.__s.query(ActivitySimilarity.activity_journal_lo_id). \
-            join(ActivityJournal, ActivityJournal.id == ActivitySimilarity.activity_journal_lo_id). \
-            filter(ActivityJournal.activity_group == self.__activity_group,
-                   ActivitySimilarity.activity_journal_hi_id == candidate,
-                   (self.__max_similarity - ActivitySimilarity.similarity) / self.__max_similarity < epsilon)
-        qhi = self.__s.query(ActivitySimilarity.activity_journal_hi_id). \
-            join(ActivityJournal, ActivityJournal.id == ActivitySimilarity.activity_journal_hi_id). \
-            filter(ActivityJournal.activity_group == self.__activity_group,
-                   ActivitySimilarity.activity_journal_lo_id == candidate,
-                   (self.__max_similarity - ActivitySimilarity.similarity) / self.__max_similarity < epsilon)
-        return [x[0] for x in qlo.all()] + [x[0] for x in qhi.all()]
+        labels = dbscan(self.__similarities.neighbours, self.__epsilon, self.__minpts)
+        return groups(labels, self.__similarities.ids, self.__minpts)
 
 
 class NearbyCalculator(OwnerInMixin, ProcessCalculator):
@@ -241,15 +420,16 @@ class NearbyCalculator(OwnerInMixin, ProcessCalculator):
             with Timestamp(owner=self.owner_out).on_success(s):
                 for activity_group in s.query(ActivityGroup).all():
                     try:
-                        d_min, n = expand_max(0, 1, 5, lambda d: len(self.dbscan(s, d, activity_group)))
+                        similarities = SimilarityMatrix(s, activity_group)  # single query, then in memory
+                        d_min, n = expand_max(0, 1, 5, lambda d: len(self.dbscan(similarities, d)))
                         log.info(f'{n} groups at d={d_min}')
-                        self.save(s, self.dbscan(s, d_min, activity_group), activity_group)
+                        self.save(s, self.dbscan(similarities, d_min), activity_group)
                     except Exception as e:
                         log.warning(f'Failed to find nearby activities for {activity_group.name}: {e}')
                         log_current_exception(traceback=False)
 
-    def dbscan(self, s, d, activity_group):
-        return NearbySimilarityDBSCAN(s, activity_group, d, 3).run()
+    def dbscan(self, similarities, d):
+        return NearbySimilarityDBSCAN(similarities, d, 3).run()
 
     def save(self, s, groups, activity_group):
         for i, group in enumerate(groups):
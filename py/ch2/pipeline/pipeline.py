@@ -71,6 +71,8 @@ class ProcessPipeline(BasePipeline):
     In this way startup and shutdown bracket the entire process and are done just once.
     '''
 
+    USES_N_CPU = False  # if true, ProcessRunner passes n_cpu (for parallel work before workers start)
+
     def __init__(self, config, *args, owner_out=None, worker=None, id=None, cprofile=None,
                  **kargs):
         self.__args = args
@@ -31,9 +31,10 @@ def run_process_pipeline(config, type, *args, like=tuple(), worker=None, **extra
     ProcessRunner(config, pipelines, *args, worker=worker, **extra_kargs).run()
 
 
-def instantiate_pipeline(pipeline, config, *args, **kargs):
+def instantiate_pipeline(pipeline, config, *args, n_cpu=None, **kargs):
     kargs = dict(kargs)
     kargs.update(pipeline.kargs)  # this is where kargs from the config are added in
+    if n_cpu and pipeline.cls.USES_N_CPU: kargs['n_cpu'] = n_cpu
     log.debug(f'Instantiating {pipeline} with {args}, {kargs}')
     return pipeline.cls(config, *args, **kargs)
 
@@ -59,11 +60,11 @@ class ProcessRunner:
             for pipeline in self.__pipelines:
                 self.__run_local(pipeline)
         else:
-            self.__run_commands(DependencyQueue(self.__config, self.__pipelines, self.__kargs))
+            self.__run_commands(DependencyQueue(self.__config, self.__pipelines, self.__kargs, n_cpu=self.__n_cpu))
 
     def __run_local(self, pipeline):
         log.info(f'Running pipeline {pipeline} locally with {self.__kargs}')
-        instantiate_pipeline(pipeline, self.__config, *self.__args,
+        instantiate_pipeline(pipeline, self.__config, *self.__args, n_cpu=self.__n_cpu,
                              id=self.__worker, worker=bool(self.__worker), **self.__kargs).run()
 
     def __run_commands(self, queue):
@@ -151,7 +152,7 @@ class EmptyException(Exception): pass
 
 class DependencyQueue:
 
-    def __init__(self, config, pipelines, kargs, min_missing=1, max_missing=20, gamma=0.4):
+    def __init__(self, config, pipelines, kargs, n_cpu=None, min_missing=1, max_missing=20, gamma=0.4):
         self.__clean_pipelines(pipelines)
         self.__config = config
         self.__blocked = [pipeline for pipeline in pipelines if pipeline.blocked_by]
@@ -161,6 +162,7 @@ class DependencyQueue:
         self.__stats = {}  # pipeline: Stats
         self.__order = []
         self.__kargs = kargs
+        self.__n_cpu = n_cpu
         self.__max_missing = max_missing
         self.__min_missing = min_missing
         self.__gamma = gamma
@@ -207,7 +209,7 @@ class DependencyQueue:
         while self.__unblocked:
             pipeline = self.__unblocked.pop()
             log.debug(f'Making {pipeline} active')
-            instance = instantiate_pipeline(pipeline, self.__config, **self.__kargs)
+            instance = instantiate_pipeline(pipeline, self.__config, n_cpu=self.__n_cpu, **self.__kargs)
             instance.startup()
             missing = instance.missing()
             self.__stats[pipeline] = Stats(pipeline, missing)
@@ -1,6 +1,7 @@
 from logging import getLogger
 from os.path import splitext, basename
 
+import numpy as np
 from pygeotile.point import Point
 
 from .utils import AbortImportButMarkScanned, ProcessFitReader
@@ -10,16 +11,17 @@ from ...commands.upload import ACTIVITY
 from ...common.date import to_time
 from ...diary.model import TYPE, EDIT
 from ...fit.format.records import fix_degrees, merge_duplicates, no_bad_values
-from ...fit.profile.profile import read_fit
 from ...lib.io import split_fit_path
 from ...names import N, T, U, Sports, S
 from ...sql.database import StatisticJournalText
 from ...sql.tables.activity import ActivityGroup, ActivityJournal, ActivityTimespan
 from ...sql.tables.statistic import StatisticJournalFloat, STATISTIC_JOURNAL_CLASSES, StatisticName, \
-    StatisticJournalType, StatisticJournal, STATISTIC_JOURNAL_TYPES
+    StatisticJournalType, StatisticJournal, STATISTIC_JOURNAL_TYPES, StatisticJournalInteger, \
+    StatisticJournalTimestamp
 from ...sql.tables.topic import ActivityTopicField, ActivityTopic, ActivityTopicJournal
 from ...sql.utils import add
 from ...srtm.bilinear import bilinear_elevation_from_constant
+from ...srtm.prewarm import prewarm_fit_files
 
 log = getLogger(__name__)
 
@@ -31,8 +33,14 @@ log = getLogger(__name__)
 class ActivityReader(LoaderMixin, ProcessFitReader):
 
     KIT = 'kit'
+    # only these messages (and fields, plus those in record_to_db) are decoded
+    RECORD_NAMES = {'event', 'record', 'session', 'sport'}
+    FIELD_NAMES = {'event', 'event_type', 'sport', 'timestamp'}
 
-    def __init__(self, *args, sport_to_activity=None, record_to_db=None, **kargs):
+    USES_N_CPU = True  # to read files and convert tiles in parallel before workers start
+
+    def __init__(self, *args, sport_to_activity=None, record_to_db=None, n_cpu=1, **kargs):
+        self.n_cpu = n_cpu
         self.sport_to_activity = self._assert('sport_to_activity', sport_to_activity)
         self.record_to_db = [(field, title, units, STATISTIC_JOURNAL_CLASSES[type])
                              for field, (title, units, type)
@@ -59,6 +67,14 @@ class ActivityReader(LoaderMixin, ProcessFitReader):
                        'The kit used in the activity')
         # also coverages - see _read
 
+    def _missing(self, s):
+        missing = super()._missing(s)
+        if missing and self.add_elevation:
+            # convert tiles once, here, rather than in each worker (see prewarm.py).  the files are
+            # read through the column cache, so the workers do not parse them again.
+            prewarm_fit_files(self.__oracle, missing, cache=self._column_cache(), jobs=self.n_cpu)
+        return missing
+
     def _read_kit(self, path):
         _, kit = split_fit_path(path)
         if kit:
@@ -69,15 +85,18 @@ class ActivityReader(LoaderMixin, ProcessFitReader):
 
     def _read_data(self, s, file_scan):
         log.info('Reading activity data from %s' % file_scan)
-        records = self.parse_records(read_fit(file_scan.path))
+        field_names = self.FIELD_NAMES.union(field for field, title, units, type in self.record_to_db)
+        records = self._read_records(file_scan, merge_duplicates, fix_degrees, no_bad_values,
+                                     record_names=self.RECORD_NAMES, field_names=field_names)
         kit = self._read_kit(file_scan.path)
         ajournal, activity_group, first_timestamp = self._create_activity(s, file_scan, kit, records)
         return ajournal, (ajournal, activity_group, first_timestamp, file_scan, kit, records)
 
     @staticmethod
-    def parse_records(data):
+    def parse_records(data, field_names=None):
         log.debug('Parsing records')
-        records = ActivityReader.read_fit_file(data, merge_duplicates, fix_degrees, no_bad_values)
+        records = ActivityReader.read_fit_file(data, merge_duplicates, fix_degrees, no_bad_values,
+                                               record_names=ActivityReader.RECORD_NAMES, field_names=field_names)
         log.debug('Parsed')
         return records
 
@@ -191,6 +210,7 @@ class ActivityReader(LoaderMixin, ProcessFitReader):
 
         have_timespan = any(is_event(record, 'start') for record in records)
         only_records = list(filter(lambda x: x.name == 'record', records))
+        elevations = self._read_elevations(records) if self.add_elevation else {}
         final_timestamp = only_records[-1].timestamp
 
         if kit: loader.add_data(N.KIT, ajournal, kit, ajournal.start)
@@ -203,7 +223,7 @@ class ActivityReader(LoaderMixin, ProcessFitReader):
             log.warning('Experimental handling of data without timespans')
             timespan = add(s, ActivityTimespan(activity_journal=ajournal, start=first_timestamp, finish=final_timestamp))
 
-        for record in records:
+        for index, record in enumerate(records):
 
             if have_timespan and is_event(record, 'start'):
                 if timespan:
@@ -228,6 +248,11 @@ class ActivityReader(LoaderMixin, ProcessFitReader):
                             value = value[0][0]
                             if units == U.KM:  # internally everything uses M
                                 value /= 1000
+                            # cached columns are floats (and dates are seconds since the epoch)
+                            if type == StatisticJournalInteger:
+                                value = int(value)
+                            elif type == StatisticJournalTimestamp:
+                                value = to_time(value)
                             loader.add_data(title, ajournal, value, timestamp)
                             if title == T.LATITUDE:
                                 lat = value
@@ -240,7 +265,7 @@ class ActivityReader(LoaderMixin, ProcessFitReader):
                         loader.add_data(N.SPHERICAL_MERCATOR_X, ajournal, x, timestamp)
                         loader.add_data(N.SPHERICAL_MERCATOR_Y, ajournal, y, timestamp)
                         if self.add_elevation:
-                            elevation = self.__oracle.elevation(lat, lon)
+                            elevation = elevations.get(index)
                             if elevation:
                                 loader.add_data(N.RAW_ELEVATION, ajournal, elevation, timestamp)
                 else:
@@ -262,6 +287,26 @@ class ActivityReader(LoaderMixin, ProcessFitReader):
             log.warning('Cleaning up dangling timespan')
             timespan.finish = final_timestamp
 
+    def _read_elevations(self, records):
+        '''
+        Elevations for the positions in all records (in a single call to the oracle), keyed by index.
+        '''
+        fields = dict((title, field) for field, title, units, type in self.record_to_db)
+        if T.LATITUDE not in fields or T.LONGITUDE not in fields:
+            return {}
+        indices, lats, lons = [], [], []
+        for index, record in enumerate(records):
+            if record.name == 'record':
+                lat, lon = record.data.get(fields[T.LATITUDE]), record.data.get(fields[T.LONGITUDE])
+                if lat is not None and lon is not None:
+                    indices.append(index)
+                    lats.append(lat[0][0])
+                    lons.append(lon[0][0])
+        elevations = self.__oracle.elevations(np.array(lats), np.array(lons))
+        if elevations is None:
+            return {}
+        return dict(zip(indices, elevations.tolist()))
+
     def _read(self, s, path):
         loader = super()._read(s, path)
         for title, percent in loader.coverage_percentages():
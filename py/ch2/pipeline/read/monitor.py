@@ -14,7 +14,6 @@ from ..pipeline import LoaderMixin
 from ...common.date import time_to_local_date, format_time, to_time, dates_from, now
 from ...data.frame import read_query
 from ...fit.format.records import fix_degrees, unpack_single_bytes, merge_duplicates
-from ...fit.profile.profile import read_fit
 from ...names import N, T, U
 from ...sql import MonitorJournal, StatisticJournalInteger, StatisticName, StatisticJournal, Interval
 from ...sql.database import StatisticJournalType, Source
@@ -100,7 +99,7 @@ class MonitorReader(LoaderMixin, ProcessFitReader):
         return MonitorReader._last(path, records, MONITORING_ATTR).value.timestamp
 
     def _read_data(self, s, file_scan):
-        records = self.parse_records(read_fit(file_scan.path))
+        records = self._read_records(file_scan, merge_duplicates, fix_degrees, unpack_single_bytes)
         first_timestamp = self.read_first_timestamp(file_scan.path, records)
         last_timestamp = self.read_last_timestamp(file_scan.path, records)
         if first_timestamp == last_timestamp:
@@ -122,7 +121,8 @@ class MonitorReader(LoaderMixin, ProcessFitReader):
         steps_by_activity = defaultdict(lambda: 0)
         for record in records:
             if HEART_RATE_ATTR in record.data and record.data[HEART_RATE_ATTR][0][0]:
-                loader.add_data(N.HEART_RATE, mjournal, record.data[HEART_RATE_ATTR][0][0], record.timestamp)
+                # cached columns are floats
+                loader.add_data(N.HEART_RATE, mjournal, int(record.data[HEART_RATE_ATTR][0][0]), record.timestamp)
             if STEPS_ATTR in record.data:
                 # we ignore activity type here (used to store it when activity group and statistic name
                 # were mixed together, but never used it anywhere)
@@ -132,7 +132,7 @@ class MonitorReader(LoaderMixin, ProcessFitReader):
                 if reset: steps_by_activity = defaultdict(lambda: 0)
                 for activity, steps in zip(record.data[ACTIVITY_TYPE_ATTR][0], record.data[STEPS_ATTR][0]):
                     steps_by_activity[activity] = steps
-                total = sum(steps_by_activity.values())
+                total = int(sum(steps_by_activity.values()))
                 loader.add_data(N.CUMULATIVE_STEPS, mjournal, total, record.timestamp)
 
     def _shutdown(self, s):
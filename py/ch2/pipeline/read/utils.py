@@ -7,7 +7,8 @@ from ..pipeline import ProcessPipeline
 from ...commands.args import base_system_path, PERMANENT, BASE
 from ...common.date import now
 from ...common.log import log_current_exception
-from ...fit.format.read import filtered_records
+from ...fit.format.cache import ColumnCache, FIT_CACHE
+from ...fit.format.read import filtered_records, records_from_columns
 from ...lib import to_time
 from ...lib.io import modified_file_scans
 from ...sql import Timestamp, FileScan
@@ -27,6 +28,7 @@ class ProcessFitReader(ProcessPipeline):
 
     def __init__(self, config, *args, sub_dir=None, **kargs):
         self.sub_dir = sub_dir
+        self.__cache = None
         super().__init__(config, *args, **kargs)
 
     def _all_paths(self):
@@ -67,9 +69,31 @@ class ProcessFitReader(ProcessPipeline):
             s.rollback()
             raise AbortImportButMarkScanned()
 
+    def _column_cache(self):
+        # one per process (old profile versions are evicted by the parent only)
+        if self.__cache is None:
+            self.__cache = ColumnCache(base_system_path(self._config.args[BASE], subdir=FIT_CACHE,
+                                                        version=PERMANENT),
+                                       evict=not self.worker)
+        return self.__cache
+
+    def _read_columns(self, file_scan, **kargs):
+        '''
+        Columnar data for the file (see columnar_records), cached by file hash.
+        '''
+        return self._column_cache().columnar_records(file_scan.path, hash=file_scan.file_hash.hash, **kargs)
+
+    def _read_records(self, file_scan, *filters, record_names=None, field_names=None):
+        '''
+        As read_fit_file, but via the column cache (see records_from_columns).
+        '''
+        columns = self._read_columns(file_scan, record_names=record_names, field_names=field_names)
+        return records_from_columns(columns, *filters)
+
     @staticmethod
-    def read_fit_file(data, *options):
-        types, messages, records = filtered_records(data)
+    def read_fit_file(data, *options, record_names=None, field_names=None):
+        types, messages, records = filtered_records(data, bulk=True,
+                                                    record_names=record_names, field_names=field_names)
         return [record.as_dict(*options)
                 for _, _, record in sorted(records,
                                            key=lambda r: r[2].timestamp if r[2].timestamp else to_time(0.0))]
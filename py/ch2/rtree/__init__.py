@@ -1,3 +1,8 @@
 
+from .array import CARTree, LARTree
+from .grid import HashGrid, SHashGrid
+from .spherical import SQRTree
 from .tree import CLRTree, CQRTree, CERTree, LLRTree, LQRTree, LERTree, MatchType
 
+# the spatial indexes for (lon, lat) points that SimilarityCalculator can use (and the benchmark compares)
+INDEXES = {'rtree': SQRTree, 'grid': SHashGrid}
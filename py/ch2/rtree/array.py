@@ -0,0 +1,514 @@
+from abc import ABC
+from math import ceil, sqrt
+
+import numpy as np
+
+from .tree import MatchType, CartesianMixin, LatLonMixin, SearchMixin
+
+'''
+An alternative R-tree, with the same API as BaseTree, where the MBRs of the children of each node are
+stored together in a numpy array, so that all children of a node are compared in a single vectorized
+operation.  This favours wider nodes than BaseTree (the default max_entries is 32 rather than 3).
+
+MBRs are (x1, y1, x2, y2) after normalization, so the tree can be combined with the Cartesian, LatLon
+and Spherical mixins (which supply the normalization).
+'''
+
+
+def to_key(mbr):
+    '''
+    MBRs are stored as "keys" (x1, y1, -x2, -y2), so that the key of the union of MBRs is the minimum of
+    their keys and each comparison below is a single vectorized operation.
+    '''
+    x1, y1, x2, y2 = mbr
+    return x1, y1, -x2, -y2
+
+
+def from_key(key):
+    k1, k2, k3, k4 = key
+    return k1, k2, -k3, -k4
+
+
+def opposite(mbr):
+    '''
+    A node overlaps the MBR if its key is less than or equal to this.
+    '''
+    x1, y1, x2, y2 = mbr
+    return x2, y2, -x1, -y1
+
+
+class Node:
+    '''
+    A node: the height (0 for leaves), the keys of the children (the first n rows of an array with
+    one spare row, for overflow before a split), and the children (nodes, or (points, value) at leaves).
+    '''
+
+    __slots__ = ('height', 'keys', 'children')
+
+    def __init__(self, height, capacity, entries=()):
+        self.height = height
+        self.keys = np.empty((capacity + 1, 4))
+        self.children = []
+        for key, child in entries:
+            self.append(key, child)
+
+    def __len__(self):
+        return len(self.children)
+
+    @property
+    def live(self):
+        return self.keys[:len(self.children)]
+
+    def append(self, key, child):
+        self.keys[len(self.children)] = key
+        self.children.append(child)
+
+    def remove(self, i):
+        n = len(self.children)
+        self.keys[i:n-1] = self.keys[i+1:n]
+        del self.children[i]
+
+    def key(self):
+        return self.live.min(axis=0)
+
+
+def areas(keys):
+    return (keys[:, 0] + keys[:, 2]) * (keys[:, 1] + keys[:, 3])
+
+
+class ArrayTree(SearchMixin, ABC):
+
+    def __init__(self, items=None, *, max_entries=32, min_entries=None,
+                 default_match=MatchType.EQUALS, default_border=0):
+        '''
+        Create an empty tree.
+
+        `items` allows construction from an iterable of `(points, value)` pairs
+        (as returned by `.items()`),
+
+        `max_entries` is the maximum number of children a node can have.
+        '''
+        if not min_entries:
+            min_entries = max_entries // 2
+        if min_entries > max_entries // 2:
+            raise Exception('Min number of entries in a node is too high')
+        if min_entries < 1:
+            raise Exception('Min number of entries in a node is too low')
+        self.__max_entries = max_entries
+        self.__min_entries = min_entries
+        self.__default_match = default_match
+        self.__default_border = default_border
+        self.__root = Node(0, max_entries)
+        self.__size = 0
+        self.__hash = 966038070
+        self.add_all(items)
+
+    @property
+    def global_mbr(self):
+        if self.__size:
+            x1, y1, x2, y2 = from_key(self.__root.key())
+            x1, y1 = self._denormalize_point((x1, y1))
+            x2, y2 = self._denormalize_point((x2, y2))
+            return x1, y1, x2, y2
+        else:
+            return None
+
+    @property
+    def min_entries(self):
+        return self.__min_entries
+
+    @property
+    def max_entries(self):
+        return self.__max_entries
+
+    @property
+    def height(self):
+        return self.__root.height
+
+    @property
+    def split_algorithm(self):
+        return 'Quadratic (array)'
+
+    def size(self):
+        return self.__size
+
+    def _check_points(self, points):
+        try:
+            _ = points[0][0]
+        except Exception:
+            raise Exception('The `points` argument is a sequence of (x, y) points. ' +
+                            'You may have entered a single (x, y) point.')
+
+    def __request(self, points, value, match, border):
+        self._check_points(points)
+        match, border = self._request_defaults(match, border)
+        points = self._normalize_points(points)
+        return self._mbr_of_points(points, border=border), (points, value), match
+
+    def get(self, points, value=None, match=None, border=None):
+        '''
+        An iterator over values of nodes that match the MBR for the given points.
+
+        The `match` describes the kind of matching done.
+
+        If `value` is given then only nodes with that value are found.
+
+        `border` is added to the MBR (eg to account for errors).
+        '''
+        for points_entry, value_entry in self.__get_leaf_contents(*self.__request(points, value, match, border)):
+            yield value_entry
+
+    def get_items(self, points, value=None, match=None, border=None):
+        '''
+        An iterator over (MBR, value) of nodes that match the MBR for the given points.
+
+        The `match` describes the kind of matching done.
+
+        If `value` is given then only nodes with that value are found.
+
+        `border` is added to the MBR (eg to account for errors).
+        '''
+        for points_entry, value_entry in self.__get_leaf_contents(*self.__request(points, value, match, border)):
+            yield self._denormalize_points(points_entry), value_entry
+
+    def _root_node(self):
+        return self.__root
+
+    def _node(self, node):
+        live = node.live
+        return node.height, np.column_stack([live[:, :2], -live[:, 2:]]), node.children
+
+    def _request_defaults(self, match, border):
+        return (self.__default_match if match is None else match,
+                self.__default_border if border is None else border)
+
+    def __get_leaf_contents(self, mbr_request, content_request, match):
+        '''
+        Internal get (a stack rather than recursion).
+        '''
+        key, far = np.array(to_key(mbr_request)), np.array(opposite(mbr_request))
+        stack = [self.__root]
+        while stack:
+            node = stack.pop()
+            if len(node):
+                if node.height:
+                    children = node.children
+                    stack.extend(children[i] for i in np.flatnonzero(self.__descend(node, key, far, match)))
+                else:
+                    yield from self.__matches(node, key, far, content_request, match)
+
+    @staticmethod
+    def __descend(node, key, far, match):
+        '''
+        Which children to descend into in a search.
+        '''
+        if match in (MatchType.EQUALS, MatchType.CONTAINED):
+            return (node.live <= key).all(axis=1)  # child contains request
+        else:
+            return (node.live <= far).all(axis=1)  # child overlaps request
+
+    @staticmethod
+    def __matches(node, key, far, content_request, match):
+        '''
+        The children of a leaf that match.
+        '''
+        points_request, value_request = content_request
+        if match == MatchType.EQUALS:
+            candidates = node.children
+        else:
+            if match == MatchType.CONTAINED:
+                mask = (node.live <= key).all(axis=1)
+            elif match == MatchType.CONTAINS:
+                mask = (node.live >= key).all(axis=1)
+            else:
+                mask = (node.live <= far).all(axis=1)
+            candidates = [node.children[i] for i in np.flatnonzero(mask)]
+        for content in candidates:
+            points_node, value_node = content
+            if (value_request is None or value_request == value_node) and \
+                    (match != MatchType.EQUALS or points_request == points_node):
+                yield content
+
+    def add(self, points, value, border=None):
+        '''
+        Add a value at the MBR of the given points.
+
+        `border` is added to the MBR (eg to account for errors).
+        '''
+        mbr, content, _ = self.__request(points, value, None, border)
+        self.__add_to_root(np.array(to_key(mbr)), content)
+        self.__update_state(1, content)
+
+    def add_all(self, items, border=None):
+        '''
+        Add a sequence of (point, value) pairs.
+
+        `border` is added to the MBR (eg to account for errors).
+        '''
+        if items:
+            for points, value in items:
+                self.add(points, value, border=border)
+
+    def bulk_load(self, items, border=None):
+        '''
+        Add a sequence of (point, value) pairs, rebuilding the tree (including any existing entries)
+        with Sort-Tile-Recursive packing.
+
+        `border` is added to the MBR (eg to account for errors).
+        '''
+        keys, children = [], []
+        for key, content in self.__leaves(self.__root):
+            keys.append(key)
+            children.append(content)
+        for points, value in items:
+            mbr, content, _ = self.__request(points, value, None, border)
+            keys.append(to_key(mbr))
+            children.append(content)
+            self.__update_state(1, content)
+        keys, height = np.array(keys, dtype=float).reshape((-1, 4)), 0
+        while len(children) > self.__max_entries:
+            nodes = [Node(height, self.__max_entries, zip(keys[group], (children[i] for i in group)))
+                     for group in self.__tile(keys)]
+            keys, children = np.array([node.key() for node in nodes]), nodes
+            height += 1
+        self.__root = Node(height, self.__max_entries, zip(keys, children))
+
+    def __tile(self, keys):
+        '''
+        Group keys (indices) into nodes: sort by x and cut into slices, then sort each slice by y and cut.
+        '''
+        xs, ys = keys[:, 0] - keys[:, 2], keys[:, 1] - keys[:, 3]  # twice the centre
+        n_slices = ceil(sqrt(ceil(len(keys) / self.__max_entries)))
+        for slice in np.array_split(np.argsort(xs, kind='stable'), n_slices):
+            slice = slice[np.argsort(ys[slice], kind='stable')]
+            yield from np.array_split(slice, ceil(len(slice) / self.__max_entries))
+
+    def __update_state(self, delta, content):
+        '''
+        Update size and hash.
+        '''
+        self.__size += delta
+        self.__hash ^= hash(content)
+
+    def __add_to_root(self, key, content):
+        split = self.__add_to_node(self.__root, key, content)
+        if split:
+            self.__root = Node(self.__root.height + 1, self.__max_entries, split)
+
+    def __add_to_node(self, node, key_addition, content):
+        '''
+        Internal add at node.  Returns a list of (key, node) if the node was split.
+        '''
+        if node.height:
+            candidates = np.minimum(node.live, key_addition)
+            area = areas(candidates)
+            i_best = np.lexsort((area, area - areas(node.live)))[0]
+            node.keys[i_best] = candidates[i_best]  # optimistic (removed if split)
+            split = self.__add_to_node(node.children[i_best], key_addition, content)
+            if split:
+                node.remove(i_best)
+                for key, child in split:
+                    node.append(key, child)
+        else:
+            node.append(key_addition, content)
+        if len(node) > self.__max_entries:
+            return self.__split(node)
+
+    def __split(self, node):
+        '''
+        Quadratic split (Guttman), returning two (key, node) pairs.
+        '''
+        live, n = node.live.copy(), len(node)
+        area = areas(live)
+        pairs = np.minimum(live[:, None, :], live[None, :, :]).reshape((n * n, 4))
+        waste = areas(pairs).reshape((n, n)) - area[:, None] - area[None, :]
+        np.fill_diagonal(waste, -np.inf)
+        seeds = np.unravel_index(np.argmax(waste), waste.shape)
+        groups, keys = [[seeds[0]], [seeds[1]]], [live[seeds[0]], live[seeds[1]]]
+        remaining = [i for i in range(n) if i not in seeds]
+        while remaining:
+            for g in 0, 1:
+                if len(groups[g]) + len(remaining) <= self.__min_entries:
+                    groups[g].extend(remaining)
+                    remaining = []
+            if not remaining:
+                break
+            candidates = live[remaining]
+            deltas = [areas(np.minimum(candidates, key)) - areas(key[None, :]) for key in keys]
+            i = int(np.argmax(np.abs(deltas[0] - deltas[1])))
+            d0, d1 = deltas[0][i], deltas[1][i]
+            if d0 != d1:
+                g = 0 if d0 < d1 else 1
+            else:
+                a0, a1 = areas(np.array(keys))
+                g = 0 if a0 < a1 else 1 if a1 < a0 else 0 if len(groups[0]) <= len(groups[1]) else 1
+            groups[g].append(remaining.pop(i))
+            keys[g] = np.minimum(keys[g], live[groups[g][-1]])
+        result = []
+        for group in groups:
+            child = Node(node.height, self.__max_entries, ((live[i], node.children[i]) for i in group))
+            result.append((child.key(), child))
+        return result
+
+    def delete(self, points, value=None, match=None, border=None):
+        '''
+        Remove entries that match the MBR of the given points and optional value.
+
+        `border` is added to the MBR (eg to account for errors).
+        '''
+        request = self.__request(points, value, match, border)
+        count = 0
+        try:
+            while True:
+                self.__delete_one_from_root(*request)
+                count += 1
+        except KeyError:
+            return count
+
+    def delete_one(self, points, value=None, match=None, border=None):
+        '''
+        Remove a single entry that match the MBR of the given points and optional value.
+
+        Raises `KeyError` if no entry exists.
+
+        `border` is added to the MBR (eg to account for errors).
+        '''
+        self.__delete_one_from_root(*self.__request(points, value, match, border))
+
+    def __delete_one_from_root(self, mbr_deletion, content_deletion, match):
+        '''
+        Internal deletion from root.  Leaves from nodes that become too small are re-inserted.
+        '''
+        key, far = np.array(to_key(mbr_deletion)), np.array(opposite(mbr_deletion))
+        found = self.__delete_one_from_node(self.__root, key, far, content_deletion, match)
+        if found:
+            content_found, orphans = found
+            while self.__root.height and len(self.__root) < 2:
+                self.__root = self.__root.children[0] if len(self.__root) else Node(0, self.__max_entries)
+            for key, content in orphans:
+                self.__add_to_root(key, content)
+            self.__update_state(-1, content_found)
+        else:
+            points, value = content_deletion
+            raise KeyError('Failed to delete %s%s' % (points, '' if value is None else ' (value %s)' % value))
+
+    def __delete_one_from_node(self, node, key, far, content_deletion, match):
+        '''
+        Internal deletion from node.  Returns (content, orphans) if found.
+        '''
+        if node.height:
+            for i in np.flatnonzero(self.__descend(node, key, far, match)):
+                child = node.children[i]
+                found = self.__delete_one_from_node(child, key, far, content_deletion, match)
+                if found:
+                    if len(child) < self.__min_entries:
+                        node.remove(i)
+                        found[1].extend(self.__leaves(child))
+                    else:
+                        node.keys[i] = child.key()
+                    return found
+        elif len(node):
+            for content in self.__matches(node, key, far, content_deletion, match):
+                node.remove(next(i for i, child in enumerate(node.children) if child is content))
+                return content, []
+
+    def __leaves(self, node):
+        '''
+        Iterator over the (key, content) leaves in a node.
+        '''
+        if node.height:
+            for child in node.children:
+                yield from self.__leaves(child)
+        else:
+            yield from zip(node.live.tolist(), node.children)
+
+    def _normalize_points(self, points):
+        return tuple(self._normalize_point(p) for p in points)
+
+    def _denormalize_points(self, points):
+        return tuple(self._denormalize_point(p) for p in points)
+
+    def _denormalize_point(self, point):
+        return point
+
+    # standard container API
+
+    def __len__(self):
+        return self.__size
+
+    def keys(self):
+        for key, (points, value) in self.__leaves(self.__root):
+            yield self._denormalize_points(points)
+
+    def values(self):
+        for key, (points, value) in self.__leaves(self.__root):
+            yield value
+
+    def items(self):
+        for key, (points, value) in self.__leaves(self.__root):
+            yield (points, value)
+
+    def __contains__(self, points):
+        try:
+            next(self.get(points))
+            return True
+        except StopIteration:
+            return False
+
+    def __hash__(self):
+        return self.__hash
+
+    def __eq__(self, other):
+        if other is self:
+            return True
+        if not isinstance(other, ArrayTree) or self.__size != len(other) or hash(self) != hash(other):
+            return False
+        return sorted(list(self.items())) == sorted(list(other.items()))
+
+    def __iter__(self):
+        return self.keys()
+
+    def __getitem__(self, points):
+        return self.get(points)
+
+    def __setitem__(self, points, value):
+        self.add(points, value)
+
+    def __delitem__(self, points):
+        self.delete(points)
+
+    def __str__(self):
+        return '%s RTree (%s leaves, %d height, %d-%d entries)' % \
+               (self.split_algorithm, len(self), self.height, self.min_entries, self.max_entries)
+
+    def assert_consistent(self):
+        '''
+        Make some basic tests of consistency.
+        '''
+        size = self.__assert_consistent(self.__root)
+        if size != self.__size:
+            raise Exception('Unexpected number of leaves (%d != %d)' % (size, self.__size))
+
+    def __assert_consistent(self, node):
+        if len(node) < self.__min_entries and node is not self.__root:
+            raise Exception('Too few children at height %d' % node.height)
+        if len(node) > self.__max_entries:
+            raise Exception('Too many children at height %d' % node.height)
+        if node.height:
+            count = 0
+            for key, child in zip(node.live, node.children):
+                if child.height != node.height - 1:
+                    raise Exception('Bad height at height %d' % node.height)
+                if not np.array_equal(key, child.key()):
+                    raise Exception('Bad MBR at height %d %s / %s' %
+                                    (node.height, from_key(child.key()), from_key(key)))
+                count += self.__assert_consistent(child)
+            return count
+        else:
+            return len(node)
+
+
+class CARTree(CartesianMixin, ArrayTree): pass
+
+
+class LARTree(LatLonMixin, ArrayTree): pass
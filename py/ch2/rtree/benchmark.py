@@ -0,0 +1,102 @@
+from logging import getLogger, basicConfig, INFO
+from random import random, seed
+from sys import argv
+from time import perf_counter
+
+import numpy as np
+
+from . import INDEXES
+from .array import CARTree
+from .tree import CQRTree, MatchType
+from ..fit.format.read import columnar_records
+from ..fit.profile.profile import read_fit
+
+log = getLogger(__name__)
+
+'''
+Compare the query speed of the different tree implementations.
+
+    > python -m ch2.rtree.benchmark [N_POINTS [N_QUERIES]]
+
+list - nodes are lists of (mbr, content) tuples (CQRTree).
+array - child MBRs are stored in numpy arrays (CARTree).
+
+And compare the R-tree used by SimilarityCalculator with a hash grid, on the GPS tracks in FIT files
+(each track's points are queried and then added, as in SimilarityCalculator).
+
+    > python -m ch2.rtree.benchmark FILE [FILE ...]
+
+rtree - SQRTree.
+grid - SHashGrid.
+'''
+
+TREES = {'list': CQRTree, 'array': CARTree}
+
+
+def benchmark(n_points=100000, n_queries=10000, border=0.001, repeat=3, trees=None):
+    '''
+    Return a map from tree name to queries per second (best of repeat).
+    '''
+    seed(1)
+    items = [([(random(), random())], i) for i in range(n_points)]
+    queries = [[(random(), random())] for _ in range(n_queries)]
+    results = {}
+    for name in trees or TREES:
+        tree, best = TREES[name](default_match=MatchType.OVERLAP, default_border=border), None
+        tree.bulk_load(items)
+        for _ in range(repeat):
+            start = perf_counter()
+            for query in queries:
+                list(tree.get(query))
+            rate = n_queries / (perf_counter() - start)
+            best = rate if best is None else max(best, rate)
+        results[name] = best
+    return results
+
+
+def read_tracks(paths, fraction=0.01):
+    '''
+    The (lon, lat) points of each FIT file (every nth point, like SimilarityCalculator).
+    '''
+    nth = max(1, int(0.5 + 1 / fraction))
+    for path in paths:
+        records = columnar_records(read_fit(path), record_names=['record'],
+                                   field_names=['position_lat', 'position_long']).get('record', {})
+        if 'position_lat' in records and 'position_long' in records:
+            lon_lats = np.column_stack([records['position_long'][0], records['position_lat'][0]])
+            lon_lats = lon_lats[np.isfinite(lon_lats).all(axis=1)][nth-1::nth]
+            if len(lon_lats):
+                yield [tuple(lon_lat) for lon_lat in lon_lats.tolist()]
+            else:
+                log.warning(f'No GPS data in {path}')
+
+
+def similarity(paths, fraction=0.01, border=150, repeat=3, indexes=None):
+    '''
+    Return a map from index name to points per second (best of repeat) and the number of matches.
+    '''
+    tracks = list(read_tracks(paths, fraction=fraction))
+    n_points = sum(len(track) for track in tracks)
+    results = {}
+    for name in indexes or INDEXES:
+        best, n_matches = None, 0
+        for _ in range(repeat):
+            index, n_matches = INDEXES[name](default_match=MatchType.OVERLAP, default_border=border), 0
+            start = perf_counter()
+            for i, track in enumerate(tracks):
+                n_matches += sum(1 for _ in index.get_items_many(track))
+                index.add_all([([lon_lat], i) for lon_lat in track])
+            rate = n_points / (perf_counter() - start)
+            best = rate if best is None else max(best, rate)
+        results[name] = (best, n_matches)
+    return results
+
+
+if __name__ == '__main__':
+    basicConfig(level=INFO)
+    if any(not arg.isdigit() for arg in argv[1:]):
+        for name, (rate, n_matches) in similarity(argv[1:]).items():
+            log.info(f'{name:>10s}: {rate:.0f} points/s ({n_matches} matches)')
+    else:
+        for name, rate in benchmark(*map(int, argv[1:])).items():
+            log.info(f'{name:>10s}: {rate:.0f} queries/s')
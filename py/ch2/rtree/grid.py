@@ -0,0 +1,282 @@
+from math import ceil
+
+import numpy as np
+
+from .spherical import LocalTangent
+from .tree import MatchType
+
+'''
+A uniform hash grid over single points, with the parts of the R-tree API used for overlap counting
+(get, get_items, get_items_many, __setitem__, bulk_load, delete).
+
+Points are normalized (as for the trees) and stored in numpy arrays, along with the (integer) key of the
+cell that contains them.  The keys are kept sorted (new points are merged in before the next query), so
+the entries in a cell are found with a binary search and a query checks only the cells within reach.
+
+Only OVERLAP (the point plus the query border touches the point plus its own border) and EQUALS are
+supported.
+'''
+
+
+class HashGrid:
+
+    def __init__(self, items=None, *, cell=None, default_match=MatchType.OVERLAP, default_border=0):
+        '''
+        Create an empty grid.
+
+        `items` allows construction from an iterable of `(points, value)` pairs.
+
+        `cell` is the width of the (square) cells; by default twice the default border (so that an
+        overlap query with the default border needs to check only neighbouring cells).
+        '''
+        cell = cell or 2 * default_border
+        if not cell or cell <= 0:
+            raise Exception('A HashGrid needs a cell size (or a default border)')
+        if default_match not in (MatchType.OVERLAP, MatchType.EQUALS):
+            raise Exception(f'A HashGrid does not support {default_match.name}')
+        self.__cell = cell
+        self.__default_match = default_match
+        self.__default_border = default_border
+        self.__xys = np.empty((0, 2))        # normalized
+        self.__points = np.empty((0, 2))     # as given
+        self.__borders = np.empty(0)
+        self.__live = np.empty(0, dtype=bool)
+        self.__values = []
+        self.__pending = []                  # (xys, points, borders, values) not yet in the arrays
+        self.__keys = np.empty(0, dtype=np.int64)  # sorted cell keys
+        self.__order = np.empty(0, dtype=np.int64)  # entry index for each key
+        self.__size = 0
+        if items:
+            self.bulk_load(items)
+
+    @property
+    def cell(self):
+        return self.__cell
+
+    def size(self):
+        return self.__size
+
+    def _normalize_many(self, points):
+        '''
+        Normalize many points to an (n, 2) array.
+        '''
+        return np.array(points, dtype=float).reshape((-1, 2))
+
+    def _check_points(self, points):
+        try:
+            _ = points[0][0]
+        except Exception:
+            raise Exception('The `points` argument is a sequence of (x, y) points. ' +
+                            'You may have entered a single (x, y) point.')
+        if len(points) != 1:
+            raise Exception('A HashGrid contains only single points')
+
+    def __cell_keys(self, xys, d_row=0, d_column=0):
+        rows = np.floor(xys[:, 1] / self.__cell).astype(np.int64) + d_row
+        columns = np.floor(xys[:, 0] / self.__cell).astype(np.int64) + d_column
+        return rows * 2 ** 32 + columns
+
+    def __flush(self):
+        '''
+        Move pending entries into the arrays and merge their keys into the index.
+        '''
+        if self.__pending:
+            xys, points, borders, values = zip(*self.__pending)
+            self.__pending = []
+            start = len(self.__values)
+            self.__xys = np.concatenate((self.__xys,) + xys)
+            self.__points = np.concatenate((self.__points,) + points)
+            self.__borders = np.concatenate((self.__borders,) + borders)
+            for batch in values:
+                self.__values.extend(batch)
+            self.__live = np.concatenate([self.__live, np.ones(len(self.__values) - start, dtype=bool)])
+            keys = np.concatenate([self.__keys, self.__cell_keys(self.__xys[start:])])
+            order = np.concatenate([self.__order, np.arange(start, len(self.__values))])
+            sort = np.argsort(keys, kind='stable')  # two sorted runs, so a merge
+            self.__keys, self.__order = keys[sort], order[sort]
+
+    def get(self, points, value=None, match=None, border=None):
+        '''
+        An iterator over values of entries that match the given (single) point.
+
+        If `value` is given then only entries with that value are found.
+
+        `border` is added to the point (eg to account for errors).
+        '''
+        for _, value_entry in self.get_items(points, value=value, match=match, border=border):
+            yield value_entry
+
+    def get_items(self, points, value=None, match=None, border=None):
+        '''
+        An iterator over (points, value) of entries that match the given (single) point.
+
+        If `value` is given then only entries with that value are found.
+
+        `border` is added to the point (eg to account for errors).
+        '''
+        self._check_points(points)
+        for _, item in self.get_items_many(points, value=value, match=match, border=border):
+            yield item
+
+    def get_items_many(self, points, value=None, match=None, border=None):
+        '''
+        As get_items(), but for many probes (each a single (x, y) point) at once.
+
+        An iterator over (index, (points, value)) where index is the position of the probe in points.
+        '''
+        for index, entry in zip(*self.__find(points, value, match, border)):
+            yield int(index), (tuple(map(tuple, self.__points[entry:entry+1].tolist())), self.__values[entry])
+
+    def __find(self, points, value, match, border):
+        '''
+        Arrays of (probe index, entry index) for all matches.
+        '''
+        self.__flush()
+        if not len(points) or not len(self.__keys):
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+        match = self.__default_match if match is None else match
+        border = self.__default_border if border is None else border
+        xys = self._normalize_many(points)
+        if match == MatchType.EQUALS:
+            reach = 0
+        elif match == MatchType.OVERLAP:
+            reach = ceil((border + self.__borders.max()) / self.__cell)
+        else:
+            raise Exception(f'A HashGrid does not support {match.name}')
+        indices, entries = [], []
+        for d_row in range(-reach, reach + 1):
+            for d_column in range(-reach, reach + 1):
+                keys = self.__cell_keys(xys, d_row, d_column)
+                lo = np.searchsorted(self.__keys, keys, side='left')
+                n = np.searchsorted(self.__keys, keys, side='right') - lo
+                indices.append(np.repeat(np.arange(len(keys)), n))
+                entries.append(self.__order[np.arange(n.sum()) - np.repeat(np.cumsum(n) - n - lo, n)])
+        indices, entries = np.concatenate(indices), np.concatenate(entries)
+        if match == MatchType.EQUALS:
+            keep = (self.__xys[entries] == xys[indices]).all(axis=1)
+        else:
+            reaches = border + self.__borders[entries]
+            keep = (np.abs(self.__xys[entries] - xys[indices]) <= reaches[:, None]).all(axis=1)
+        keep &= self.__live[entries]
+        indices, entries = indices[keep], entries[keep]
+        if value is not None:
+            keep = np.array([self.__values[entry] == value for entry in entries], dtype=bool)
+            indices, entries = indices[keep], entries[keep]
+        return indices, entries
+
+    def add(self, points, value, border=None):
+        '''
+        Add a value at the given (single) point.
+
+        `border` is added to the point (eg to account for errors).
+        '''
+        self._check_points(points)
+        self.bulk_load([(points, value)], border=border)
+
+    def add_all(self, items, border=None):
+        '''
+        Add a sequence of (point, value) pairs.
+
+        `border` is added to the point (eg to account for errors).
+        '''
+        if items:
+            self.bulk_load(items, border=border)
+
+    def bulk_load(self, items, border=None):
+        '''
+        Add a sequence of (point, value) pairs together (the points are normalized in a single operation).
+
+        `border` is added to the point (eg to account for errors).
+        '''
+        items = list(items)
+        if items:
+            for points, _ in items:
+                self._check_points(points)
+            border = self.__default_border if border is None else border
+            points = np.array([points[0] for points, _ in items], dtype=float).reshape((-1, 2))
+            self.__pending.append((self._normalize_many(points), points, np.full(len(items), float(border)),
+                                   [value for _, value in items]))
+            self.__size += len(items)
+
+    def delete(self, points, value=None, match=None, border=None):
+        '''
+        Remove entries that match the given (single) point and optional value.
+
+        `border` is added to the point (eg to account for errors).
+        '''
+        self._check_points(points)
+        _, entries = self.__find(points, value, match, border)
+        entries = np.unique(entries)
+        self.__live[entries] = False
+        self.__size -= len(entries)
+        return len(entries)
+
+    def delete_one(self, points, value=None, match=None, border=None):
+        '''
+        Remove a single entry that matches the given (single) point and optional value.
+
+        Raises `KeyError` if no entry exists.
+        '''
+        self._check_points(points)
+        _, entries = self.__find(points, value, match, border)
+        if not len(entries):
+            raise KeyError(points)
+        self.__live[entries.min()] = False
+        self.__size -= 1
+
+    # standard container API
+
+    def __len__(self):
+        return self.__size
+
+    def items(self):
+        '''
+        All (points, value) pairs.
+        '''
+        self.__flush()
+        for entry in np.flatnonzero(self.__live):
+            yield tuple(map(tuple, self.__points[entry:entry+1].tolist())), self.__values[entry]
+
+    def keys(self):
+        for points, _ in self.items():
+            yield points
+
+    def values(self):
+        for _, value in self.items():
+            yield value
+
+    def __contains__(self, points):
+        try:
+            next(self.get(points))
+            return True
+        except StopIteration:
+            return False
+
+    def __iter__(self):
+        return self.keys()
+
+    def __getitem__(self, points):
+        return self.get(points)
+
+    def __setitem__(self, points, value):
+        self.add(points, value)
+
+    def __delitem__(self, points):
+        self.delete(points)
+
+    def __str__(self):
+        return f'{self.__class__.__name__}(size={self.__size}, cell={self.__cell})'
+
+
+class SHashGrid(HashGrid):
+    '''
+    A hash grid over (lon, lat) points, with cells (and borders) in metres on the local tangent plane
+    (like SQRTree).
+    '''
+
+    def __init__(self, *args, **kargs):
+        self.__plane = LocalTangent()
+        super().__init__(*args, **kargs)
+
+    def _normalize_many(self, points):
+        return self.__plane.normalize_many(points)
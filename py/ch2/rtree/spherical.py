@@ -1,13 +1,17 @@
 from logging import getLogger
 
-from math import pi, cos
+from math import pi, cos, sin, asin, sqrt
 
-from .tree import LinearMixin, BaseTree, QuadraticMixin, ExponentialMixin, CartesianMixin
+import numpy as np
+
+from .array import ArrayTree
+from .tree import LinearMixin, BaseTree, QuadraticMixin, ExponentialMixin, CartesianMixin, normalize_angles
 
 log = getLogger(__name__)
 
 RADIUS = 6371000
 RADIAN = pi / 180
+SLACK = 0.01  # allowance for the error in the local tangent approximation
 
 
 def norm180(x):
@@ -16,6 +20,24 @@ def norm180(x):
     return x
 
 
+def haversine(lon1, lat1, lon2, lat2):
+    '''
+    The great-circle distance in m.
+    '''
+    dlon, dlat = (lon2 - lon1) * RADIAN, (lat2 - lat1) * RADIAN
+    a = sin(dlat / 2) ** 2 + cos(lat1 * RADIAN) * cos(lat2 * RADIAN) * sin(dlon / 2) ** 2
+    return 2 * RADIUS * asin(min(1, sqrt(a)))
+
+
+def haversine_many(lon1, lat1, lon2, lat2):
+    '''
+    Vectorized haversine.
+    '''
+    dlon, dlat = (lon2 - lon1) * RADIAN, (lat2 - lat1) * RADIAN
+    a = np.sin(dlat / 2) ** 2 + np.cos(lat1 * RADIAN) * np.cos(lat2 * RADIAN) * np.sin(dlon / 2) ** 2
+    return 2 * RADIUS * np.arcsin(np.minimum(1, np.sqrt(a)))
+
+
 class LocalTangent:
     '''
     Assume a spherical earth and local linear approximations to convert from (lon, lat) to (x, y) in m.
@@ -31,14 +53,44 @@ class LocalTangent:
             self.__zero = point
         zx, zy = self.__zero
         lon, lat = norm180(point[0] - zx), point[1] - zy
-        x, y = RADIUS * RADIAN * lon * cos(self.__zero[1]), RADIUS * RADIAN * lat
+        x, y = RADIUS * RADIAN * lon * cos(self.__zero[1] * RADIAN), RADIUS * RADIAN * lat
         # log.debug(f'{point[0]},{point[1]} ({zx},{zy} -> {lon},{lat}) -> {x},{y}')
         return x, y
 
+    def normalize_many(self, points):
+        '''
+        Vectorized normalize, returning an (n, 2) array.
+        '''
+        points = np.array(points, dtype=float).reshape((-1, 2))
+        if self.__zero is None:
+            self.__zero = tuple(points[0].tolist())
+        zx, zy = self.__zero
+        lon, lat = normalize_angles(points[:, 0] - zx), points[:, 1] - zy
+        return np.column_stack([RADIUS * RADIAN * lon * cos(self.__zero[1] * RADIAN), RADIUS * RADIAN * lat])
+
+    def east_west_scales(self, y, mbrs):
+        '''
+        East-west distances in the plane are correct only at the latitude of the origin.  This is the
+        factor (at most 1) that makes them a lower bound on the true distance from a point (at y) to
+        anything within each MBR.
+        '''
+        lat, lat1, lat2 = (self.__zero[1] + np.asarray(value) / (RADIUS * RADIAN)
+                           for value in (y, mbrs[:, 1], mbrs[:, 3]))
+        furthest = np.minimum(np.maximum(np.maximum(np.abs(lat1), np.abs(lat2)), abs(lat)), 90)
+        return np.minimum(1, np.cos(furthest * RADIAN) / cos(self.__zero[1] * RADIAN))
+
     def denormalize(self, point):
         zx, zy = self.__zero
         x, y = point
-        return norm180(zx + x / (RADIUS * RADIAN * cos(self.__zero[1]))), zy + y / (RADIUS * RADIAN)
+        return norm180(zx + x / (RADIUS * RADIAN * cos(self.__zero[1] * RADIAN))), zy + y / (RADIUS * RADIAN)
+
+    def denormalize_many(self, xys):
+        '''
+        Vectorized denormalize, returning an (n, 2) array.
+        '''
+        zx, zy = self.__zero
+        return np.column_stack([normalize_angles(zx + xys[:, 0] / (RADIUS * RADIAN * cos(zy * RADIAN))),
+                                zy + xys[:, 1] / (RADIUS * RADIAN)])
 
 
 class SphericalMixin(CartesianMixin):
@@ -50,9 +102,30 @@ class SphericalMixin(CartesianMixin):
     def _normalize_point(self, point):
         return self.__plane.normalize(point)
 
+    def _normalize_many(self, points):
+        return self.__plane.normalize_many(points)
+
     def _denormalize_point(self, point):
         return self.__plane.denormalize(point)
 
+    def _distance_bounds(self, xy, mbrs):
+        dx, dy = self._distance_components(xy, mbrs)
+        return np.hypot(dx * self.__plane.east_west_scales(xy[1], mbrs), dy) * (1 - SLACK)
+
+    def _distance_to_points(self, xy, points):
+        '''
+        The great-circle distance to the nearest of the points.
+        '''
+        lon, lat = self.__plane.denormalize(xy)
+        return min(haversine(lon, lat, *self.__plane.denormalize(point)) for point in points)
+
+    def _distances_many(self, xys1, xys2):
+        '''
+        The great-circle distances between corresponding points.
+        '''
+        (lon1, lat1), (lon2, lat2) = self.__plane.denormalize_many(xys1).T, self.__plane.denormalize_many(xys2).T
+        return haversine_many(lon1, lat1, lon2, lat2)
+
 
 class SLRTree(LinearMixin, SphericalMixin, BaseTree): pass
 
@@ -63,6 +136,9 @@ class SQRTree(QuadraticMixin, SphericalMixin, BaseTree): pass
 class SERTree(ExponentialMixin, SphericalMixin, BaseTree): pass
 
 
+class SARTree(SphericalMixin, ArrayTree): pass
+
+
 class Global:
     '''
     Tile a globe.
@@ -1,6 +1,11 @@
 
 from abc import ABC, abstractmethod
 from enum import IntEnum
+from heapq import heappush, heappop
+from itertools import islice, takewhile, count
+from math import ceil, sqrt, hypot
+
+import numpy as np
 
 
 class MatchType(IntEnum):
@@ -14,7 +19,131 @@ class MatchType(IntEnum):
     OVERLAP = 3  # request and node overlap
 
 
-class BaseTree(ABC):
+def normalize_angles(x):
+    '''
+    Reduce angles to (-180, 180] (vectorized; values already in range are unchanged).
+    '''
+    x = np.array(x, dtype=float)
+    while (x <= -180).any():
+        x = np.where(x <= -180, x + 360, x)
+    while (x > 180).any():
+        x = np.where(x > 180, x - 360, x)
+    return x
+
+
+class SearchMixin:
+    '''
+    Searches shared by BaseTree and ArrayTree (see array.py).  These need only the root node and, for
+    each node, its height, the MBRs of its children (an (n, 4) array) and the children themselves (nodes,
+    or (points, value) at leaves), which each tree supplies through _root_node() and _node().
+    '''
+
+    @abstractmethod
+    def _root_node(self):
+        raise NotImplementedError()
+
+    @abstractmethod
+    def _node(self, node):
+        '''
+        (height, mbrs, children) for the node.
+        '''
+        raise NotImplementedError()
+
+    @abstractmethod
+    def _request_defaults(self, match, border):
+        '''
+        The match and border, replacing None with the tree's defaults.
+        '''
+        raise NotImplementedError()
+
+    def get_items_many(self, points, value=None, match=None, border=None):
+        '''
+        As get_items(), but for many probes (each a single (x, y) point) at once.  The probes are normalized
+        together and the tree is traversed once, with each node compared against all the probes that
+        reach it in a single vectorized operation.
+
+        An iterator over (index, (MBR, value)) where index is the position of the probe in points.
+        '''
+        if len(points):
+            match, border = self._request_defaults(match, border)
+            xys = self._normalize_many(points)
+            mbrs = self._mbrs_of_many(xys, border=border)
+            stack = [(self._root_node(), np.arange(len(xys)))]
+            while stack:
+                node, indices = stack.pop()
+                height, mbrs_children, children = self._node(node)
+                if not children:
+                    continue
+                if match == MatchType.EQUALS and not height:
+                    masks = np.array([(xys[indices, 0] == points_child[0][0]) &
+                                      (xys[indices, 1] == points_child[0][1])
+                                      if len(points_child) == 1 else np.zeros(len(indices), dtype=bool)
+                                      for points_child, _ in children])
+                elif match in (MatchType.EQUALS, MatchType.CONTAINED):
+                    masks = self._contains_many(mbrs_children, mbrs[indices])
+                elif match == MatchType.CONTAINS and not height:
+                    masks = self._contains_many(mbrs[indices], mbrs_children).T
+                else:
+                    masks = self._overlaps_many(mbrs_children, mbrs[indices])
+                for i in np.flatnonzero(masks.any(axis=1)):
+                    child = children[i]
+                    if height:
+                        stack.append((child, indices[masks[i]]))
+                    elif value is None or value == child[1]:
+                        item = (self._denormalize_points(child[0]), child[1])
+                        for index in indices[masks[i]]:
+                            yield int(index), item
+
+    def nearest(self, point, k=1, value=None):
+        '''
+        An iterator over (distance, (points, value)) for the k entries nearest the (x, y) point, nearest first.
+        The distance to an entry is the distance to its nearest point.
+
+        If `value` is given then only entries with that value are found.
+        '''
+        return islice(self.__nearest(point, value), k)
+
+    def within(self, point, distance, value=None):
+        '''
+        An iterator over (distance, (points, value)) for the entries within the given distance of the
+        (x, y) point, nearest first.
+
+        If `value` is given then only entries with that value are found.
+        '''
+        return takewhile(lambda found: found[0] <= distance, self.__nearest(point, value))
+
+    def distances(self, points1, points2):
+        '''
+        The distances between corresponding (x, y) points in the two sequences (measured as for nearest()
+        and within()), as an array.
+        '''
+        return self._distances_many(self._normalize_many(points1), self._normalize_many(points2))
+
+    def __nearest(self, point, value):
+        '''
+        Best-first search.  The heap contains nodes (ordered by a lower bound on the distance to their
+        contents) and entries (ordered by distance), so an entry at the top is nearer than anything unseen.
+        '''
+        xy, order = self._normalize_point(point), count()
+        heap = [(0, next(order), False, self._root_node())]
+        while heap:
+            distance, _, is_entry, content = heappop(heap)
+            if is_entry:
+                points_entry, value_entry = content
+                yield distance, (self._denormalize_points(points_entry), value_entry)
+            else:
+                height, mbrs, children = self._node(content)
+                if height:
+                    for bound, node in zip(self._distance_bounds(xy, mbrs).tolist(), children):
+                        heappush(heap, (bound, next(order), False, node))
+                else:
+                    for points_entry, value_entry in children:
+                        if value is None or value == value_entry:
+                            heappush(heap, (self._distance_to_points(xy, points_entry), next(order), True,
+                                            (points_entry, value_entry)))
+
+
+class BaseTree(SearchMixin, ABC):
 
     # nodes in the tree are
     #   (height, [entry, entry, entry...])
@@ -136,6 +265,18 @@ class BaseTree(ABC):
         for points_entry, value_entry in self.__get_leaf_contents(self.__root, mbr_request, content_request, match):
             yield self._denormalize_points(points_entry), value_entry
 
+    def _root_node(self):
+        return self.__root
+
+    def _node(self, node):
+        height, entries = node
+        return height, np.array([mbr for mbr, _ in entries], dtype=float).reshape((-1, 4)), \
+               [content for _, content in entries]
+
+    def _request_defaults(self, match, border):
+        return (self.__default_match if match is None else match,
+                self.__default_border if border is None else border)
+
     def __get_leaf_contents(self, node, mbr_request, content_request, match):
         '''
         Internal get from node.
@@ -191,6 +332,50 @@ class BaseTree(ABC):
             for points, value in items:
                 self.add(points, value, border=border)
 
+    def bulk_load(self, items, border=None):
+        '''
+        Add a sequence of (point, value) pairs, rebuilding the tree (including any existing entries)
+        with Sort-Tile-Recursive packing.  The result is balanced, with full nodes, and is built much
+        faster than with add_all().
+
+        `border` is added to the MBR (eg to account for errors).
+        '''
+        border = self.__default_border if border is None else border
+        entries = list(self.__leaves(self.__root, False))
+        for points, value in items:
+            self._check_points(points)
+            points = self._normalize_points(points)
+            content = (points, value)
+            entries.append((self._mbr_of_points(points, border=border), content))
+            self.__update_state(1, content)
+        height = 0
+        while len(entries) > self.__max_entries:
+            entries = [(self._mbr_of_entries(*group), (height, group)) for group in self.__tile(entries)]
+            height += 1
+        self.__root = (height, entries)
+
+    def __tile(self, entries):
+        '''
+        Group entries into nodes: sort by x and cut into slices, then sort each slice by y and cut into nodes.
+        '''
+        n_slices = ceil(sqrt(ceil(len(entries) / self.__max_entries)))
+        entries = sorted(entries, key=lambda entry: self._centre_of_mbr(entry[0])[0])
+        for slice in self.__divide(entries, n_slices):
+            slice.sort(key=lambda entry: self._centre_of_mbr(entry[0])[1])
+            yield from self.__divide(slice, ceil(len(slice) / self.__max_entries))
+
+    @staticmethod
+    def __divide(entries, n):
+        '''
+        Divide into n lists of (nearly) equal length (so that no node has too few entries).
+        '''
+        size, extra = divmod(len(entries), n)
+        start = 0
+        for i in range(n):
+            finish = start + size + (1 if i < extra else 0)
+            yield entries[start:finish]
+            start = finish
+
     def __update_state(self, delta, content):
         '''
         Update size and hash.
@@ -545,6 +730,38 @@ class BaseTree(ABC):
     def _mbr_of_points(self, points, border=0):
         raise NotImplementedError()
 
+    @abstractmethod
+    def _normalize_many(self, points):
+        raise NotImplementedError()
+
+    @abstractmethod
+    def _mbrs_of_many(self, xys, border=0):
+        raise NotImplementedError()
+
+    @abstractmethod
+    def _overlaps_many(self, mbrs1, mbrs2):
+        raise NotImplementedError()
+
+    @abstractmethod
+    def _contains_many(self, outers, inners):
+        raise NotImplementedError()
+
+    @abstractmethod
+    def _distance_bounds(self, xy, mbrs):
+        raise NotImplementedError()
+
+    @abstractmethod
+    def _distance_to_points(self, xy, points):
+        raise NotImplementedError()
+
+    @abstractmethod
+    def _distances_many(self, xys1, xys2):
+        raise NotImplementedError()
+
+    @abstractmethod
+    def _centre_of_mbr(self, mbr):
+        raise NotImplementedError()
+
     def _mbr_of_entries(self, *entries):
         return self._mbr_of_mbrs(*(mbr for mbr, _ in entries))
 
@@ -604,6 +821,66 @@ class CartesianMixin:
         x1s, y1s, x2s, y2s = zip(*mbrs)
         return min(x1s), min(y1s), max(x2s), max(y2s)
 
+    def _normalize_many(self, points):
+        '''
+        Normalize many points to an (n, 2) array.
+        '''
+        return np.array(points, dtype=float).reshape((-1, 2))
+
+    def _mbrs_of_many(self, xys, border=0):
+        '''
+        The MBRs of many single points (an (n, 2) array) as an (n, 4) array.
+        '''
+        return np.column_stack([xys - border, xys + border])
+
+    def _overlaps_many(self, mbrs1, mbrs2):
+        '''
+        Do the MBRs intersect?  Arrays of shape (n, 4) and (m, 4) give an (n, m) result.
+        '''
+        a, b = mbrs1[:, None, :], mbrs2[None, :, :]
+        return (a[..., 0] <= b[..., 2]) & (a[..., 2] >= b[..., 0]) & (a[..., 1] <= b[..., 3]) & (a[..., 3] >= b[..., 1])
+
+    def _contains_many(self, outers, inners):
+        '''
+        Are the `inner` MBRs contained by the `outer`?  Arrays of shape (n, 4) and (m, 4) give an (n, m) result.
+        '''
+        a, b = outers[:, None, :], inners[None, :, :]
+        return (a[..., 0] <= b[..., 0]) & (a[..., 2] >= b[..., 2]) & (a[..., 1] <= b[..., 1]) & (a[..., 3] >= b[..., 3])
+
+    def _distance_components(self, xy, mbrs):
+        '''
+        The x and y distances from the point to each of the MBRs (an (n, 4) array); zero if inside.
+        '''
+        x, y = xy
+        return (np.maximum(np.maximum(mbrs[:, 0] - x, x - mbrs[:, 2]), 0),
+                np.maximum(np.maximum(mbrs[:, 1] - y, y - mbrs[:, 3]), 0))
+
+    def _distance_bounds(self, xy, mbrs):
+        '''
+        A lower bound on the distance from the point to anything in each of the MBRs (an (n, 4) array).
+        '''
+        return np.hypot(*self._distance_components(xy, mbrs))
+
+    def _distance_to_points(self, xy, points):
+        '''
+        The distance from the point to the nearest of the points.
+        '''
+        x, y = xy
+        return min(hypot(x - px, y - py) for px, py in points)
+
+    def _distances_many(self, xys1, xys2):
+        '''
+        The distances between corresponding points in two (n, 2) arrays.
+        '''
+        return np.hypot(*(xys1 - xys2).T)
+
+    def _centre_of_mbr(self, mbr):
+        '''
+        The (x, y) centre of the MBR.
+        '''
+        x1, y1, x2, y2 = mbr
+        return (x1 + x2) / 2, (y1 + y2) / 2
+
     def _overlaps(self, mbr1, mbr2):
         '''
         Do the two MBR's intersect?
@@ -721,6 +998,16 @@ class LatLonMixin(CartesianMixin):
         lon = self._normalize_angle(lon - self.__zero_lon)
         return lon, lat
 
+    def _normalize_many(self, points):
+        '''
+        Vectorized _normalize_point().
+        '''
+        xys = np.array(points, dtype=float).reshape((-1, 2))
+        if self.__zero_lon is None:
+            self.__zero_lon = points[0][0]
+        xys[:, 0] = normalize_angles(xys[:, 0] - self.__zero_lon)
+        return xys
+
     def _denormalize_point(self, point):
         '''
         Revert the normalization above.
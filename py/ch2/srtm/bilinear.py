@@ -1,4 +1,6 @@
 
+import numpy as np
+
 from .file import SRTM1_DIR_CNAME, SAMPLES, ElevationSupport, elevation_from_constant
 
 
@@ -23,6 +25,8 @@ class BilinearElevation(ElevationSupport):
     If dir is not None and a file is missing for a particular lat/lon then an exception is raised.
 
     Elevations are bilinear interpolated from the surrounding arcsec grid.
+
+    For many points (eg a whole activity) use elevations(), which works with numpy arrays, a tile at a time.
     '''
 
     def elevation(self, lat, lon):
@@ -41,3 +45,24 @@ class BilinearElevation(ElevationSupport):
             return h0 * (1-k) + h1 * k
         else:
             return None
+
+    def elevations(self, lats, lons):
+        '''
+        As elevation, but for arrays of lats and lons, returning an array.
+        '''
+        if self._dir:
+            lats, lons = np.asarray(lats, dtype=float), np.asarray(lons, dtype=float)
+            result = np.empty(lats.shape)
+            for flat, flon, mask in self._by_tile(lats, lons):
+                h = self._reader(self._dir, flat, flon)
+                x = (lons[mask] - flon) * (SAMPLES - 1)
+                y = (lats[mask] - flat) * (SAMPLES - 1)
+                i, j = x.astype(int), y.astype(int)
+                k = y - j
+                h0 = h[j, i] * (1-k) + h[j+1, i] * k
+                h1 = h[j, i+1] * (1-k) + h[j+1, i+1] * k
+                k = x - i
+                result[mask] = h0 * (1-k) + h1 * k
+            return result
+        else:
+            return None
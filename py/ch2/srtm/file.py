@@ -1,5 +1,4 @@
-
-from functools import lru_cache
+from collections import OrderedDict
 from genericpath import exists
 from logging import getLogger
 
@@ -8,8 +7,9 @@ from os.path import join
 from zipfile import ZipFile
 
 import numpy as np
+from psutil import virtual_memory
 
-from ..common.io import clean_path
+from ..common.io import clean_path, atomic_write
 from ..common.log import log_current_exception
 from ..sql import Constant
 
@@ -21,19 +21,27 @@ SAMPLES = 3601
 # from view-source:http://dwtkns.com/srtm30m/
 BASE_URL = 'http://e4ftl01.cr.usgs.gov/MEASURES/SRTMGL1.003/2000.02.11/'
 EXTN = '.SRTMGL1.hgt.zip'
+NPY = '.npy'
+TILE_BYTES = SAMPLES * SAMPLES * 2
 
 
 # lots of credit to https://github.com/aatishnn/srtm-python/blob/master/srtm.py
 # (although that has bugs...)
 
 
-@lru_cache(4)  # 4 means our tests are quick (and should tile a local patch)
-def cached_file_reader(dir, flat, flon):
+def tile_root(flat, flon):
     # https://wiki.openstreetmap.org/wiki/SRTM
     # The official 3-arc-second and 1-arc-second data for versions 2.1 and 3.0 are divided into 1°×1° data tiles.
     # The tiles are distributed as zip files containing HGT files labeled with the coordinate of the southwest cell.
     # For example, the file N20E100.hgt contains data from 20°N to 21°N and from 100°E to 101°E inclusive.
-    root = '%s%02d%s%03d' % ('S' if flat < 0 else 'N', abs(flat), 'W' if flon < 0 else 'E', abs(flon))
+    return '%s%02d%s%03d' % ('S' if flat < 0 else 'N', abs(flat), 'W' if flon < 0 else 'E', abs(flon))
+
+
+def read_hgt(dir, flat, flon):
+    '''
+    The tile as a (flipped, so increasing latitude) native-endian array, read from the hgt or zip file.
+    '''
+    root = tile_root(flat, flon)
     hgt_file = root + '.hgt'
     hgt_path = join(dir, hgt_file)
     zip_path = join(dir, root + EXTN)
@@ -51,7 +59,79 @@ def cached_file_reader(dir, flat, flon):
         # i tried automating download, but couldn't get ouath2 to work
         log.warning(f'Download {BASE_URL + root + EXTN}')
         raise Exception(f'Missing {hgt_file}')
-    return np.flip(np.frombuffer(data, np.dtype('>i2'), SAMPLES * SAMPLES).reshape((SAMPLES, SAMPLES)), 0)
+    return np.flip(np.frombuffer(data, np.dtype('>i2'), SAMPLES * SAMPLES).reshape((SAMPLES, SAMPLES)), 0). \
+        astype(np.int16)
+
+
+def convert_tile(dir, flat, flon, force=False):
+    '''
+    Write the tile as an npy file (if it does not already exist) and return the path.
+    '''
+    path = join(dir, tile_root(flat, flon) + NPY)
+    if force or not exists(path):
+        h = read_hgt(dir, flat, flon)
+        log.debug(f'Writing {path}')
+        with atomic_write(path) as output:
+            np.save(output, h)
+    return path
+
+
+class TileStore:
+    '''
+    An LRU cache of tiles.
+
+    Each tile is converted once to a native-endian npy file in the SRTM directory which is then memory
+    mapped, so reading is fast and processes share pages through the OS page cache.  If the directory
+    is not writable the tile is kept in memory instead.
+
+    At most max_tiles are kept, and (since tiles may be held in memory) no more than max_bytes
+    (by default, a quarter of physical memory).
+    '''
+
+    def __init__(self, max_tiles=16, max_bytes=None):
+        self.__tiles = OrderedDict()
+        self.__max_tiles = max_tiles
+        self.__max_bytes = max_bytes or virtual_memory().total // 4
+
+    def configure(self, max_tiles=None, max_bytes=None):
+        if max_tiles is not None:
+            self.__max_tiles = max_tiles
+        if max_bytes is not None:
+            self.__max_bytes = max_bytes
+        self.__evict()
+
+    @property
+    def size(self):
+        return max(1, min(self.__max_tiles, self.__max_bytes // TILE_BYTES))
+
+    def __evict(self):
+        while len(self.__tiles) > self.size:
+            self.__tiles.popitem(last=False)
+
+    def __call__(self, dir, flat, flon):
+        key = (dir, flat, flon)
+        if key in self.__tiles:
+            self.__tiles.move_to_end(key)
+        else:
+            self.__tiles[key] = self.__load(dir, flat, flon)
+            self.__evict()
+        return self.__tiles[key]
+
+    @staticmethod
+    def __load(dir, flat, flon):
+        try:
+            path = convert_tile(dir, flat, flon)
+        except OSError as e:
+            log.warning(f'Cannot write tile to {dir} ({e}); reading into memory')
+            return read_hgt(dir, flat, flon)
+        return np.load(path, mmap_mode='r')
+
+    def cache_clear(self):
+        self.__tiles.clear()
+
+
+# shared by all ElevationSupport instances in a process
+cached_file_reader = TileStore()
 
 
 class ElevationSupport:
@@ -60,11 +140,29 @@ class ElevationSupport:
         self._dir = dir
         self._reader = reader
 
+    @property
+    def dir(self):
+        '''
+        The SRTM directory (None if not configured).
+        '''
+        return self._dir
+
     def _lookup(self, lat, lon):
         flat, flon = floor(lat), floor(lon)
         # construct the path in the reader so it's skipped if we hit the cache
         return flat, flon, self._reader(self._dir, flat, flon)
 
+    @staticmethod
+    def _by_tile(lats, lons):
+        '''
+        Yield (flat, flon, mask) for each tile containing the points.
+        '''
+        tiles, tile_index = np.unique(np.stack([np.floor(lats).ravel(), np.floor(lons).ravel()], axis=1), axis=0,
+                                      return_inverse=True)
+        tile_index = tile_index.reshape(lats.shape)
+        for tile, (flat, flon) in enumerate(tiles.tolist()):
+            yield int(flat), int(flon), tile_index == tile
+
 
 def elevation_from_constant(s, interp, dir_name=SRTM1_DIR_CNAME):
     try:
@@ -0,0 +1,124 @@
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from itertools import chain
+from logging import getLogger
+from math import floor
+from os.path import join, exists
+
+import numpy as np
+from geoalchemy2.shape import to_shape
+
+from .file import tile_root, convert_tile, BASE_URL, EXTN, NPY
+from ..fit.format.read import columnar_records
+from ..fit.profile.profile import read_fit
+from ..sql import ActivityJournal
+
+log = getLogger(__name__)
+
+'''
+Convert the tiles needed for an area to the local (npy) format before they are used, so that
+elevation lookups never pay the conversion cost, and list the tiles that need to be downloaded.
+
+Converted tiles are memory mapped (see TileStore), so once converted they are shared, through the
+OS page cache, by all processes (eg the workers started by ch2 process).
+'''
+
+MARGIN = 0.5
+LAT, LON = 'position_lat', 'position_long'
+
+
+def tiles_for_box(lat1, lon1, lat2, lon2):
+    '''
+    The (flat, flon) tiles that cover the box (corners in any order).
+    '''
+    for flat in range(floor(min(lat1, lat2)), floor(max(lat1, lat2)) + 1):
+        for flon in range(floor(min(lon1, lon2)), floor(max(lon1, lon2)) + 1):
+            yield flat, flon
+
+
+def tiles_for_points(points, margin=MARGIN):
+    '''
+    The (flat, flon) tiles that cover the (lat, lon) points, each extended by margin degrees.
+    '''
+    tiles = set()
+    for lat, lon in points:
+        tiles.update(tiles_for_box(lat - margin, lon - margin, lat + margin, lon + margin))
+    return sorted(tiles)
+
+
+def has_source(dir, flat, flon):
+    root = tile_root(flat, flon)
+    return any(exists(join(dir, root + extn)) for extn in ('.hgt', EXTN, NPY))
+
+
+def prewarm(dir, tiles, jobs=1, force=False):
+    '''
+    Convert all tiles (in parallel, if jobs > 1).  Returns (converted, missing) lists of tiles.
+    '''
+    tiles = sorted(set(tiles))
+    missing = [tile for tile in tiles if not has_source(dir, *tile)]
+    present = [tile for tile in tiles if tile not in missing]
+    # avoid starting processes if there is nothing to do
+    todo = present if force else [tile for tile in present if not exists(join(dir, tile_root(*tile) + NPY))]
+    convert = partial(convert_tile, dir, force=force)
+    flats, flons = [tile[0] for tile in todo], [tile[1] for tile in todo]
+    if jobs > 1 and len(todo) > 1:
+        with ProcessPoolExecutor(max_workers=min(jobs, len(todo))) as executor:
+            list(executor.map(convert, flats, flons))
+    else:
+        list(map(convert, flats, flons))
+    log.info(f'{len(present)} tiles ready, {len(missing)} missing')
+    for flat, flon in missing:
+        log.warning(f'Download {BASE_URL + tile_root(flat, flon) + EXTN}')
+    return present, missing
+
+
+def activity_centres(s):
+    '''
+    The (lat, lon) centres of all activities.
+    '''
+    for centre, in s.query(ActivityJournal.centre).filter(ActivityJournal.centre != None).all():
+        lon, lat = to_shape(centre).coords[0]
+        yield lat, lon
+
+
+def fit_file_points(path, cache=None):
+    '''
+    The (lat, lon) positions in the FIT file, rounded to 0.1 degree (and without duplicates).
+    If a ColumnCache is given the file is read through that (so it is not parsed again on import).
+    Files that cannot be read give no points (the error is reported when they are imported).
+    '''
+    try:
+        if cache:
+            columns = cache.columnar_records(path, record_names=['record'], field_names=[LAT, LON])
+        else:
+            columns = columnar_records(read_fit(path), record_names=['record'], field_names=[LAT, LON])
+    except Exception as e:
+        log.debug(f'Could not read positions from {path}: {e}')
+        return []
+    columns = columns.get('record', {})
+    if LAT not in columns or LON not in columns:
+        return []
+    points = np.stack([columns[LAT][0], columns[LON][0]], axis=1).astype(float)
+    points = points[~np.isnan(points).any(axis=1)]
+    return [tuple(point) for point in np.unique(np.round(points, 1), axis=0).tolist()]
+
+
+def prewarm_fit_files(oracle, paths, cache=None, margin=MARGIN, jobs=1):
+    '''
+    Convert the tiles around the positions in the FIT files (eg those about to be imported), before
+    workers are started, so that the workers only map tiles (rather than each converting the same hgt
+    files at once).  Tiles that are not available are ignored (they may be sea).
+
+    The files are read in parallel (if jobs > 1) and, if a ColumnCache is given, through the cache, so
+    that the workers that import them read the cached columns rather than parsing them again.
+    '''
+    if oracle.dir:
+        read = partial(fit_file_points, cache=cache)
+        if jobs > 1 and len(paths) > 1:
+            with ProcessPoolExecutor(max_workers=min(jobs, len(paths))) as executor:
+                points = set(chain.from_iterable(executor.map(read, paths)))
+        else:
+            points = set(chain.from_iterable(map(read, paths)))
+        tiles = [tile for tile in tiles_for_points(points, margin=margin) if has_source(oracle.dir, *tile)]
+        prewarm(oracle.dir, tiles, jobs=jobs)
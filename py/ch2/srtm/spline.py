@@ -1,37 +1,114 @@
-
-from functools import lru_cache
+from collections import OrderedDict
+from logging import getLogger
+from os import makedirs
+from os.path import join, exists
+from pickle import dump, load
 
 import numpy as np
 from scipy.interpolate import RectBivariateSpline
 
-from .file import SRTM1_DIR_CNAME, SAMPLES, ElevationSupport, elevation_from_constant, cached_file_reader
+from .file import SRTM1_DIR_CNAME, SAMPLES, ElevationSupport, elevation_from_constant, tile_root
+from ..common.io import atomic_write
+
+log = getLogger(__name__)
+
+'''
+Elevations from a bicubic spline fitted to the SRTM data.
+
+Fitting a spline to a whole tile takes seconds, so (without smoothing) splines are fitted to a window
+around the points requested (aligned to BLOCK samples, so that nearby requests share windows, and padded
+by PAD samples, so that the window edges do not affect the values).  These splines are cached in memory
+and on disk (in the SPLINE sub-directory of the SRTM directory).
+
+A smoothed spline depends on all the data it is fitted to, so is always fitted to the whole tile (as
+before windowing was added).  These are large, so are cached only in memory, and at most MAX_TILE_SPLINES.
+'''
+
+BLOCK = 256
+PAD = 32
+SPLINE = 'spline'
+TILE = (0, SAMPLES, 0, SAMPLES)
+MAX_TILE_SPLINES = 4
 
 
 def spline_elevation_from_constant(s, dir_name=SRTM1_DIR_CNAME, smooth=0):
     return elevation_from_constant(s, lambda dir: SplineElevation(dir, smooth), dir_name=dir_name)
 
 
+def _start(samples):
+    return max(0, int(samples.min()) // BLOCK * BLOCK - PAD)
+
+
+def _finish(samples):
+    return min(SAMPLES, (int(samples.max()) // BLOCK + 1) * BLOCK + PAD + 1)
+
+
 class SplineElevation(ElevationSupport):
+    '''
+    If smooth is non-zero the spline is smoothed (and fitted to the whole tile).
+    '''
 
-    def __init__(self, dir, smooth=0):
-        super().__init__(dir, make_cached_spline_builder(smooth))
+    def __init__(self, dir, smooth=0, max_splines=16):
+        super().__init__(dir)
+        self.__smooth = smooth
+        self.__max_splines = min(max_splines, MAX_TILE_SPLINES) if smooth else max_splines
+        self.__splines = OrderedDict()
 
     def elevation(self, lat, lon):
         if self._dir:
-            _, _, spline = self._lookup(lat, lon)
-            return spline([lat], [lon])[0][0]  # it's a grid for all x and y, hence 2d
+            return self.elevations(np.array([lat]), np.array([lon]))[0]
+        else:
+            return None
+
+    def elevations(self, lats, lons):
+        '''
+        As elevation, but for arrays of lats and lons, returning an array.
+        '''
+        if self._dir:
+            lats, lons = np.asarray(lats, dtype=float), np.asarray(lons, dtype=float)
+            result = np.empty(lats.shape)
+            for flat, flon, mask in self._by_tile(lats, lons):
+                rows, cols = (lats[mask] - flat) * (SAMPLES - 1), (lons[mask] - flon) * (SAMPLES - 1)
+                window = TILE if self.__smooth else (_start(rows), _finish(rows), _start(cols), _finish(cols))
+                result[mask] = self.__spline(flat, flon, window).ev(lats[mask], lons[mask])
+            return result
         else:
             return None
 
+    def __spline(self, flat, flon, window):
+        key = (flat, flon, window)
+        if key in self.__splines:
+            self.__splines.move_to_end(key)
+        else:
+            self.__splines[key] = self.__cached_spline(flat, flon, window)
+            while len(self.__splines) > self.__max_splines:
+                self.__splines.popitem(last=False)
+        return self.__splines[key]
 
-def make_cached_spline_builder(smooth):
+    def __cached_spline(self, flat, flon, window):
+        if window == TILE:
+            return self.__fit(flat, flon, window)
+        path = join(self._dir, SPLINE, '%s-%d-%d-%d-%d-%s.pkl' % ((tile_root(flat, flon),) + window + (self.__smooth,)))
+        if exists(path):
+            try:
+                with open(path, 'rb') as input:
+                    return load(input)
+            except Exception as e:
+                log.warning(f'Could not read {path}: {e}')
+        spline = self.__fit(flat, flon, window)
+        try:
+            makedirs(join(self._dir, SPLINE), exist_ok=True)
+            with atomic_write(path) as output:
+                dump(spline, output)
+        except OSError as e:
+            log.debug(f'Could not cache spline in {path}: {e}')
+        return spline
 
-    @lru_cache(4)  # 4 means our tests are quick (and should tile a local patch)
-    def cached_spline_builder(dir, flat, flon):
-        h = cached_file_reader(dir, flat, flon)
-        x, y = np.linspace(flat, flat+1, SAMPLES), np.linspace(flon, flon+1, SAMPLES)
+    def __fit(self, flat, flon, window):
+        r0, r1, c0, c1 = window
+        log.debug(f'Fitting spline to {tile_root(flat, flon)} {window}')
+        h = self._reader(self._dir, flat, flon)[r0:r1, c0:c1]
+        x, y = np.linspace(flat, flat+1, SAMPLES)[r0:r1], np.linspace(flon, flon+1, SAMPLES)[c0:c1]
         # not 100% sure on the scaling of s but it seems to be related to sum of errors at all points
         # however, a scaling of SAMPLES * SAMPLES means that smooth=1 gives a numerical error, so add 10
-        return RectBivariateSpline(x, y, h, s=smooth * SAMPLES * SAMPLES * 10)
-
-    return cached_spline_builder
+        return RectBivariateSpline(x, y, h, s=self.__smooth * SAMPLES * SAMPLES * 10)
@@ -0,0 +1,64 @@
+from random import random, seed
+
+import numpy as np
+
+from ch2.lib.dbscan import MatrixNeighbours, KDTreeNeighbours, RTreeNeighbours, dbscan, dbscan_many, groups, NOISE
+from ch2.rtree import CQRTree, CARTree
+from ch2.rtree.spherical import SQRTree, haversine
+from tests import LogTestCase
+
+
+def blobs(n, centres, scale=0.05):
+    return [(x + random() * scale, y + random() * scale) for x, y in centres for _ in range(n)]
+
+
+class TestDBSCAN(LogTestCase):
+
+    def test_matrix(self):
+        # 0-1-2 chain of close pairs, 3 attached to 2 only, 4 isolated
+        neighbours = MatrixNeighbours.from_pairs(5, [0, 1, 0, 2, 3], [1, 2, 2, 3, 4], [0.1, 0.1, 0.0, 0.2, 0.9])
+        labels = dbscan(neighbours, 0.5, 2)
+        self.assertEqual(labels.tolist(), [0, 0, 0, 0, NOISE])
+        self.assertEqual(groups(labels, ids=[10, 11, 12, 13, 14]), [[10, 11, 12, 13]])
+        self.assertEqual(dbscan(neighbours, 0.5, 3).tolist(), [0, 0, 0, 0, NOISE])  # 2 is core
+        self.assertEqual(dbscan(neighbours, 0.5, 4).tolist(), [NOISE] * 5)
+        self.assertEqual(dbscan(neighbours, 0.05, 1).tolist(), [0, NOISE, 0, NOISE, NOISE])
+
+    def test_indexes_agree(self):
+        seed(1)
+        points = blobs(30, [(0, 0), (1, 1), (0, 1)]) + [(random() * 2, random() * 2) for _ in range(20)]
+        indexes = [KDTreeNeighbours(points),
+                   RTreeNeighbours.from_points(CQRTree, points),
+                   RTreeNeighbours.from_points(CARTree, points)]
+        xy = np.array(points)
+        distances = np.hypot(*(xy[:, None, :] - xy[None, :, :]).transpose(2, 0, 1))
+        lo, hi = np.triu_indices(len(points), 1)
+        indexes.append(MatrixNeighbours.from_pairs(len(points), lo, hi, distances[lo, hi]))
+        for epsilon in (0.01, 0.05, 0.2):
+            expected = groups(dbscan(indexes[0], epsilon, 4))
+            for index in indexes[1:]:
+                self.assertEqual(groups(dbscan(index, epsilon, 4)), expected)
+        self.assertEqual(len(groups(dbscan(indexes[0], 0.05, 4), minpts=4)), 3)
+
+    def test_spherical(self):
+        seed(3)
+        points = blobs(30, [(-70.5, -33.5), (-70.45, -33.5)], scale=0.01)
+        lo, hi = np.triu_indices(len(points), 1)
+        distances = [haversine(*points[i], *points[j]) for i, j in zip(lo, hi)]
+        matrix = MatrixNeighbours.from_pairs(len(points), lo, hi, distances)
+        rtree = RTreeNeighbours.from_points(SQRTree, points)
+        for epsilon in (100, 300, 1000):
+            self.assertEqual(groups(dbscan(rtree, epsilon, 4)), groups(dbscan(matrix, epsilon, 4)))
+
+    def test_groups(self):
+        # equal sizes are ordered by smallest member, including point number 0
+        self.assertEqual(groups(np.array([1, 0, 0, 1, 2, NOISE])), [[0, 3], [1, 2], [4]])
+        self.assertEqual(groups(np.array([1, 0, 0, 1, 2, NOISE]), minpts=2), [[0, 3], [1, 2]])
+
+    def test_many(self):
+        seed(2)
+        neighbours = KDTreeNeighbours(blobs(50, [(0, 0), (0.2, 0), (1, 1)]))
+        epsilons = [0.005, 0.02, 0.1, 0.5]
+        for labels, epsilon in zip(dbscan_many(neighbours, epsilons, 3), epsilons):
+            self.assertEqual(labels.tolist(), dbscan(neighbours, epsilon, 3).tolist())
+        self.assertEqual(dbscan_many(neighbours, [], 3), [])
@@ -1,12 +1,23 @@
 from glob import glob
 from logging import getLogger
+from math import isnan
+from os import makedirs
 from os.path import basename, join, exists
+from tempfile import TemporaryDirectory
+
+from numpy import array_equal, diff
 
 from ch2.commands.args import FIELDS, TABLES, GREP
-from ch2.fit.format.read import filtered_records
+from ch2.fit.format.bulk import Run, OFFSET
+from ch2.fit.format.cache import ColumnCache
+from ch2.fit.format.crc import crc16, _bytewise, BLOCK, MIN_VECTOR
+from ch2.fit.format.read import filtered_records, columnar_records, parse_data, records_from_columns
 from ch2.fit.format.records import no_names, append_units, no_bad_values, fix_degrees, chain
+from ch2.fit.format.stream import stream_data, build_checkpoints, Checkpoints
+from ch2.fit.format.tokens import Defined, CompressedTimestamp
 from ch2.fit.profile.fields import DynamicField
-from ch2.fit.profile.profile import read_external_profile, read_fit
+from ch2.fit.profile.lazy import read_lazy_profile, write_lazy_profile
+from ch2.fit.profile.profile import read_external_profile, read_fit, read_profile
 from ch2.fit.summary import summarize, summarize_csv, summarize_tables
 from ch2.lib.tests import OutputMixin, HEX_ADDRESS, EXC_HDR_CHK, sub_extn, EXC_FLD, sub_dir, RNM_UNKNOWN, ROUND_DISTANCE
 from tests import LogTestCase
@@ -77,6 +88,186 @@ class TestFit(LogTestCase, OutputMixin):
                     print(record.into(tuple, filter=chain(no_names, append_units, no_bad_values, fix_degrees)),
                           file=output)
 
+    def test_bulk(self):
+        for dir in ('personal', 'sdk', 'other'):
+            for fit_file in glob(join(self.test_dir, 'source', dir, '*.fit')):
+                try:
+                    scalar = self.decode(fit_file, bulk=False)
+                except Exception as e:
+                    with self.assertRaises(type(e), msg=fit_file):
+                        self.decode(fit_file, bulk=True)
+                else:
+                    self.assertEqual(self.decode(fit_file, bulk=True), scalar, fit_file)
+
+    def test_bulk_compressed(self):
+        types, messages = read_profile(profile_path=self.profile_path)
+        data = read_fit(join(self.test_dir, 'source/personal/andrew@acooke.org_24755630065.fit'))
+        state, tokens = parse_data(data, types, messages, bulk=True)
+        compressed = 0
+        for offset, token in tokens:
+            if isinstance(token, CompressedTimestamp):
+                compressed += 1
+            if isinstance(token, Run):
+                self.assertFalse(any(data[offset + i * token.definition.size] & 0x80 for i in range(token.count)))
+        self.assertGreater(compressed, 0)
+
+    def test_compiled(self):
+        types, messages = read_profile(profile_path=self.profile_path)
+        for fit_file in glob(join(self.test_dir, 'source', 'personal', '*.fit')):
+            state, tokens = parse_data(read_fit(fit_file), types, messages)
+            for offset, token in tokens:
+                if isinstance(token, Defined):
+                    profile = token.definition.message.parse_message(token.data, token.definition, token.timestamp,
+                                                                      accumulators=token._accumulators)
+                    self.assertEqual(list(token.parse_token().data), list(profile.data), fit_file)
+
+    def test_selected(self):
+        record_names, field_names = {'record', 'event', 'sport'}, {'timestamp', 'event', 'sport', 'heart_rate',
+                                                                   'position_lat', 'enhanced_speed', 'distance'}
+        for dir in ('personal', 'sdk'):
+            for fit_file in glob(join(self.test_dir, 'source', dir, '*.fit')):
+                data = read_fit(fit_file)
+                for bulk in (True, False):
+                    _, _, all = filtered_records(data, field_names=field_names, bulk=bulk,
+                                                 profile_path=self.profile_path)
+                    _, _, selected = filtered_records(data, record_names=record_names, field_names=field_names,
+                                                      bulk=bulk, profile_path=self.profile_path)
+                    self.assertEqual([(record.name, record.timestamp, record.data)
+                                      for _, _, record in all if record.name in record_names],
+                                     [(record.name, record.timestamp, record.data)
+                                      for _, _, record in selected], fit_file)
+
+    def test_columnar(self):
+        data = read_fit(join(self.test_dir, 'source/personal/2018-08-27-rec.fit'))
+        columns = columnar_records(data, record_names=['record'], profile_path=self.profile_path)
+        self.assertEqual(list(columns.keys()), ['record'])
+        columns = columns['record']
+        types, messages, records = filtered_records(data, record_names=['record'], profile_path=self.profile_path,
+                                                    pipeline=[fix_degrees])
+        records = [record for _, _, record in records]
+        self.assertEqual(len(columns['timestamp'][0]), len(records))
+        self.assertEqual(columns['position_lat'][1], '°')
+        for name in ('position_lat', 'position_long', 'distance', 'heart_rate', 'cadence', 'enhanced_speed'):
+            values, units = columns[name]
+            for value, record in zip(values, records):
+                expected = record.data[name][0]
+                if expected is None:
+                    self.assertTrue(isnan(value), name)
+                else:
+                    self.assertAlmostEqual(value, expected[0], msg=name)
+        for value, record in zip(columns['timestamp'][0], records):
+            self.assertEqual(value, record.timestamp.timestamp())
+        self.assertTrue((diff(columns[OFFSET][0]) > 0).all())
+
+    def test_cache(self):
+        path = join(self.test_dir, 'source/personal/2018-08-27-rec.fit')
+        with TemporaryDirectory() as dir:
+            makedirs(join(dir, 'old-profile'))
+            cache = ColumnCache(dir, profile_path=self.profile_path)
+            self.assertFalse(exists(join(dir, 'old-profile')))
+            self.assertIsNone(cache.read('abc'))
+            parsed = cache.columnar_records(path, hash='abc', record_names=['record'])
+            cached = cache.columnar_records(path, hash='abc', record_names=['record'])
+            self.assertEqual(list(parsed['record'].keys()), list(cached['record'].keys()))
+            for name, (values, units) in parsed['record'].items():
+                self.assertEqual(units, cached['record'][name][1])
+                self.assertTrue(array_equal(values, cached['record'][name][0], equal_nan=values.dtype != object))
+            self.assertIn('event', cache.read('abc'))
+
+    def test_cache_hit(self):
+        path = join(self.test_dir, 'source/personal/2018-08-27-rec.fit')
+        with TemporaryDirectory() as dir:
+            cache = ColumnCache(dir, profile_path=self.profile_path)
+            parsed = cache.columnar_records(path, hash='abc', record_names=['record'])
+            # a second cache (as in a new worker) does not evict, and does not read the (missing) file
+            cache = ColumnCache(dir, profile_path=self.profile_path, evict=False)
+            cached = cache.columnar_records(join(dir, 'missing.fit'), hash='abc', record_names=['record'])
+            self.assertEqual(list(parsed['record'].keys()), list(cached['record'].keys()))
+
+    def test_records_from_columns(self):
+        record_names = {'event', 'record', 'sport'}
+        field_names = {'event', 'event_type', 'sport', 'timestamp', 'heart_rate', 'position_lat', 'distance'}
+        data = read_fit(join(self.test_dir, 'source/personal/2018-08-27-rec.fit'))
+        _, _, records = filtered_records(data, record_names=record_names, field_names=field_names, bulk=True,
+                                         profile_path=self.profile_path)
+        # a stable sort, so records with equal timestamps stay in file order
+        expected = sorted((record.as_dict(fix_degrees, no_bad_values) for _, _, record in records),
+                          key=lambda record: record.timestamp)
+        columns = columnar_records(data, profile_path=self.profile_path)
+        rebuilt = records_from_columns(columns, fix_degrees, no_bad_values, record_names=record_names)
+        self.assertEqual([(record.name, record.timestamp) for record in rebuilt],
+                         [(record.name, record.timestamp) for record in expected])
+        for record, target in zip(rebuilt, expected):
+            for name in ('event', 'event_type', 'sport'):
+                self.assertEqual(record.data.get(name), target.data.get(name), name)
+            for name in ('heart_rate', 'position_lat', 'distance'):
+                self.assertEqual(name in record.data, name in target.data, name)
+                if name in target.data:
+                    self.assertAlmostEqual(record.data[name][0][0], target.data[name][0][0], msg=name)
+
+    def test_lazy_profile(self):
+        nlog, types, messages = read_external_profile(self.profile_path)
+        with TemporaryDirectory() as dir:
+            path = join(dir, 'profile')
+            write_lazy_profile(path, nlog, types, messages)
+            lazy_types, lazy_messages = read_lazy_profile(path, nlog)
+            self.assertEqual(lazy_types.profile_to_type('carry_exercise_name').profile_to_internal('farmers_walk'), 1)
+            self.assertIs(lazy_messages.number_to_message(20).profile_to_field('timestamp').type,
+                          lazy_types.profile_to_type('date_time'))
+            self.assertEqual(lazy_messages.number_to_message(0xff00).name, 'MESSAGE 65280')
+            self.assertIsInstance(lazy_types.base_types, type(types.base_types))
+            self.assertEqual([type.name for type in lazy_types.base_types], [type.name for type in types.base_types])
+            with self.assertRaises(KeyError):
+                lazy_types.profile_to_type('int16')
+            self.assertEqual(lazy_types.profile_to_type('int16', auto_create=True).name, 'int16')
+            self.assertTrue(lazy_types.is_type('int16'))
+            for fit_file in glob(join(self.test_dir, 'source', 'personal', '*.fit')):
+                data = read_fit(fit_file)
+                for (_, expected), (_, token) in zip(parse_data(data, types, messages)[1],
+                                                     parse_data(data, lazy_types, lazy_messages)[1]):
+                    self.assertEqual(list(token.parse_token().data), list(expected.parse_token().data))
+
+    def test_crc(self):
+        self.assertEqual(crc16(b'123456789'), 0xbb3d)  # standard check value for CRC-16/ARC
+        data = read_fit(join(self.test_dir, 'source/personal/2018-08-27-rec.fit'))
+        self.assertGreater(len(data), 10 * BLOCK)
+        expected = _bytewise(data, 0)
+        self.assertEqual(crc16(data), expected)
+        self.assertEqual(crc16(memoryview(data)[1000:], crc16(data[:1000])), expected)
+        data = data + data  # long enough for the vector path
+        for n in (MIN_VECTOR - 1, MIN_VECTOR, MIN_VECTOR + 1, len(data)):
+            self.assertEqual(crc16(data[:n]), _bytewise(data[:n], 0), n)
+
+    def test_stream(self):
+        path = join(self.test_dir, 'source/personal/2018-08-27-rec.fit')
+        data = read_fit(path)
+        types, messages = read_profile(profile_path=self.profile_path)
+        expected = [(offset, str(token)) for offset, token in parse_data(data, types, messages)[1]]
+        with open(path, 'rb') as input:
+            streamed = [(offset, str(token)) for _, offset, token in stream_data(input, types, messages)[1]]
+        self.assertEqual(streamed, expected)
+        with TemporaryDirectory() as dir:
+            with open(path, 'rb') as input:
+                build_checkpoints(input, types, messages, every=len(data) // 10).save(join(dir, 'ckpt'))
+            checkpoints = Checkpoints.load(join(dir, 'ckpt'))
+        self.assertGreater(len(checkpoints.checkpoints), 5)
+        after_bytes = len(data) * 2 // 3
+        self.assertGreater(checkpoints.before(after_bytes).offset, 0)
+        records = filtered_records(data, after_bytes=after_bytes, profile_path=self.profile_path)[2]
+        with open(path, 'rb') as input:
+            resumed = filtered_records(input, after_bytes=after_bytes, profile_path=self.profile_path,
+                                       checkpoints=checkpoints)[2]
+            self.assertEqual([(i, offset, repr(record)) for i, offset, record in resumed],
+                             [(i, offset, repr(record)) for i, offset, record in records])
+        with self.assertRaises(Exception):
+            filtered_records(data, after_bytes=after_bytes, profile_path=self.profile_path, bulk=True)
+
+    def decode(self, fit_file, **kargs):
+        types, messages, records = filtered_records(read_fit(fit_file), profile_path=self.profile_path,
+                                                    internal=True, **kargs)
+        return [repr((i, offset, record.name, record.timestamp, list(record.data.items())))
+                for i, offset, record in records]
+
     def standard_csv(self, fit_path, csv_path, filters=None):
         if filters is None: filters = []
         if EXC_HDR_CHK not in filters: filters = [EXC_HDR_CHK] + filters
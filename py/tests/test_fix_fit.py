@@ -1,6 +1,9 @@
-from os.path import join
+from json import load
+from os.path import join, basename
+from tempfile import TemporaryDirectory
 
 from ch2.commands.args import RECORDS
+from ch2.fit.batch import batch_fix, GOOD, FIXED, BAD
 from ch2.fit.fix import fix
 from ch2.fit.format.tokens import FileHeader
 from ch2.fit.profile.profile import read_fit
@@ -123,3 +126,22 @@ class TestFixFit(LogTestCase, OutputMixin):
     def test_drop_bug(self):
         bad = read_fit(join(self.test_dir, 'source/personal/2018-07-26-rec.fit'))
         fix(bad, drop=True, fix_checksum=True, fix_header=True, max_delta_t=60, max_fwd_len=500)
+
+    def test_batch(self):
+        paths = [join(self.test_dir, 'source/personal/2018-08-27-rec.fit'),
+                 join(self.test_dir, 'source/other/8CS90646.FIT'),
+                 join(self.test_dir, 'source/other/8CS90646.FIT')]
+        with TemporaryDirectory() as dir:
+            report = join(dir, 'report.json')
+            entries = batch_fix(paths, jobs=2, output_dir=join(dir, 'fixed'), report=report,
+                                drop=True, fix_checksum=True, fix_header=True)
+            self.assertEqual([entry['status'] for entry in entries], [GOOD, FIXED, FIXED])
+            self.assertEqual(read_fit(entries[1]['output_path']),
+                             fix(read_fit(paths[1]), drop=True, fix_checksum=True, fix_header=True))
+            self.assertEqual([basename(entry['output_path']) for entry in entries],
+                             ['2018-08-27-rec.fit', '8CS90646.FIT', '8CS90646-1.FIT'])
+            self.assertEqual(read_fit(entries[2]['output_path']), read_fit(entries[1]['output_path']))
+            with open(report) as input:
+                self.assertEqual(load(input)['counts'], {GOOD: 1, FIXED: 2, BAD: 0})
+            entries = batch_fix(paths[1:2], slices=':1000', fix_checksum=True, fix_header=True)
+            self.assertEqual(entries[0]['status'], BAD)
@@ -0,0 +1,30 @@
+from struct import pack
+
+import numpy as np
+
+from ch2.pipeline.calculate.nearby import decode_points, grid_overlaps
+from tests import LogTestCase
+
+
+class TestNearby(LogTestCase):
+
+    def test_decode_points(self):
+        multi = pack('<BII', 1, 4, 3) + b''.join(pack('<BIdd', 1, 1, x, y) for x, y in ((1, 2), (3, 4), (5, 6)))
+        self.assertEqual(decode_points(memoryview(multi)).tolist(), [[1, 2], [3, 4], [5, 6]])
+        self.assertEqual(decode_points(pack('>BIdd', 0, 1, 7, 8)).tolist(), [[7, 8]])
+        self.assertEqual(decode_points(pack('<BII', 1, 4, 0)).shape, (0, 2))
+        with self.assertRaises(Exception):
+            decode_points(pack('<BII', 1, 2, 0))
+
+    def test_grid_overlaps(self):
+        # points about 100m apart along a meridian; b follows the first half of a, c is far away
+        lats = np.linspace(-33, -33.01, 12)
+        a = np.stack([np.full(12, -70.0), lats], axis=1)
+        b = np.stack([np.full(6, -70.0005), lats[:6]], axis=1)
+        c = a + 1
+        ids = np.array([1] * 12 + [2] * 6 + [3] * 12)
+        first, second, count = grid_overlaps(ids, np.concatenate([a, b, c]), 150)
+        overlaps = dict(((x, y), n) for x, y, n in zip(first.tolist(), second.tolist(), count.tolist()))
+        self.assertEqual(sorted(overlaps), [(1, 2), (2, 1)])
+        self.assertEqual(overlaps[2, 1], 6)  # all of b is on a
+        self.assertTrue(6 <= overlaps[1, 2] <= 9)  # about half of a is on b (cells are coarse)
@@ -0,0 +1,211 @@
+from math import hypot
+from random import random, seed
+
+from ch2.rtree import CQRTree, CARTree, HashGrid, MatchType
+from ch2.rtree.grid import SHashGrid
+from ch2.rtree.spherical import SQRTree, SARTree, LocalTangent, haversine, RADIUS, RADIAN
+from tests import LogTestCase
+
+
+def random_items(n, x0=0, y0=0, scale=1):
+    return [([(x0 + random() * scale, y0 + random() * scale)], i) for i in range(n)]
+
+
+class TreeTests:
+    '''
+    Run against both the list (BaseTree) and array (ArrayTree) implementations.
+    '''
+
+    cartesian = None
+    spherical = None
+
+    def test_bulk_load(self):
+        seed(1)
+        for n in (0, 1, 3, 4, 7, 10, 100, 1000):
+            items = random_items(n)
+            added, loaded = self.cartesian(items), self.cartesian()
+            loaded.bulk_load(items)
+            loaded.assert_consistent()
+            self.assertEqual(added, loaded)
+            self.assertEqual(len(loaded), n)
+            for points, value in items[:50]:
+                self.assertEqual(sorted(added.get(points, match=MatchType.OVERLAP, border=0.1)),
+                                 sorted(loaded.get(points, match=MatchType.OVERLAP, border=0.1)))
+
+    def test_bulk_load_then_modify(self):
+        seed(2)
+        items = random_items(500)
+        tree = self.cartesian()
+        tree.bulk_load(items[:300])
+        tree.add_all(items[300:400])
+        tree.bulk_load(items[400:])
+        tree.assert_consistent()
+        self.assertEqual(tree, self.cartesian(items))
+        for points, value in items[::2]:
+            self.assertEqual(tree.delete(points, value=value), 1)
+            tree.assert_consistent()
+        self.assertEqual(tree, self.cartesian(items[1::2]))
+
+    def test_bulk_load_spherical(self):
+        seed(3)
+        items = random_items(1000, -70.5, -33.5, 0.1)
+        added = self.spherical(items, default_match=MatchType.OVERLAP, default_border=150)
+        loaded = self.spherical(default_match=MatchType.OVERLAP, default_border=150)
+        loaded.bulk_load(items)
+        loaded.assert_consistent()
+        self.assertLessEqual(loaded.height, added.height)
+        for points, value in items[:100]:
+            self.assertEqual(sorted(added.get(points)), sorted(loaded.get(points)))
+
+    def test_match(self):
+        tree = self.cartesian()
+        tree.add([(0, 0), (2, 2)], 'big')
+        tree.add([(1, 1)], 'point')
+        tree.add([(5, 5), (6, 6)], 'far')
+        self.assertEqual(list(tree.get([(0, 0), (2, 2)])), ['big'])
+        self.assertEqual(sorted(tree.get([(1, 1)], match=MatchType.CONTAINED)), ['big', 'point'])
+        self.assertEqual(sorted(tree.get([(-1, -1), (3, 3)], match=MatchType.CONTAINS)), ['big', 'point'])
+        self.assertEqual(sorted(tree.get([(1.5, 1.5), (5.5, 5.5)], match=MatchType.OVERLAP)), ['big', 'far'])
+        self.assertEqual(list(tree.get([(1, 1)], value='big', match=MatchType.CONTAINED)), ['big'])
+        self.assertTrue([(5, 5), (6, 6)] in tree)
+        self.assertFalse([(5, 5)] in tree)
+        self.assertEqual(tree.delete([(0, 0), (3, 3)], match=MatchType.CONTAINS), 2)
+        self.assertEqual(list(tree.values()), ['far'])
+        with self.assertRaises(KeyError):
+            tree.delete_one([(0, 0), (2, 2)])
+
+    def test_random_operations(self):
+        seed(4)
+        tree, reference = self.cartesian(max_entries=4), {}
+        for i in range(2000):
+            if reference and random() < 0.4:
+                key = list(reference)[int(random() * len(reference))]
+                tree.delete_one([key], value=reference.pop(key))
+            else:
+                key = (random(), random())
+                tree.add([key], i)
+                reference[key] = i
+            if i % 100 == 0:
+                tree.assert_consistent()
+        tree.assert_consistent()
+        self.assertEqual(sorted(tree.values()), sorted(reference.values()))
+        for key, value in reference.items():
+            self.assertEqual(list(tree.get([key])), [value])
+
+    def test_get_items_many(self):
+        seed(5)
+        for tree, x0, y0, scale, border in ((self.cartesian(), 0, 0, 1, 0.01),
+                                            (self.spherical(), -70.5, -33.5, 0.1, 150)):
+            items = random_items(2000, x0, y0, scale)
+            items.append(([(x0, y0), (x0 + scale, y0 + scale)], 'big'))
+            tree.bulk_load(items)
+            probes = [points[0] for points, value in items[:100]] + \
+                     [points[0] for points, value in random_items(100, x0, y0, scale)]
+            for match in MatchType:
+                extra = 0 if match == MatchType.EQUALS else border
+                for value in (None, 'big'):
+                    expected = sorted((i, item) for i, probe in enumerate(probes)
+                                      for item in tree.get_items([probe], value=value, match=match, border=extra))
+                    self.assertEqual(sorted(tree.get_items_many(probes, value=value, match=match, border=extra)),
+                                     expected)
+                    self.assertTrue(expected or value)
+        self.assertEqual(list(tree.get_items_many([])), [])
+
+    def test_nearest(self):
+        seed(6)
+        items = random_items(1000)
+        tree = self.cartesian(items)
+        for x, y in ((0.5, 0.5), (-1, 2), (0.01, 0.99)):
+            distances = sorted((hypot(x - px, y - py), value) for [(px, py)], value in items)
+            self.assertEqual([(d, value) for d, (points, value) in tree.nearest((x, y), k=10)], distances[:10])
+            self.assertEqual([(d, value) for d, (points, value) in tree.within((x, y), 0.1)],
+                             [(d, value) for d, value in distances if d <= 0.1])
+        self.assertEqual([value for d, (points, value) in tree.nearest((0.5, 0.5), k=3, value=7)], [7])
+        self.assertEqual(list(self.cartesian().nearest((0, 0))), [])
+
+    def test_nearest_spherical(self):
+        seed(7)
+        for x0, y0 in ((-70.5, -33.5), (10, 60), (179.9, 0)):
+            items = random_items(1000, x0, y0, 0.2)
+            tree = self.spherical(items)
+            lon, lat = x0 + 0.1, y0 + 0.1
+            distances = sorted((haversine(lon, lat, px, py), value) for [(px, py)], value in items)
+            found = [(d, value) for d, (points, value) in tree.nearest((lon, lat), k=20)]
+            self.assertEqual([value for d, value in found], [value for d, value in distances[:20]])
+            for (d1, _), (d2, _) in zip(found, distances):
+                self.assertAlmostEqual(d1, d2, places=3)
+            self.assertEqual(sorted(value for d, (points, value) in tree.within((lon, lat), 1000)),
+                             sorted(value for d, value in distances if d <= 1000))
+
+
+class TestListTree(TreeTests, LogTestCase):
+
+    cartesian = CQRTree
+    spherical = SQRTree
+
+
+class TestArrayTree(TreeTests, LogTestCase):
+
+    cartesian = CARTree
+    spherical = SARTree
+
+
+class TestHashGrid(LogTestCase):
+
+    def test_against_trees(self):
+        seed(8)
+        for tree_cls, grid_cls, x0, y0, scale, border in ((CQRTree, HashGrid, 0, 0, 1, 0.01),
+                                                          (SQRTree, SHashGrid, -70.5, -33.5, 0.1, 150)):
+            items = random_items(2000, x0, y0, scale)
+            tree = tree_cls(default_match=MatchType.OVERLAP, default_border=border)
+            grid = grid_cls(default_match=MatchType.OVERLAP, default_border=border)
+            tree.bulk_load(items[:1000])
+            grid.bulk_load(items[:1000])
+            for points, value in items[1000:]:
+                tree[points] = value
+                grid[points] = value
+            self.assertEqual(len(grid), 2000)
+            probes = [points[0] for points, value in random_items(200, x0, y0, scale)]
+            for extra in (None, 0, 3 * border):
+                found = sorted((i, value) for i, (_, value) in grid.get_items_many(probes, border=extra))
+                self.assertEqual(found, sorted((i, value) for i, (_, value) in
+                                               tree.get_items_many(probes, border=extra)))
+                self.assertTrue(found)
+            self.assertEqual(sorted(grid.get(items[0][0], value=0)), [0])
+            self.assertEqual(grid.delete(items[0][0], value=0, match=MatchType.EQUALS), 1)
+            self.assertEqual(list(grid.get(items[0][0], value=0)), [])
+            self.assertEqual(len(grid), 1999)
+            self.assertEqual(sorted(grid.values()), list(range(1, 2000)))
+
+    def test_errors(self):
+        with self.assertRaises(Exception):
+            HashGrid()
+        grid = HashGrid(cell=1)
+        with self.assertRaises(Exception):
+            grid.add([(0, 0), (1, 1)], 'line')
+        grid.add([(0, 0)], 'point')
+        with self.assertRaises(Exception):
+            list(grid.get([(0, 0)], match=MatchType.CONTAINS))
+        self.assertEqual(list(grid.get([(0, 0)])), ['point'])
+        self.assertFalse([(0.5, 0.5)] in grid)
+        with self.assertRaises(KeyError):
+            grid.delete_one([(0.5, 0.5)])
+
+
+class TestLocalTangent(LogTestCase):
+
+    def test_projection(self):
+        # east-west distances scale with the cosine of the origin's latitude (in radians; cos(60 deg) = 0.5)
+        tangent = LocalTangent((10, 60))
+        x, y = tangent.normalize((11, 61))
+        self.assertAlmostEqual(x, 0.5 * RADIUS * RADIAN, places=3)
+        self.assertAlmostEqual(y, RADIUS * RADIAN, places=3)
+        (xm, ym), = tangent.normalize_many([(11, 61)]).tolist()
+        self.assertAlmostEqual(xm, x, places=6)
+        self.assertAlmostEqual(ym, y, places=6)
+        lon, lat = tangent.denormalize((x, y))
+        self.assertAlmostEqual(lon, 11, places=9)
+        self.assertAlmostEqual(lat, 61, places=9)
+        # and agree with the great-circle distance nearby
+        x, y = tangent.normalize((10.01, 60))
+        self.assertAlmostEqual(x, haversine(10, 60, 10.01, 60), delta=0.01)
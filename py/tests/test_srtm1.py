@@ -1,14 +1,23 @@
 
 from contextlib import contextmanager
 from logging import getLogger
+from os import listdir
+from os.path import join, exists, getmtime
+from tempfile import TemporaryDirectory
+
+import numpy as np
+from scipy.interpolate import RectBivariateSpline
 
 from ch2 import constants
 from ch2.commands.args import V, DEV, FORCE, bootstrap_db
 from ch2.common.args import mm, m
+from ch2.common.io import file_hash
 from ch2.config.profiles.default import default
-from ch2.srtm.bilinear import bilinear_elevation_from_constant
-from ch2.srtm.file import SRTM1_DIR_CNAME
-from ch2.srtm.spline import spline_elevation_from_constant
+from ch2.fit.format.cache import ColumnCache
+from ch2.srtm.bilinear import bilinear_elevation_from_constant, BilinearElevation
+from ch2.srtm.file import SRTM1_DIR_CNAME, SAMPLES, TileStore, read_hgt
+from ch2.srtm.prewarm import prewarm, tiles_for_box, tiles_for_points, fit_file_points, prewarm_fit_files
+from ch2.srtm.spline import spline_elevation_from_constant, SplineElevation, SPLINE
 from tests import LogTestCase, random_test_user
 
 log = getLogger(__name__)
@@ -45,6 +54,72 @@ class TestSortem(LogTestCase):
             elevation = oracle.elevation(-33.4489, -70.6693)
             self.assertAlmostEqual(elevation, 545.1531644129972, places=9)
 
+    def test_vector(self):
+        with self.bilinear() as oracle:
+            # a grid that crosses the corner of four tiles
+            lats, lons = np.meshgrid(np.linspace(-34.1, -33.9, 21), np.linspace(-71.1, -70.9, 21))
+            elevations = oracle.elevations(lats, lons)
+            self.assertEqual(elevations.shape, lats.shape)
+            for lat, lon, elevation in zip(lats.ravel(), lons.ravel(), elevations.ravel()):
+                self.assertAlmostEqual(elevation, oracle.elevation(lat, lon), places=9)
+
+    def test_tile_store(self):
+        with TemporaryDirectory() as dir:
+            heights = np.arange(SAMPLES * SAMPLES, dtype='>i2').reshape((SAMPLES, SAMPLES))
+            heights.tofile(join(dir, 'S34W071.hgt'))
+            store = TileStore(max_tiles=1)
+            tile = store(dir, -34, -71)
+            self.assertTrue(exists(join(dir, 'S34W071.npy')))
+            self.assertIsInstance(tile, np.memmap)
+            self.assertEqual(tile.dtype, np.int16)
+            self.assertTrue(np.array_equal(tile, np.flip(heights, 0)))
+            self.assertTrue(np.array_equal(tile, read_hgt(dir, -34, -71)))
+            self.assertIs(store(dir, -34, -71), tile)
+            with self.assertRaisesRegex(Exception, 'Missing S35W071.hgt'):
+                store(dir, -35, -71)
+
+    def test_spline_cache(self):
+        with TemporaryDirectory() as dir:
+            rows, cols = np.meshgrid(np.arange(SAMPLES), np.arange(SAMPLES), indexing='ij')
+            heights = (1000 + 100 * np.sin(rows / 50) * np.cos(cols / 70)).astype('>i2')
+            heights.tofile(join(dir, 'S34W071.hgt'))
+            lats, lons = np.meshgrid(np.linspace(-33.9, -33.8, 11), np.linspace(-70.9, -70.8, 11))
+            fresh = SplineElevation(dir).elevations(lats, lons)
+            self.assertTrue(listdir(join(dir, SPLINE)))
+            cached = SplineElevation(dir).elevations(lats, lons)  # new instance, so read from disk
+            self.assertTrue(np.array_equal(fresh, cached))
+            full = RectBivariateSpline(np.linspace(-34, -33, SAMPLES), np.linspace(-71, -70, SAMPLES),
+                                       read_hgt(dir, -34, -71), s=0)
+            self.assertTrue(np.allclose(fresh, full.ev(lats, lons)))
+
+    def test_prewarm(self):
+        self.assertEqual(list(tiles_for_box(-33.5, -70.5, -34.5, -71.5)),
+                         [(-35, -72), (-35, -71), (-34, -72), (-34, -71)])
+        self.assertEqual(tiles_for_points([(-33.5, -70.5)], margin=0.6), list(tiles_for_box(-33, -70, -35, -72)))
+        with TemporaryDirectory() as dir:
+            np.zeros((SAMPLES, SAMPLES), dtype='>i2').tofile(join(dir, 'S34W071.hgt'))
+            present, missing = prewarm(dir, [(-34, -71), (-35, -71)], jobs=2)
+            self.assertEqual(present, [(-34, -71)])
+            self.assertEqual(missing, [(-35, -71)])
+            self.assertTrue(exists(join(dir, 'S34W071.npy')))
+            modified = getmtime(join(dir, 'S34W071.npy'))
+            prewarm(dir, [(-34, -71)], jobs=2)  # already converted, so nothing to do
+            self.assertEqual(getmtime(join(dir, 'S34W071.npy')), modified)
+        points = fit_file_points('data/test/source/personal/2018-08-27-rec.fit')
+        self.assertTrue(points)
+        self.assertIn((-34, -71), tiles_for_points(points, margin=0))
+        self.assertEqual(fit_file_points('data/test/source/missing.fit'), [])
+
+    def test_prewarm_fit_files(self):
+        path = 'data/test/source/personal/2018-08-27-rec.fit'
+        with TemporaryDirectory() as dir, TemporaryDirectory() as cache_dir:
+            np.zeros((SAMPLES, SAMPLES), dtype='>i2').tofile(join(dir, 'S34W071.hgt'))
+            cache = ColumnCache(cache_dir)
+            prewarm_fit_files(BilinearElevation(dir), [path, path], cache=cache, jobs=2)
+            self.assertTrue(exists(join(dir, 'S34W071.npy')))
+            # the file was read through the cache, so importing it will not parse it again
+            self.assertIsNotNone(cache.read(file_hash(path)))
+
     def assert_contours(self, oracle, lat, lon, n, map, scale=1, step=1.):
         image = ''
         for i in range(n):